@@ -0,0 +1,452 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from datetime import datetime
+
+"""
+End-to-end benchmark for the daily pipeline.
+
+The MLB Stats API is replaced by a fake that serves synthetic slates with a configurable
+injected latency, and the games table by either a local Postgres database or a stand-in
+connection that only counts statements. For every slate size, prepare_games and
+update_games are run end to end and the wall time, p50/p95 per-game latency, API calls
+per game and DB statements per game are reported.
+
+Usage:
+    python benchmarks/benchmark_pipeline.py
+    python benchmarks/benchmark_pipeline.py --slates 1 15 100 --api-latency-ms 80
+    python benchmarks/benchmark_pipeline.py --psql "dbname=mlb_bench"
+    python benchmarks/benchmark_pipeline.py --save-baseline benchmarks/baseline.json
+    python benchmarks/benchmark_pipeline.py --baseline benchmarks/baseline.json
+"""
+
+SRC_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+BENCHMARK_TABLE_NAME = "benchmark_games"
+GAME_DATE = "2023-08-25"
+
+# The pipeline reads its configuration when it is imported, so it has to be set first
+os.environ.setdefault("MLB_DB_TABLE_NAME", BENCHMARK_TABLE_NAME)
+os.environ["MLB_API_MODE"] = "live"
+os.environ["MLB_RUN_DATE"] = "08/25/2023"
+os.environ["MLB_PLAYER_ID_CACHE_PATH"] = os.path.join(
+    tempfile.mkdtemp(), "player_ids.json"
+)
+sys.path.insert(0, SRC_PATH)
+
+import function
+import pitchers
+import stats_api
+import teams
+
+from migrations import MIGRATIONS
+
+TEAMS = [
+    {
+        "id": 108 + i,
+        "name": f"Team {i}",
+        "teamName": f"Club {i}",
+        "abbreviation": f"T{i}",
+    }
+    for i in range(30)
+]
+
+
+class FakeStatsAPI:
+    """
+    Serves synthetic responses in place of the MLB Stats API
+    """
+
+    def __init__(self, games: int, latency: float):
+        """
+        :param games: the number of games on the slate
+        :param latency: how long each request takes, in seconds
+        """
+        self.games = games
+        self.latency = latency
+        self.calls = 0
+        self.lock = threading.Lock()
+        self.served_at = {}
+
+    def pitcher_id(self, game: int, side: str) -> int:
+        return 600000 + game * 2 + (0 if side == "home" else 1)
+
+    def schedule(self, params: dict) -> dict:
+        # Games before the run date (update_games' yesterday) are over; the run date's (prepare_games') are yet to start
+        game_date = datetime.strptime(params["date"], "%m/%d/%Y").strftime("%Y-%m-%d")
+        final = game_date < GAME_DATE
+        games = []
+        for i in range(self.games):
+            home, away = TEAMS[(2 * i) % 30], TEAMS[(2 * i + 1) % 30]
+            games.append(
+                {
+                    "gamePk": 700000 + i,
+                    "gameDate": f"{game_date}T23:05:00Z",
+                    "gameType": "R",
+                    "status": {"detailedState": "Final" if final else "Scheduled"},
+                    "teams": {
+                        side: {
+                            "team": {"id": team["id"], "name": team["name"]},
+                            "isWinner": final and side == "home",
+                            "probablePitcher": {
+                                "id": self.pitcher_id(i, side),
+                                "fullName": f"Pitcher {self.pitcher_id(i, side)}",
+                            },
+                        }
+                        for side, team in (("home", home), ("away", away))
+                    },
+                }
+            )
+        return {
+            "totalItems": len(games),
+            "dates": [{"date": game_date, "games": games}],
+        }
+
+    def person(self, params: dict) -> dict:
+        person_id = int(params["personId"])
+        with self.lock:
+            self.served_at[person_id] = time.time()
+        return {
+            "people": [
+                {
+                    "id": person_id,
+                    "stats": [{"splits": [{"stat": self.season_stats()}]}],
+                }
+            ]
+        }
+
+    def stats(self, params: dict) -> dict:
+        pitcher_ids = [
+            self.pitcher_id(i, side)
+            for i in range(self.games)
+            for side in ("home", "away")
+        ]
+        with self.lock:
+            for pitcher_id in pitcher_ids:
+                self.served_at[pitcher_id] = time.time()
+        return {
+            "stats": [
+                {
+                    "totalSplits": len(pitcher_ids),
+                    "splits": [
+                        {"player": {"id": pitcher_id}, "stat": self.season_stats()}
+                        for pitcher_id in pitcher_ids
+                    ],
+                }
+            ]
+        }
+
+    def season_stats(self) -> dict:
+        return {
+            "era": "3.45",
+            "winPercentage": ".600",
+            "wins": 6,
+            "losses": 4,
+            "inningsPitched": "80.1",
+            "strikeoutsPer9Inn": "9.10",
+            "walksPer9Inn": "2.80",
+            "strikeOuts": 81,
+            "battersFaced": 330,
+            "baseOnBalls": 25,
+            "whip": "1.15",
+            "hits": 67,
+            "homeRuns": 9,
+            "atBats": 300,
+            "sacFlies": 3,
+        }
+
+    def __call__(self, endpoint: str, params: dict) -> dict:
+        with self.lock:
+            self.calls += 1
+        time.sleep(self.latency)
+
+        if endpoint == "schedule":
+            return self.schedule(params)
+        if endpoint == "person":
+            return self.person(params)
+        if endpoint == "stats":
+            return self.stats(params)
+        if endpoint == "teams":
+            return {"teams": TEAMS}
+        if endpoint == "sports_players":
+            return {"people": []}
+        raise ValueError(f"Unexpected endpoint {endpoint}")
+
+
+class CountingCursor:
+    """
+    A cursor for the stand-in connection that counts statements instead of running them
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.rowcount = 0
+        self.results = []
+
+    def execute(self, sql, params=None):
+        self.connection.statements += 1
+        time.sleep(self.connection.latency)
+        self.results = []
+        # The schema is taken as migrated, as it is on every run after the first
+        if str(sql).startswith("SELECT version FROM"):
+            self.results = [(version,) for version, _, _ in MIGRATIONS]
+
+    def fetchall(self):
+        return self.results
+
+    def mogrify(self, template, args):
+        return repr(args).encode()
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class CountingConnection:
+    """
+    A stand-in for the database connection that counts round trips
+    """
+
+    def __init__(self, latency: float):
+        """
+        :param latency: how long each round trip takes, in seconds
+        """
+        self.latency = latency
+        self.statements = 0
+        self.closed = 0
+        self.encoding = "UTF8"
+
+    def cursor(self):
+        return CountingCursor(self)
+
+    def commit(self):
+        self.statements += 1
+        time.sleep(self.latency)
+
+    def rollback(self):
+        self.statements += 1
+
+
+def connect_postgres(connection_string: str):
+    """
+    Connects to a local Postgres database, counting every statement, and creates an empty benchmark table with the migrations
+
+    :param connection_string: the connection string of the database
+    :returns: the connection
+    """
+    import psycopg2
+    import psycopg2.extensions
+
+    from migrations import ensure_partitions, migrate
+
+    class PostgresCountingCursor(psycopg2.extensions.cursor):
+        def execute(self, sql, params=None):
+            self.connection.statements += 1
+            return super().execute(sql, params)
+
+    class PostgresCountingConnection(psycopg2.extensions.connection):
+        statements = 0
+
+        def commit(self):
+            self.statements += 1
+            return super().commit()
+
+    conn = psycopg2.connect(
+        connection_string,
+        connection_factory=PostgresCountingConnection,
+        cursor_factory=PostgresCountingCursor,
+    )
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {BENCHMARK_TABLE_NAME} CASCADE")
+        cursor.execute(f"DROP TABLE IF EXISTS {BENCHMARK_TABLE_NAME}_schema_migrations")
+    conn.commit()
+    migrate(conn, BENCHMARK_TABLE_NAME)
+    ensure_partitions(conn, BENCHMARK_TABLE_NAME, [int(GAME_DATE[:4])])
+    conn.statements = 0
+
+    return conn
+
+
+class FakeS3:
+    """
+    A stand-in for the S3 resource that discards uploads
+    """
+
+    def __init__(self):
+        self.meta = self
+        self.client = self
+
+    def upload_file(self, **kwargs):
+        pass
+
+    def put_object(self, **kwargs):
+        pass
+
+
+def percentile(values: list, pct: float) -> float:
+    """
+    :param values: the values
+    :param pct: the percentile, between 0 and 100
+    :returns: the percentile of the values, using the nearest-rank method
+    """
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))]
+
+
+def run_slate(games: int, args) -> dict:
+    """
+    Runs the pipeline against a synthetic slate
+
+    :param games: the number of games on the slate
+    :param args: the command line arguments
+    :returns: the measurements for the slate
+    """
+    fake_api = FakeStatsAPI(games, args.api_latency_ms / 1000)
+    stats_api.fetch = fake_api
+
+    if args.psql:
+        conn = connect_postgres(args.psql)
+    else:
+        conn = CountingConnection(args.db_latency_ms / 1000)
+    function.get_db_connection = lambda: conn
+    function.get_s3 = lambda: FakeS3()
+
+    # Start each slate cold, as the first run in a new container would, so a slate measures the same whether it runs alone or after others
+    function.reset_run_state()
+    function.tables_ready = False
+    teams.team_index = None
+    pitchers.player_id_cache = None
+
+    start_time = time.time()
+    function.prepare_games()
+    prepare_time = time.time() - start_time
+
+    per_game = [
+        max(
+            fake_api.served_at.get(fake_api.pitcher_id(i, side), start_time)
+            for side in ("home", "away")
+        )
+        - start_time
+        for i in range(games)
+    ]
+
+    start_time = time.time()
+    function.update_games()
+    update_time = time.time() - start_time
+
+    if args.psql:
+        conn.close()
+
+    return {
+        "games": games,
+        "wall_time": prepare_time + update_time,
+        "prepare_time": prepare_time,
+        "update_time": update_time,
+        "p50_game_latency": percentile(per_game, 50),
+        "p95_game_latency": percentile(per_game, 95),
+        "api_calls_per_game": fake_api.calls / games,
+        "db_statements_per_game": conn.statements / games,
+    }
+
+
+def compare(results: list, baseline: list, tolerance: float) -> list:
+    """
+    Compares results against a baseline
+
+    :param results: the results of this run
+    :param baseline: the results of the baseline run
+    :param tolerance: how much worse, as a fraction, a number may be before it counts as a regression
+    :returns: a description of every regression
+    """
+    baseline_by_games = {row["games"]: row for row in baseline}
+    regressions = []
+
+    for row in results:
+        base = baseline_by_games.get(row["games"])
+        if base is None:
+            continue
+        for metric in [
+            "wall_time",
+            "p95_game_latency",
+            "api_calls_per_game",
+            "db_statements_per_game",
+        ]:
+            if row[metric] > base[metric] * (1 + tolerance) + 1e-9:
+                regressions.append(
+                    f"{row['games']} games: {metric} went from {base[metric]:.4f} to {row[metric]:.4f}"
+                )
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="End-to-end benchmark for the daily pipeline."
+    )
+    parser.add_argument(
+        "--slates", type=int, nargs="+", default=[1, 5, 15, 50, 100, 150]
+    )
+    parser.add_argument("--api-latency-ms", type=float, default=50)
+    parser.add_argument("--db-latency-ms", type=float, default=20)
+    parser.add_argument("--psql", help="connection string of a local Postgres database")
+    parser.add_argument("--baseline", help="a report to compare against")
+    parser.add_argument("--save-baseline", help="where to save this report")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    # Keep the pipeline's own output out of the report. A 1-game slate is run first and
+    # discarded, so that the process's one-time costs (e.g. lazy imports) are not charged to
+    # whichever slate happens to run first
+    stdout = sys.stdout
+    results = []
+    for games in [1, *args.slates]:
+        sys.stdout = open(os.devnull, "w")
+        try:
+            results.append(run_slate(games, args))
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+    results = results[1:]
+
+    print(
+        f"{'games':>6} {'wall (s)':>10} {'p50 game (s)':>13} {'p95 game (s)':>13} {'API calls/game':>15} {'DB stmts/game':>14}"
+    )
+    for row in results:
+        print(
+            f"{row['games']:>6} {row['wall_time']:>10.3f} {row['p50_game_latency']:>13.3f} {row['p95_game_latency']:>13.3f} {row['api_calls_per_game']:>15.2f} {row['db_statements_per_game']:>14.2f}"
+        )
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as file:
+            json.dump(
+                {
+                    "settings": vars(args) | {"baseline": None, "save_baseline": None},
+                    "results": results,
+                },
+                file,
+                indent=2,
+            )
+        print(f"\nBaseline saved to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, "r") as file:
+            regressions = compare(results, json.load(file)["results"], args.tolerance)
+        if regressions:
+            print("\nRegressions against the baseline:")
+            for regression in regressions:
+                print(f" - {regression}")
+            sys.exit(1)
+        print("\nNo regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,43 +1,29 @@
 import boto3
-import datetime
 import os
-import tempfile
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from model_artifact import publish_artifact
 
 MODEL_ACCESS_KEY_ID = os.getenv("MODEL_ACCESS_KEY_ID")
 MODEL_SECRET_ACCESS_KEY = os.getenv("MODEL_SECRET_ACCESS_KEY")
 LOGS_ENDPOINT_URL = os.getenv("LOGS_ENDPOINT_URL")
 MODEL_BUCKET = os.getenv("MODEL_BUCKET")
+MODEL_PREFIX = os.getenv("MLB_MODEL_PREFIX", "models")
 
+# The artifact written by modeling.ipynb
+artifact_path = "model_objects/current"
 
-now = datetime.datetime.now()
-current_time = str(now).replace(" ", "_")[:19].replace(":", "-")
-
-file_path = "model_objects/current_models.pkl"
-with open(file_path, "rb") as pickle_file:
-    pickle_content = pickle_file.read()
-
-temp = tempfile.NamedTemporaryFile(
-    prefix=current_time, suffix="_temp", mode="wb", delete=False
-)
-
-temp.write(pickle_content)
-temp.flush()
-
-temp.seek(0)
-
-s3 = boto3.resource(
+s3 = boto3.client(
     service_name="s3",
     aws_access_key_id=MODEL_ACCESS_KEY_ID,
     aws_secret_access_key=MODEL_SECRET_ACCESS_KEY,
     endpoint_url=LOGS_ENDPOINT_URL,
 )
 
-key = f"{current_time}-model.pickle"
-data = open(temp.name, "rb")
-
-s3.Bucket(MODEL_BUCKET).put_object(Key=f"{key}", Body=data)
+version = publish_artifact(s3, artifact_path, MODEL_BUCKET, MODEL_PREFIX)
 
-print(f"File uploaded to bucket {MODEL_BUCKET} as {key}")
-
-temp.close()
-os.remove(temp.name)
+print(
+    f"Models uploaded to bucket {MODEL_BUCKET} as {MODEL_PREFIX}/{version}/ and marked as latest"
+)
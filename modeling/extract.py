@@ -0,0 +1,248 @@
+import argparse
+import datetime
+import glob
+import json
+import os
+import polars as pl
+import psycopg2
+
+"""
+Incremental extract of the games table to a partitioned Parquet dataset.
+
+Rows are streamed from a server-side cursor in chunks, so memory use does not grow with the
+size of the table, and each chunk is written as Parquet files under a partition per season.
+Every game's updated_at is set whenever it is written (see migrations.py), and a watermark
+records when the last extract started, so later runs only pull the games written since then:
+new games, whatever their IDs (e.g. backfilled ones), and games whose winner, predictions,
+form or pitchers have changed. Each run looks back EXTRACT_OVERLAP before the watermark, so
+games written by transactions that were still open when the last extract started are not
+missed. A game can therefore appear in more than one file; scan_dataset keeps its latest row.
+A watermark written before games had an updated_at is ignored, and the whole table is
+extracted again.
+
+Before extracting, main refreshes the materialized view of every game's features (see
+migrations.py). The refresh recomputes every season, so it is done here, when training data
+is pulled, rather than by the daily pipeline.
+
+Files written before the games table had a season are kept in partitions per extract date,
+and files written before a column was added to the table do not have that column; both are
+still read by scan_dataset.
+
+Usage:
+    python extract.py
+    python extract.py --dataset-path dataset --full
+"""
+
+TABLE_NAME = os.getenv("MLB_DB_TABLE_NAME", "games")
+DATASET_PATH = os.getenv("MLB_DATASET_PATH", "dataset")
+CHUNK_SIZE = int(os.getenv("MLB_EXTRACT_CHUNK_SIZE", 10000))
+WATERMARK_FILE = "_watermark.json"
+EXTRACT_OVERLAP = datetime.timedelta(hours=1)
+
+# Postgres type OIDs and the types their columns are stored as, so every chunk has the same schema
+INTEGER_TYPES = [20, 21, 23]
+FLOAT_TYPES = [700, 701, 1700]
+BOOLEAN_TYPES = [16]
+DATE_TYPES = [1082]
+TIMESTAMP_TYPES = [1184]
+
+
+def connect():
+    """
+    :returns: a connection to the database holding the games table
+    """
+    return psycopg2.connect(
+        database=os.getenv("AWS_PSQL_DB"),
+        user=os.getenv("AWS_PSQL_USER"),
+        password=os.getenv("AWS_PSQL_PASSWORD"),
+        host=os.getenv("AWS_PSQL_HOST"),
+        port=os.getenv("AWS_PSQL_PORT"),
+    )
+
+
+def refresh_features(conn):
+    """
+    Recomputes the materialized view of every game's features and label, without blocking reads of it
+
+    :param conn: the database connection
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {TABLE_NAME}_features")
+    conn.commit()
+
+
+def load_watermark(dataset_path: str) -> dict:
+    """
+    :param dataset_path: the directory of the dataset
+    :returns: when the last extract started, as updated_since; empty if nothing has been extracted
+    """
+    try:
+        with open(os.path.join(dataset_path, WATERMARK_FILE), "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_watermark(dataset_path: str, watermark: dict):
+    """
+    :param dataset_path: the directory of the dataset
+    :param watermark: the watermark to save
+    """
+    path = os.path.join(dataset_path, WATERMARK_FILE)
+    with open(f"{path}.tmp", "w") as file:
+        json.dump(watermark, file)
+    os.replace(f"{path}.tmp", path)
+
+
+def column_schema(description) -> dict:
+    """
+    :param description: the description of a cursor over the games table
+    :returns: the polars schema of the rows
+    """
+    schema = {}
+    for column in description:
+        if column.type_code in INTEGER_TYPES:
+            schema[column.name] = pl.Int64
+        elif column.type_code in FLOAT_TYPES:
+            schema[column.name] = pl.Float64
+        elif column.type_code in BOOLEAN_TYPES:
+            schema[column.name] = pl.Boolean
+        elif column.type_code in DATE_TYPES:
+            schema[column.name] = pl.Date
+        elif column.type_code in TIMESTAMP_TYPES:
+            schema[column.name] = pl.Datetime("us", "UTC")
+        else:
+            schema[column.name] = pl.Utf8
+
+    return schema
+
+
+def extract(conn, dataset_path: str, full: bool = False) -> dict:
+    """
+    Streams the games written since the last extract into the dataset
+
+    :param conn: the database connection
+    :param dataset_path: the directory of the dataset
+    :param full: if True, ignore the watermark and extract the whole table
+    :returns: the number of rows and files written
+    """
+    watermark = {} if full else load_watermark(dataset_path)
+
+    run = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+
+    rows_written = 0
+    files_written = 0
+
+    # The start of the extract's transaction, which every row it reads was committed before
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT now()")
+        ((started_at,),) = cursor.fetchall()
+
+    condition, params = "", ()
+    if watermark.get("updated_since"):
+        condition = "WHERE updated_at > %s"
+        params = (
+            datetime.datetime.fromisoformat(watermark["updated_since"])
+            - EXTRACT_OVERLAP,
+        )
+
+    # A named cursor keeps the result set on the server and sends it over in batches
+    with conn.cursor(name=f"extract_{run.replace('-', '_')}") as cursor:
+        cursor.itersize = CHUNK_SIZE
+        cursor.execute(
+            f"SELECT * FROM {TABLE_NAME} {condition} ORDER BY game_id", params
+        )
+
+        schema = None
+        while True:
+            rows = cursor.fetchmany(CHUNK_SIZE)
+            if not rows:
+                break
+            if schema is None:
+                schema = column_schema(cursor.description)
+
+            chunk = pl.DataFrame(rows, schema=schema, orient="row").with_columns(
+                pl.lit(run).alias("extracted_at")
+            )
+            # Partitioning by a list gives tuple keys on every polars version, including the pinned 0.20
+            parts = chunk.partition_by(["season"], as_dict=True)
+            for (partition_season,), part in parts.items():
+                partition = os.path.join(dataset_path, f"season={partition_season}")
+                os.makedirs(partition, exist_ok=True)
+                part.write_parquet(
+                    os.path.join(partition, f"part-{run}-{files_written:05d}.parquet")
+                )
+                files_written += 1
+
+            rows_written += len(chunk)
+
+    conn.commit()
+
+    os.makedirs(dataset_path, exist_ok=True)
+    save_watermark(dataset_path, {"updated_since": started_at.isoformat()})
+
+    return {"rows": rows_written, "files": files_written}
+
+
+def dataset_files(dataset_path: str = DATASET_PATH) -> list:
+    """
+    :param dataset_path: the directory of the dataset
+    :returns: the paths of every Parquet file of the dataset, in both the season and the older extract date partitions
+    """
+    return sorted(
+        glob.glob(os.path.join(dataset_path, "season=*", "*.parquet"))
+        + glob.glob(os.path.join(dataset_path, "extracted=*", "*.parquet"))
+    )
+
+
+def scan_dataset(dataset_path: str = DATASET_PATH) -> pl.LazyFrame:
+    """
+    Lazily reads the dataset, keeping only the latest extracted row of every game
+
+    Files with different columns, e.g. written before a column was added to the games table, are combined by name, with the
+    missing columns left null.
+
+    :param dataset_path: the directory of the dataset
+    :returns: the games, with the columns of the games table
+    """
+    return (
+        pl.concat(
+            [
+                pl.scan_parquet(path, hive_partitioning=False)
+                for path in dataset_files(dataset_path)
+            ],
+            how="diagonal_relaxed",
+        )
+        .sort("extracted_at")
+        .unique(subset="game_id", keep="last")
+        .drop("extracted_at")
+        .sort("game_id")
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Extracts the games table to a partitioned Parquet dataset."
+    )
+    parser.add_argument("--dataset-path", default=DATASET_PATH)
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="ignore the watermark and extract everything",
+    )
+    args = parser.parse_args()
+
+    conn = connect()
+    try:
+        refresh_features(conn)
+        counts = extract(conn, args.dataset_path, args.full)
+    finally:
+        conn.close()
+
+    print(
+        f"{counts['rows']} row(s) written to {counts['files']} file(s) in {args.dataset_path}."
+    )
+
+
+if __name__ == "__main__":
+    main()
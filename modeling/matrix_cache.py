@@ -0,0 +1,166 @@
+import hashlib
+import joblib
+import json
+import numpy as np
+import os
+import shutil
+import sys
+import tempfile
+
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import StandardScaler
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from extract import dataset_files, scan_dataset
+from features import LABEL, TRAINING_FEATURES, build_features, feature_matrix
+
+"""
+On-disk cache of the standardised training and test matrices.
+
+The features are built, split and standardised (with statistics from the training split only)
+once per version of the dataset, and saved as .npy files under a directory named after a hash
+of the dataset's Parquet files and the split settings. Later runs memory-map the files instead
+of rebuilding them, so every worker process shares the same pages.
+
+The matrices are stored column-major, so each feature is contiguous on disk and every feature
+set, being a contiguous run of TRAINING_FEATURES, is a view of the matrix rather than a copy.
+Recent form is NaN for games from before the game logs; the scaler ignores NaN when fitting and
+keeps it when transforming, so the games are kept for the feature sets without form.
+"""
+
+CACHE_PATH = os.getenv("MLB_MATRIX_CACHE_PATH", "model_objects/cache")
+MATRIX_DTYPE = np.float64
+ARRAYS = ["X_train", "X_test", "y_train", "y_test"]
+
+
+def dataset_hash(dataset_path: str, seed: int, test_size: float) -> str:
+    """
+    Hashes the contents of the dataset and the settings the matrices are built with
+
+    :param dataset_path: the directory of the dataset written by extract.py
+    :param seed: the seed of the split
+    :param test_size: the fraction of games in the test split
+    :returns: the hash, as hex
+    """
+    digest = hashlib.sha256()
+    digest.update(
+        json.dumps(
+            {
+                "features": TRAINING_FEATURES,
+                "dtype": np.dtype(MATRIX_DTYPE).name,
+                "seed": seed,
+                "test_size": test_size,
+            }
+        ).encode()
+    )
+
+    for path in dataset_files(dataset_path):
+        digest.update(os.path.relpath(path, dataset_path).encode())
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(1024 * 1024), b""):
+                digest.update(block)
+
+    return digest.hexdigest()[:16]
+
+
+def build_matrices(dataset_path: str, directory: str, seed: int, test_size: float):
+    """
+    Builds the features, splits and standardises them, and saves them to a directory
+
+    :param dataset_path: the directory of the dataset written by extract.py
+    :param directory: the directory to save the matrices to
+    :param seed: the seed of the split
+    :param test_size: the fraction of games in the test split
+    """
+    features = build_features(
+        scan_dataset(dataset_path).collect(), label=True, form=True
+    )
+    X = feature_matrix(features, TRAINING_FEATURES)
+    y = features[LABEL].to_numpy()
+
+    train_rows, test_rows = train_test_split(
+        np.arange(len(y)), test_size=test_size, random_state=seed, shuffle=True
+    )
+    scaler = StandardScaler().fit(X[train_rows])
+
+    arrays = {
+        "X_train": np.asfortranarray(scaler.transform(X[train_rows]), MATRIX_DTYPE),
+        "X_test": np.asfortranarray(scaler.transform(X[test_rows]), MATRIX_DTYPE),
+        "y_train": y[train_rows],
+        "y_test": y[test_rows],
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, f"{name}.npy"), array)
+
+    joblib.dump(scaler, os.path.join(directory, "scaler.joblib"))
+    with open(os.path.join(directory, "meta.json"), "w") as file:
+        json.dump(
+            {
+                "features": TRAINING_FEATURES,
+                "train_size": len(train_rows),
+                "test_size": len(test_rows),
+            },
+            file,
+        )
+
+
+def load_matrices(
+    dataset_path: str, seed: int, test_size: float, cache_path: str = CACHE_PATH
+) -> dict:
+    """
+    Loads the matrices of the dataset, building them first if they are not cached
+
+    :param dataset_path: the directory of the dataset written by extract.py
+    :param seed: the seed of the split
+    :param test_size: the fraction of games in the test split
+    :param cache_path: the directory the matrices are cached in
+    :returns: the directory of the matrices and the matrices as read-only memory maps
+    """
+    directory = os.path.join(cache_path, dataset_hash(dataset_path, seed, test_size))
+
+    if not os.path.exists(os.path.join(directory, "meta.json")):
+        # Build into a temporary directory first so that a half-built cache is never used
+        os.makedirs(cache_path, exist_ok=True)
+        build_path = tempfile.mkdtemp(dir=cache_path)
+        try:
+            build_matrices(dataset_path, build_path, seed, test_size)
+            os.replace(build_path, directory)
+        except Exception:
+            shutil.rmtree(build_path, ignore_errors=True)
+            raise
+
+    return open_matrices(directory)
+
+
+def open_matrices(directory: str) -> dict:
+    """
+    Memory-maps cached matrices
+
+    :param directory: the directory of the matrices
+    :returns: the directory, the scaler and the matrices as read-only memory maps
+    """
+    matrices = {
+        name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+        for name in ARRAYS
+    }
+    matrices["scaler"] = joblib.load(os.path.join(directory, "scaler.joblib"))
+    matrices["directory"] = directory
+
+    return matrices
+
+
+def columns(matrix: np.ndarray, names: list) -> np.ndarray:
+    """
+    Selects features from a matrix, without copying when they are a contiguous run of TRAINING_FEATURES
+
+    :param matrix: a matrix with a column for every feature in TRAINING_FEATURES
+    :param names: the features to select, in order
+    :returns: the columns of the features
+    """
+    indices = [TRAINING_FEATURES.index(name) for name in names]
+
+    if indices == list(range(indices[0], indices[0] + len(indices))):
+        return matrix[:, indices[0] : indices[0] + len(indices)]
+
+    return matrix[:, indices]
@@ -0,0 +1,437 @@
+import argparse
+import datetime
+import json
+import multiprocessing
+import numpy as np
+import os
+import sys
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from sklearn import svm
+from sklearn.ensemble import HistGradientBoostingClassifier
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from sklearn.metrics import (
+    accuracy_score,
+    f1_score,
+    precision_score,
+    recall_score,
+    roc_auc_score,
+)
+from sklearn.model_selection import StratifiedKFold, cross_val_score
+from sklearn.neighbors import KNeighborsClassifier, NearestCentroid
+from threadpoolctl import threadpool_limits
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from extract import DATASET_PATH
+from features import (
+    ALL_STAT_FEATURES,
+    FORM_FEATURES,
+    MODERN_FEATURES,
+    OLD_SCHOOL_FEATURES,
+)
+from matrix_cache import CACHE_PATH, columns, load_matrices, open_matrices
+from model_artifact import write_artifact
+from online import ONLINE_MODEL
+
+"""
+Model selection for the win predictor, as a single command.
+
+The standardised training and test matrices come from matrix_cache, so they are only rebuilt
+when the dataset changes, and every worker memory-maps the same files.
+
+Every feature set x model family x hyperparameter combination is scored with 5-fold cross
+validation on the training split, on a process pool with one single-threaded worker per
+core. For each feature set and family the hyperparameters with the best cross-validation
+score are kept, as GridSearchCV would, and the family with the best cross-validation score
+becomes that feature set's model. Only the chosen models are scored on the test split, so
+their test scores are not biased by the selection. A stochastic gradient descent logistic
+model is also trained on every feature, for the daily pipeline to keep updating with each
+day's results. The results table is written next to the artifact of the best models.
+Nothing is plotted unless --plot is given.
+
+The form feature set adds each pitcher's recent form to every stat, and is scored only on the
+games that have it. It is left out of the artifact, since the pipeline predicts before a day's
+form is written.
+
+Usage:
+    python train.py
+    python train.py --dataset-path dataset --workers 4 --plot
+"""
+
+SEED = 42
+TEST_SIZE = 0.2
+CV_FOLDS = 5
+ARTIFACT_PATH = "model_objects/current"
+
+FEATURE_SETS = {
+    "all_stats": ALL_STAT_FEATURES,
+    "old_school": OLD_SCHOOL_FEATURES,
+    "modern": MODERN_FEATURES,
+    "form": ALL_STAT_FEATURES + FORM_FEATURES,
+}
+
+# The feature sets the pipeline can predict with, and so the ones written to the artifact
+SERVED_FEATURE_SETS = ["all_stats", "old_school", "modern"]
+
+# Each model family, how to build it and the hyperparameters to search
+MODEL_FAMILIES = {
+    "LogisticRegression": (
+        lambda **params: LogisticRegression(random_state=SEED, **params),
+        {"C": [0.01, 0.1, 1.0, 10.0]},
+    ),
+    "SVC": (
+        lambda **params: svm.SVC(random_state=SEED, **params),
+        {"C": [0.1, 1.0, 10.0]},
+    ),
+    "NearestCentroid": (lambda **params: NearestCentroid(**params), {}),
+    "KNeighborsClassifier": (
+        lambda **params: KNeighborsClassifier(**params),
+        {"n_neighbors": [1, 2, 3, 5, 8, 13, 21, 34, 45, 79]},
+    ),
+    "HistGradientBoostingClassifier": (
+        lambda **params: HistGradientBoostingClassifier(random_state=SEED, **params),
+        {"max_iter": [100, 200], "learning_rate": [0.05, 0.1]},
+    ),
+}
+
+# The memory-mapped matrices, opened by every worker when the pool starts rather than sent with each task
+splits = None
+
+
+def parameter_grid(grid: dict) -> list:
+    """
+    :param grid: a dict mapping each hyperparameter to the values to try
+    :returns: every combination of the values, as dicts
+    """
+    combinations = [{}]
+    for name, values in grid.items():
+        combinations = [
+            {**combination, name: value}
+            for combination in combinations
+            for value in values
+        ]
+
+    return combinations
+
+
+def init_worker(directory: str):
+    """
+    Runs once in every worker process
+
+    :param directory: the directory of the cached matrices
+    """
+    global splits
+
+    splits = open_matrices(directory)
+    # Each worker gets one core; letting every model also use every core would oversubscribe them
+    threadpool_limits(1)
+
+
+def feature_rows(split: str, feature_set: str) -> tuple:
+    """
+    :param split: "train" or "test"
+    :param feature_set: the name of the feature set
+    :returns: a tuple of the features and labels of the split's games that have every feature in the set
+    """
+    X = columns(splits[f"X_{split}"], FEATURE_SETS[feature_set])
+    y = splits[f"y_{split}"]
+    # Only recent form can be missing; the other sets are kept as views of the matrix
+    missing = np.isnan(X).any(axis=1)
+    if missing.any():
+        return X[~missing], y[~missing]
+
+    return X, y
+
+
+def evaluate(task: tuple) -> dict:
+    """
+    Cross-validates one model on the training split
+
+    :param task: a tuple of the feature set, the model family and the hyperparameters
+    :returns: the cross-validation score of the model, and the model fitted on the whole training split
+    """
+    feature_set, family, params = task
+    build, _ = MODEL_FAMILIES[family]
+    X_train, y_train = feature_rows("train", feature_set)
+    start_time = time.time()
+
+    cv_scores = cross_val_score(
+        build(**params),
+        X_train,
+        y_train,
+        cv=StratifiedKFold(CV_FOLDS, shuffle=True, random_state=SEED),
+    )
+
+    model = build(**params).fit(X_train, y_train)
+
+    return {
+        "feature_set": feature_set,
+        "family": family,
+        "params": params,
+        "cv_accuracy": float(cv_scores.mean()),
+        "training_games": len(y_train),
+        "seconds": time.time() - start_time,
+        "model": model,
+    }
+
+
+def test_scores(result: dict) -> dict:
+    """
+    Scores a chosen model on the test split
+
+    :param result: the output of evaluate for the model
+    :returns: the accuracy, precision, recall, F1 and AUC of the model on the test split
+    """
+    model = result["model"]
+    X_test, y_test = feature_rows("test", result["feature_set"])
+    predictions = model.predict(X_test)
+    if hasattr(model, "predict_proba"):
+        scores = model.predict_proba(X_test)[:, 1]
+    elif hasattr(model, "decision_function"):
+        scores = model.decision_function(X_test)
+    else:
+        scores = predictions
+
+    return {
+        "accuracy": accuracy_score(y_test, predictions),
+        "precision": precision_score(y_test, predictions, zero_division=0),
+        "recall": recall_score(y_test, predictions, zero_division=0),
+        "f1": f1_score(y_test, predictions, zero_division=0),
+        "auc": roc_auc_score(y_test, scores),
+        "testing_games": len(y_test),
+    }
+
+
+def select_best(results: list) -> tuple:
+    """
+    Picks the best hyperparameters of every family, then the best family of every feature set, both by cross-validation accuracy
+
+    The test split plays no part in the choice.
+
+    :param results: the output of evaluate for every task
+    :returns: a tuple of the best result of every feature set and family, and the best result of every feature set
+    """
+    best_by_family = {}
+    for result in results:
+        key = (result["feature_set"], result["family"])
+        if (
+            key not in best_by_family
+            or result["cv_accuracy"] > best_by_family[key]["cv_accuracy"]
+        ):
+            best_by_family[key] = result
+
+    best_by_set = {}
+    for (feature_set, _), result in best_by_family.items():
+        if (
+            feature_set not in best_by_set
+            or result["cv_accuracy"] > best_by_set[feature_set]["cv_accuracy"]
+        ):
+            best_by_set[feature_set] = result
+
+    return best_by_family, best_by_set
+
+
+def train_online_model(now: datetime.datetime) -> dict:
+    """
+    Trains the model that the daily pipeline keeps updating with each day's results (see online.py)
+
+    :param now: when the models were trained
+    :returns: the model's entry in the artifact
+    """
+    X_train = columns(splits["X_train"], ALL_STAT_FEATURES)
+    X_test = columns(splits["X_test"], ALL_STAT_FEATURES)
+    model = SGDClassifier(loss="log_loss", random_state=SEED).fit(
+        X_train, splits["y_train"]
+    )
+
+    return {
+        "model": model,
+        # The daily updates keep this scaler as it is, until the next batch retrain
+        "scaler": splits["scaler"],
+        "features": ALL_STAT_FEATURES,
+        "metadata": {
+            "date created": now,
+            "model type": type(model).__name__,
+            "parameters": {"loss": "log_loss"},
+            "accuracy": accuracy_score(splits["y_test"], model.predict(X_test)),
+            "training set size": len(splits["y_train"]),
+            "testing set size": len(splits["y_test"]),
+            "games_learned": len(splits["y_train"]),
+        },
+    }
+
+
+def format_table(rows: list, headers: list) -> str:
+    """
+    :param rows: lists of the values of each row, as strings
+    :param headers: the name of each column
+    :returns: the rows as a text table, with every column padded to its widest value
+    """
+    widths = [
+        max(len(row[index]) for row in [headers, *rows])
+        for index in range(len(headers))
+    ]
+    lines = [
+        "  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip()
+        for row in [headers, *rows]
+    ]
+    lines.insert(1, "  ".join("-" * width for width in widths))
+
+    return "\n".join(lines)
+
+
+def plot_roc_curves(best_by_set: dict, output_path: str):
+    """
+    Saves the ROC curve, on the test split, of the chosen model of every feature set
+
+    :param best_by_set: the second output of select_best
+    :param output_path: the directory to save the plots to
+    """
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    from sklearn.metrics import RocCurveDisplay
+
+    for feature_set, result in best_by_set.items():
+        family = result["family"]
+        X_test, y_test = feature_rows("test", feature_set)
+        display = RocCurveDisplay.from_estimator(result["model"], X_test, y_test)
+        display.ax_.plot([0, 1], [0, 1], color="gray", linestyle="--")
+        display.ax_.set_title(
+            f"{family} ({feature_set}) Receiver Operating Characteristic"
+        )
+        display.figure_.savefig(
+            os.path.join(output_path, f"roc_{feature_set}_{family}.png")
+        )
+        plt.close(display.figure_)
+
+
+def main():
+    global splits
+
+    parser = argparse.ArgumentParser(
+        description="Trains and selects the win predictor models."
+    )
+    parser.add_argument("--dataset-path", default=DATASET_PATH)
+    parser.add_argument("--artifact-path", default=ARTIFACT_PATH)
+    parser.add_argument("--cache-path", default=CACHE_PATH)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument(
+        "--plot", action="store_true", help="save the ROC curve of every chosen model"
+    )
+    args = parser.parse_args()
+
+    start_time = time.time()
+    splits = load_matrices(args.dataset_path, SEED, TEST_SIZE, args.cache_path)
+    tasks = [
+        (feature_set, family, params)
+        for feature_set in FEATURE_SETS
+        for family, (_, grid) in MODEL_FAMILIES.items()
+        for params in parameter_grid(grid)
+    ]
+    print(
+        f"Training {len(tasks)} model(s) on {len(splits['y_train'])} game(s) with {args.workers} worker(s)..."
+    )
+
+    # Workers are spawned rather than forked, since forking after polars has started its thread pool can deadlock
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker,
+        initargs=(splits["directory"],),
+    ) as executor:
+        results = list(executor.map(evaluate, tasks))
+
+    best_by_family, best_by_set = select_best(results)
+    for result in best_by_set.values():
+        result.update(test_scores(result))
+
+    # Test scores are only shown for the chosen models
+    table = [
+        [
+            feature_set,
+            family,
+            json.dumps(result["params"]),
+            f"{result['cv_accuracy']:.2%}",
+            *(
+                [
+                    f"{result['accuracy']:.2%}",
+                    f"{result['precision']:.2%}",
+                    f"{result['recall']:.2%}",
+                    f"{result['f1']:.2%}",
+                    f"{result['auc']:.3f}",
+                    "*",
+                ]
+                if best_by_set[feature_set] is result
+                else [""] * 6
+            ),
+        ]
+        for (feature_set, family), result in best_by_family.items()
+    ]
+    print(
+        format_table(
+            table,
+            [
+                "Feature Set",
+                "Model",
+                "Parameters",
+                "CV Accuracy",
+                "Accuracy",
+                "Precision",
+                "Recall",
+                "F1",
+                "AUC",
+                "Best",
+            ],
+        )
+    )
+
+    now = datetime.datetime.now()
+    version = now.strftime("%Y-%m-%d_%H-%M-%S")
+    artifact = {
+        feature_set: {
+            "model": result["model"],
+            "scaler": splits["scaler"],
+            "features": FEATURE_SETS[feature_set],
+            "metadata": {
+                "date created": now,
+                "model type": result["family"],
+                "parameters": result["params"],
+                "accuracy": result["accuracy"],
+                "training set size": result["training_games"],
+                "testing set size": result["testing_games"],
+            },
+        }
+        for feature_set, result in best_by_set.items()
+        if feature_set in SERVED_FEATURE_SETS
+    }
+    artifact[ONLINE_MODEL] = train_online_model(now)
+    print(
+        f"Online model accuracy: {artifact[ONLINE_MODEL]['metadata']['accuracy']:.2%}"
+    )
+    write_artifact(artifact, args.artifact_path, version)
+
+    with open(os.path.join(args.artifact_path, "results.json"), "w") as file:
+        json.dump(
+            [
+                {key: value for key, value in result.items() if key != "model"}
+                for result in results
+            ],
+            file,
+            indent=2,
+        )
+
+    if args.plot:
+        plot_roc_curves(best_by_set, args.artifact_path)
+
+    print(
+        f"\nModels written to {args.artifact_path} as version {version} in {datetime.timedelta(seconds=time.time() - start_time)}."
+    )
+
+
+if __name__ == "__main__":
+    main()
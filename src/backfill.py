@@ -0,0 +1,325 @@
+import argparse
+import json
+import os
+import threading
+
+from database import (
+    STATUS_COLUMNS,
+    fetch_winner_states,
+    update_columns,
+    update_winners,
+    upsert_games,
+)
+from fanout import map_concurrently
+from games import (
+    FINAL_STATUSES,
+    UNPLAYED_STATUSES,
+    build_game_record,
+    game_day,
+    lookup_winner,
+    prefetch_pitchers,
+)
+from pitchers import seed_stat_lines
+from schedule import get_schedule
+from snapshots import read_stats_on
+
+"""
+Backfills winners and matchups for a range of dates, e.g. after an outage.
+
+The schedule for the whole range is fetched in a single request. Games that already have a
+winner are skipped, missing matchups are added using each pitcher's stats going into the
+game (read from the stat snapshot store when it has a snapshot of that day), and days are
+processed in parallel. Every finished day is recorded in a checkpoint file so that an
+interrupted backfill picks up where it left off.
+
+Added games are written with their status and, as the daily pipeline writes them, their
+pitchers' recent form from the game log table. When the pitching lines of finished games are
+ingested into the game log table, every day's lines are ingested before any day's games are
+added, so that each day's form can use the lines of the days before it in the range.
+
+Usage:
+    python backfill.py 08/01/2023 08/31/2023
+"""
+
+CHECKPOINT_PATH = os.getenv(
+    "MLB_BACKFILL_CHECKPOINT_PATH", "/tmp/backfill_checkpoint.json"
+)
+
+
+def load_checkpoint(start_date: str, end_date: str) -> dict:
+    """
+    Loads the checkpoint of a backfill
+
+    :param start_date: the first date of the backfill, formatted as %m/%d/%Y
+    :param end_date: the last date of the backfill, formatted as %m/%d/%Y
+    :returns: a dict mapping every finished day of the backfill to its counts
+    """
+    try:
+        with open(CHECKPOINT_PATH, "r") as file:
+            return json.load(file).get(f"{start_date}-{end_date}", {})
+    except (OSError, ValueError):
+        return {}
+
+
+def save_checkpoint(start_date: str, end_date: str, finished: dict):
+    """
+    Saves the checkpoint of a backfill
+
+    :param start_date: the first date of the backfill, formatted as %m/%d/%Y
+    :param end_date: the last date of the backfill, formatted as %m/%d/%Y
+    :param finished: a dict mapping every finished day of the backfill to its counts
+    """
+    try:
+        with open(CHECKPOINT_PATH, "r") as file:
+            checkpoints = json.load(file)
+    except (OSError, ValueError):
+        checkpoints = {}
+
+    checkpoints[f"{start_date}-{end_date}"] = finished
+
+    with open(CHECKPOINT_PATH, "w") as file:
+        json.dump(checkpoints, file, indent=2)
+
+
+def ingest_day(
+    conn, game_log_table_name: str, games: list, ingested_games: set, db_lock
+) -> int:
+    """
+    Ingests the pitching lines of a single day's finished games into the game log table
+
+    :param conn: the database connection
+    :param game_log_table_name: the name of the game log table
+    :param games: the day's games from the schedule
+    :param ingested_games: the IDs of the games whose lines are already in the game log table, which are not fetched again
+    :param db_lock: the lock that serializes writes on the shared connection
+    :returns: the number of lines stored
+    """
+    from game_logs import fetch_game_logs, write_game_logs
+
+    lines = []
+    for game in games:
+        if game["status"] in FINAL_STATUSES and game["game_id"] not in ingested_games:
+            lines += fetch_game_logs(game["game_id"], game_day(game))
+
+    if not lines:
+        return 0
+
+    with db_lock:
+        return write_game_logs(conn, game_log_table_name, lines)
+
+
+def backfill_day(
+    conn,
+    table_name: str,
+    games: list,
+    winner_states: dict,
+    db_lock,
+    snapshot_table_name: str = None,
+    game_log_table_name: str = None,
+) -> dict:
+    """
+    Backfills the matchups and winners of a single day
+
+    :param conn: the database connection
+    :param table_name: the name of the games table
+    :param games: the day's games from the schedule
+    :param winner_states: a dict mapping the ID of every game already in the table to whether its winner is set
+    :param db_lock: the lock that serializes writes on the shared connection
+    :param snapshot_table_name: the name of the stat snapshot table, if the pitchers' stats should be read from it when it has them
+    :param game_log_table_name: the name of the game log table, if the recent form of added games should be derived from it
+    :returns: the number of games prepared and updated
+    """
+    to_prepare = [
+        game
+        for game in games
+        if game["game_id"] not in winner_states
+        and game["status"] not in UNPLAYED_STATUSES
+    ]
+    to_update = [
+        game
+        for game in games
+        if not winner_states.get(game["game_id"]) and game["status"] in FINAL_STATUSES
+    ]
+
+    if snapshot_table_name and to_prepare:
+        day = game_day(to_prepare[0])
+        pitchers = [
+            (game[f"{side}_probable_pitcher"], game[f"{side}_probable_pitcher_id"])
+            for game in to_prepare
+            for side in ("home", "away")
+            if game[f"{side}_probable_pitcher_id"]
+        ]
+        with db_lock:
+            stats = read_stats_on(
+                conn,
+                snapshot_table_name,
+                [pitcher_id for _, pitcher_id in pitchers],
+                day,
+            )
+        seed_stat_lines(pitchers, stats, as_of=day)
+
+    # Pitchers are fetched one at a time here because the days themselves run in parallel
+    prefetch_pitchers(to_prepare, 1, point_in_time=True)
+    records = [build_game_record(game, point_in_time=True) for game in to_prepare]
+    winners = [(lookup_winner(game)[0], game["game_id"]) for game in to_update]
+    winners = [winner for winner in winners if winner[0] is not None]
+
+    from game_logs import FORM_COLUMNS, derive_form
+
+    no_form = (None,) * len(FORM_COLUMNS)
+    form = {}
+    if game_log_table_name and records:
+        day = game_day(to_prepare[0])
+        with db_lock:
+            try:
+                form = {
+                    row[0]: row[1:]
+                    for row in derive_form(
+                        conn,
+                        game_log_table_name,
+                        records,
+                        day.replace(month=1, day=1),
+                        day,
+                    )
+                }
+            except Exception as e:
+                # The games are stored without their form, which the models do not depend on
+                print(f"Error occurred deriving recent form from the game logs: {e}")
+                conn.rollback()
+
+    statuses = {game["game_id"]: game["status"] for game in games}
+    with db_lock:
+        try:
+            prepared = upsert_games(conn, table_name, records, commit=False)
+            update_columns(
+                conn,
+                table_name,
+                {**FORM_COLUMNS, **STATUS_COLUMNS},
+                [
+                    (record[0], *form.get(record[0], no_form), statuses[record[0]])
+                    for record in records
+                ],
+                "update_form",
+                commit=False,
+            )
+            updated = update_winners(conn, table_name, winners, commit=False)
+            # Games already in the table keep their form, and only have their status brought up to date
+            update_columns(
+                conn,
+                table_name,
+                STATUS_COLUMNS,
+                [
+                    (game_id, status)
+                    for game_id, status in statuses.items()
+                    if game_id in winner_states
+                ],
+                "update_status",
+                commit=False,
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    return {
+        "prepared": list(prepared.values()).count("inserted"),
+        "updated": list(updated.values()).count("updated"),
+    }
+
+
+def backfill(
+    conn,
+    table_name: str,
+    start_date: str,
+    end_date: str,
+    max_workers: int,
+    snapshot_table_name: str = None,
+    game_log_table_name: str = None,
+) -> dict:
+    """
+    Backfills the matchups and winners of every day in a range
+
+    :param conn: the database connection
+    :param table_name: the name of the games table
+    :param start_date: the first date to backfill, formatted as %m/%d/%Y
+    :param end_date: the last date to backfill, formatted as %m/%d/%Y
+    :param max_workers: the maximum number of days being backfilled at once
+    :param snapshot_table_name: the name of the stat snapshot table, if the pitchers' stats should be read from it when it has them
+    :param game_log_table_name: the name of the game log table, if the pitching lines of finished games should be ingested into it
+    :returns: a dict mapping every day in the range to the number of games prepared and updated
+    """
+    finished = load_checkpoint(start_date, end_date)
+
+    sched = get_schedule(start_date=start_date, end_date=end_date)
+    winner_states = fetch_winner_states(
+        conn, table_name, [game["game_id"] for game in sched]
+    )
+    ingested_games = set()
+    if game_log_table_name:
+        from game_logs import ingested_game_ids
+
+        ingested_games = ingested_game_ids(
+            conn,
+            game_log_table_name,
+            [game["game_id"] for game in sched if game["status"] in FINAL_STATUSES],
+        )
+
+    days = {}
+    for game in sched:
+        days.setdefault(game["game_date"], []).append(game)
+    days_left = sorted(day for day in days if day not in finished)
+    print(
+        f"Backfilling {len(days_left)} of {len(days)} day(s) from {start_date} to {end_date}..."
+    )
+
+    db_lock = threading.Lock()
+    checkpoint_lock = threading.Lock()
+
+    if game_log_table_name:
+
+        def ingest(day: str) -> int:
+            return ingest_day(
+                conn, game_log_table_name, days[day], ingested_games, db_lock
+            )
+
+        lines, _ = map_concurrently(ingest, days_left, max_workers)
+        print(f"{sum(lines)} pitching line(s) ingested into {game_log_table_name}.")
+
+    def run_day(day: str) -> dict:
+        counts = backfill_day(
+            conn,
+            table_name,
+            days[day],
+            winner_states,
+            db_lock,
+            snapshot_table_name,
+            game_log_table_name,
+        )
+        with checkpoint_lock:
+            finished[day] = counts
+            save_checkpoint(start_date, end_date, finished)
+        print(
+            f"{day}: {counts['prepared']} game(s) prepared, {counts['updated']} updated."
+        )
+        return counts
+
+    map_concurrently(run_day, days_left, max_workers)
+
+    return finished
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Backfills winners and matchups for a range of dates."
+    )
+    parser.add_argument("start_date", help="formatted as %%m/%%d/%%Y")
+    parser.add_argument("end_date", help="formatted as %%m/%%d/%%Y")
+    args = parser.parse_args()
+
+    import function
+
+    print(function.run_backfill(args.start_date, args.end_date))
+
+
+if __name__ == "__main__":
+    main()
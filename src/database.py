@@ -0,0 +1,339 @@
+from instrumentation import span
+from psycopg2.extras import execute_values
+
+"""
+Bulk writes to the games table.
+
+Each function writes all of the day's rows in a single statement and a single commit.
+"""
+
+GAME_COLUMNS = [
+    "game_id",
+    "home_team_id",
+    "home_team_name",
+    "away_team_id",
+    "away_team_name",
+    "home_pitcher",
+    "home_pitcher_id",
+    "home_pitcher_era",
+    "home_pitcher_win_percentage",
+    "home_pitcher_wins",
+    "home_pitcher_losses",
+    "home_pitcher_innings_pitched",
+    "away_pitcher",
+    "away_pitcher_id",
+    "away_pitcher_era",
+    "away_pitcher_win_percentage",
+    "away_pitcher_wins",
+    "away_pitcher_losses",
+    "away_pitcher_innings_pitched",
+    "home_pitcher_k_nine",
+    "home_pitcher_bb_nine",
+    "home_pitcher_k_bb_diff",
+    "home_pitcher_whip",
+    "home_pitcher_babip",
+    "away_pitcher_k_nine",
+    "away_pitcher_bb_nine",
+    "away_pitcher_k_bb_diff",
+    "away_pitcher_whip",
+    "away_pitcher_babip",
+    "game_date",
+    "season",
+]
+
+# The columns written by the prediction stage, after game_id, and their types
+PREDICTION_COLUMNS = {
+    "predicted_winner": "integer",
+    "home_win_probability": "double precision",
+    "old_school_predicted_winner": "integer",
+    "old_school_home_win_probability": "double precision",
+    "modern_predicted_winner": "integer",
+    "modern_home_win_probability": "double precision",
+    "online_predicted_winner": "integer",
+    "online_home_win_probability": "double precision",
+}
+
+# The schedule status of each game, kept up to date so that the intraday refresh can tell what has changed
+STATUS_COLUMNS = {"game_status": "text"}
+
+
+def upsert_games(conn, table_name: str, rows: list, commit: bool = True) -> dict:
+    """
+    Inserts games, updating any that already exist (e.g. rescheduled games)
+
+    Rows that already exist with identical values are left untouched.
+
+    :param conn: the database connection
+    :param table_name: the name of the games table
+    :param rows: tuples of values in the order of GAME_COLUMNS
+    :param commit: whether to commit; False leaves the write in the current transaction
+    :returns: a dict mapping each game ID to "inserted", "updated" or "skipped"
+    """
+    rows = list({row[0]: row for row in rows}.values())
+    outcomes = {row[0]: "skipped" for row in rows}
+    if not rows:
+        return outcomes
+
+    columns = ", ".join(GAME_COLUMNS)
+    # The season is part of the key, since the table is partitioned on it; a trigger keeps each game under a single season (see migrations.py)
+    updated_columns = [column for column in GAME_COLUMNS[1:] if column != "season"]
+    updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in updated_columns)
+    changed = " OR ".join(
+        f"{table_name}.{column} IS DISTINCT FROM EXCLUDED.{column}"
+        for column in updated_columns
+    )
+    sql = f"INSERT INTO {table_name} ({columns}) VALUES %s ON CONFLICT (game_id, season) DO UPDATE SET {updates} WHERE {changed} RETURNING game_id, (xmax = 0) AS inserted"
+
+    try:
+        with span(
+            "db_write", table=table_name, statement="upsert_games", rows=len(rows)
+        ):
+            with conn.cursor() as cursor:
+                written = execute_values(
+                    cursor, sql, rows, page_size=len(rows), fetch=True
+                )
+            if commit:
+                conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    for game_id, inserted in written:
+        outcomes[game_id] = "inserted" if inserted else "updated"
+
+    return outcomes
+
+
+def update_winners(conn, table_name: str, rows: list, commit: bool = True) -> dict:
+    """
+    Sets the winning team of games
+
+    Games that are not in the table, or that already have the same winner, are left untouched.
+
+    :param conn: the database connection
+    :param table_name: the name of the games table
+    :param rows: tuples of (winning team ID, game ID)
+    :param commit: whether to commit; False leaves the write in the current transaction
+    :returns: a dict mapping each game ID to "updated" or "skipped"
+    """
+    rows = list({row[1]: row for row in rows}.values())
+    outcomes = {game_id: "skipped" for _, game_id in rows}
+    if not rows:
+        return outcomes
+
+    sql = f"UPDATE {table_name} SET winning_team = data.winning_team FROM (VALUES %s) AS data (winning_team, game_id) WHERE {table_name}.game_id = data.game_id AND {table_name}.winning_team IS DISTINCT FROM data.winning_team RETURNING {table_name}.game_id"
+
+    try:
+        with span(
+            "db_write", table=table_name, statement="update_winners", rows=len(rows)
+        ):
+            with conn.cursor() as cursor:
+                written = execute_values(
+                    cursor,
+                    sql,
+                    rows,
+                    template="(%s::integer, %s::integer)",
+                    page_size=len(rows),
+                    fetch=True,
+                )
+            if commit:
+                conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    for (game_id,) in written:
+        outcomes[game_id] = "updated"
+
+    return outcomes
+
+
+def update_columns(
+    conn,
+    table_name: str,
+    columns: dict,
+    rows: list,
+    statement: str,
+    commit: bool = True,
+) -> dict:
+    """
+    Sets the values of some columns of games
+
+    Games that are not in the table, or that already have the same values, are left untouched.
+
+    :param conn: the database connection
+    :param table_name: the name of the games table
+    :param columns: a dict mapping each column to its type
+    :param rows: tuples of game ID followed by values in the order of columns
+    :param statement: the name of the write, for instrumentation
+    :param commit: whether to commit; False leaves the write in the current transaction
+    :returns: a dict mapping each game ID to "updated" or "skipped"
+    """
+    rows = list({row[0]: row for row in rows}.values())
+    outcomes = {row[0]: "skipped" for row in rows}
+    if not rows:
+        return outcomes
+
+    names = ", ".join(columns)
+    updates = ", ".join(f"{column} = data.{column}" for column in columns)
+    changed = " OR ".join(
+        f"{table_name}.{column} IS DISTINCT FROM data.{column}" for column in columns
+    )
+    template = ", ".join(
+        f"%s::{column_type}" for column_type in ["integer", *columns.values()]
+    )
+    sql = f"UPDATE {table_name} SET {updates} FROM (VALUES %s) AS data (game_id, {names}) WHERE {table_name}.game_id = data.game_id AND ({changed}) RETURNING {table_name}.game_id"
+
+    try:
+        with span(
+            "db_write",
+            table=table_name,
+            statement=statement,
+            rows=len(rows),
+        ):
+            with conn.cursor() as cursor:
+                written = execute_values(
+                    cursor,
+                    sql,
+                    rows,
+                    template=f"({template})",
+                    page_size=len(rows),
+                    fetch=True,
+                )
+            if commit:
+                conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    for (game_id,) in written:
+        outcomes[game_id] = "updated"
+
+    return outcomes
+
+
+def update_predictions(conn, table_name: str, rows: list, commit: bool = True) -> dict:
+    """
+    Sets the predictions of games
+
+    Games that are not in the table, or that already have the same predictions, are left untouched.
+
+    :param conn: the database connection
+    :param table_name: the name of the games table
+    :param rows: tuples of game ID followed by values in the order of PREDICTION_COLUMNS
+    :param commit: whether to commit; False leaves the write in the current transaction
+    :returns: a dict mapping each game ID to "updated" or "skipped"
+    """
+    return update_columns(
+        conn, table_name, PREDICTION_COLUMNS, rows, "update_predictions", commit
+    )
+
+
+def count_outcomes(outcomes: dict) -> dict:
+    """
+    Counts how many games were inserted, updated and skipped
+
+    :param outcomes: a dict mapping each game ID to its outcome
+    :returns: a dict of the number of games with each outcome
+    """
+    counts = {"inserted": 0, "updated": 0, "skipped": 0}
+    for outcome in outcomes.values():
+        counts[outcome] += 1
+
+    return counts
+
+
+def fetch_winner_states(conn, table_name: str, game_ids: list) -> dict:
+    """
+    Gets which of the given games are already in the table, and whether their winner is set
+
+    :param conn: the database connection
+    :param table_name: the name of the games table
+    :param game_ids: the IDs of the games
+    :returns: a dict mapping the ID of every game in the table to True if its winner is set, False otherwise
+    """
+    if not game_ids:
+        return {}
+
+    with span("db_read", table=table_name, statement="fetch_winner_states"):
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"SELECT game_id, winning_team IS NOT NULL FROM {table_name} WHERE game_id = ANY(%s)",
+                (list(game_ids),),
+            )
+            states = dict(cursor.fetchall())
+        conn.rollback()
+
+    return states
+
+
+def fetch_refresh_states(conn, table_name: str, game_ids: list) -> dict:
+    """
+    Gets what the intraday refresh compares with the schedule for each of the given games
+
+    :param conn: the database connection
+    :param table_name: the name of the games table
+    :param game_ids: the IDs of the games
+    :returns: a dict mapping the ID of every game in the table to a tuple of the names and IDs of its home and away pitchers and its status
+    """
+    if not game_ids:
+        return {}
+
+    with span("db_read", table=table_name, statement="fetch_refresh_states"):
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"SELECT game_id, home_pitcher, home_pitcher_id, away_pitcher, away_pitcher_id, game_status FROM {table_name} WHERE game_id = ANY(%s)",
+                (list(game_ids),),
+            )
+            states = {row[0]: row[1:] for row in cursor.fetchall()}
+        conn.rollback()
+
+    return states
+
+
+def fetch_games(conn, table_name: str, game_ids: list) -> list:
+    """
+    Gets the rows of games that have a winner
+
+    :param conn: the database connection
+    :param table_name: the name of the games table
+    :param game_ids: the IDs of the games
+    :returns: tuples of values in the order of GAME_COLUMNS, followed by the winning team
+    """
+    if not game_ids:
+        return []
+
+    with span("db_read", table=table_name, statement="fetch_games"):
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"SELECT {', '.join(GAME_COLUMNS)}, winning_team FROM {table_name} WHERE game_id = ANY(%s) AND winning_team IS NOT NULL",
+                (list(game_ids),),
+            )
+            rows = cursor.fetchall()
+        conn.rollback()
+
+    return rows
+
+
+def fetch_game_records(conn, table_name: str, game_ids: list) -> list:
+    """
+    Gets the rows of games, e.g. ones prepared by an earlier run
+
+    :param conn: the database connection
+    :param table_name: the name of the games table
+    :param game_ids: the IDs of the games
+    :returns: tuples of values in the order of GAME_COLUMNS
+    """
+    if not game_ids:
+        return []
+
+    with span("db_read", table=table_name, statement="fetch_game_records"):
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"SELECT {', '.join(GAME_COLUMNS)} FROM {table_name} WHERE game_id = ANY(%s)",
+                (list(game_ids),),
+            )
+            rows = cursor.fetchall()
+        conn.rollback()
+
+    return rows
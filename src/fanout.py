@@ -0,0 +1,37 @@
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+Bounded fan-out for the network-bound parts of the pipeline.
+
+Results always come back in the same order as the inputs so that logs and summaries
+stay deterministic regardless of which call finishes first.
+"""
+
+
+def map_concurrently(func, items: list, max_workers: int) -> tuple:
+    """
+    Calls a function on every item, with at most max_workers calls in flight at once
+
+    :param func: the function to call on each item
+    :param items: the items to call the function on
+    :param max_workers: the maximum number of calls in flight; 1 or less runs the calls sequentially
+    :returns: a tuple of the results (in the same order as items) and the summed time of the calls in seconds, i.e. the time the calls would have taken had they run sequentially
+    """
+
+    def timed(item):
+        start_time = time.time()
+        result = func(item)
+        return result, time.time() - start_time
+
+    if max_workers <= 1 or len(items) <= 1:
+        timed_results = [timed(item) for item in items]
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as pool:
+            timed_results = list(pool.map(timed, items))
+
+    results = [result for result, _ in timed_results]
+    sequential_time = sum(elapsed for _, elapsed in timed_results)
+
+    return results, sequential_time
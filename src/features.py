@@ -0,0 +1,134 @@
+import numpy as np
+import polars as pl
+
+from database import GAME_COLUMNS
+from game_logs import FORM_STATS
+
+"""
+Feature engineering shared by model training and the daily pipeline.
+
+Every feature is the away pitcher's stat minus the home pitcher's, built as polars column
+expressions so a whole frame is computed in one vectorised pass. The same functions are
+used on the historical games table when training and on the day's freshly prepared rows
+when predicting, so the two can never drift apart.
+"""
+
+# Each feature and the per-pitcher stat it compares, in the order the models were trained on
+FEATURE_STATS = {
+    "pitcher_era_comp": "era",
+    "pitcher_win_percentage_comp": "win_percentage",
+    "pitcher_win_comp": "wins",
+    "pitcher_losses_comp": "losses",
+    "pitcher_innings_pitched_comp": "innings_pitched",
+    "pitcher_k_nine_comp": "k_nine",
+    "pitcher_bb_nine_comp": "bb_nine",
+    "pitcher_k_bb_diff_comp": "k_bb_diff",
+    "pitcher_whip_comp": "whip",
+    "pitcher_babip_comp": "babip",
+    "pitcher_k_bb_ratio_comp": "k_bb_ratio",
+}
+
+ALL_STAT_FEATURES = list(FEATURE_STATS)
+OLD_SCHOOL_FEATURES = ALL_STAT_FEATURES[:5]
+MODERN_FEATURES = ALL_STAT_FEATURES[5:]
+
+# Each recent-form feature (e.g. over the last 3 starts) and the per-pitcher stat it compares;
+# the stats are derived from the game logs and written to the games table after the rows are built
+FORM_FEATURE_STATS = {f"pitcher_{stat}_comp": stat for stat in FORM_STATS}
+FORM_FEATURES = list(FORM_FEATURE_STATS)
+
+# Every feature the training matrices have a column for; games from before the game logs have no form
+TRAINING_FEATURES = ALL_STAT_FEATURES + FORM_FEATURES
+
+# 1 if the home team won, 0 if the away team won
+LABEL = "winning_team"
+
+
+def stat_column(side: str, stat: str) -> pl.Expr:
+    """
+    :param side: "home" or "away"
+    :param stat: the name of the stat, e.g. "era"
+    :returns: the stat of one side's pitcher as a float; stats are stored as text by some writers
+    """
+    if stat == "k_bb_ratio":
+        k_nine = stat_column(side, "k_nine")
+        bb_nine = stat_column(side, "bb_nine")
+        return pl.when(bb_nine == 0).then(None).otherwise(k_nine / bb_nine)
+
+    return pl.col(f"{side}_pitcher_{stat}").cast(pl.Float64, strict=False)
+
+
+def feature_expressions() -> list:
+    """
+    :returns: an expression for every feature, named as in ALL_STAT_FEATURES
+    """
+    return [
+        (stat_column("away", stat) - stat_column("home", stat)).alias(feature)
+        for feature, stat in FEATURE_STATS.items()
+    ]
+
+
+def form_expressions() -> list:
+    """
+    :returns: an expression for every recent-form feature, named as in FORM_FEATURES
+    """
+    return [
+        (stat_column("away", stat) - stat_column("home", stat)).alias(feature)
+        for feature, stat in FORM_FEATURE_STATS.items()
+    ]
+
+
+def label_expression() -> pl.Expr:
+    """
+    :returns: an expression for the label; null if the game has no winner yet
+    """
+    return (pl.col("winning_team") == pl.col("home_team_id")).cast(pl.Int8).alias(LABEL)
+
+
+def rows_to_frame(rows: list, columns: list = None) -> pl.DataFrame:
+    """
+    Builds a frame from rows prepared for the games table
+
+    :param rows: tuples of values in the order of database.GAME_COLUMNS
+    :param columns: the columns of the rows, if they are not database.GAME_COLUMNS
+    :returns: the rows as a frame with the columns of the games table
+    """
+    return pl.DataFrame(
+        rows, schema=columns or GAME_COLUMNS, orient="row", infer_schema_length=None
+    )
+
+
+def build_features(
+    df: pl.DataFrame, label: bool = False, form: bool = False
+) -> pl.DataFrame:
+    """
+    Builds the features of every game in a frame
+
+    Games missing any feature in ALL_STAT_FEATURES (e.g. a pitcher with no walks, or no stats at
+    all) are dropped. Games missing recent form are kept, with nulls for it.
+
+    :param df: games with the columns of the games table
+    :param label: if True, also build the label and drop games that have no winner
+    :param form: if True, also build every feature in FORM_FEATURES; df must have the form columns
+    :returns: the game ID, every feature in ALL_STAT_FEATURES, the form features and the label if requested
+    """
+    columns = [pl.col("game_id"), *feature_expressions()]
+    required = list(ALL_STAT_FEATURES)
+
+    if form:
+        columns.extend(form_expressions())
+
+    if label:
+        columns.append(label_expression())
+        required.append(LABEL)
+
+    return df.select(columns).drop_nulls(required)
+
+
+def feature_matrix(features: pl.DataFrame, names: list = None) -> np.ndarray:
+    """
+    :param features: the output of build_features
+    :param names: the features to include, in order; defaults to ALL_STAT_FEATURES
+    :returns: the features as a float64 matrix with a row per game
+    """
+    return features.select(names or ALL_STAT_FEATURES).to_numpy().astype(np.float64)
@@ -1,16 +1,57 @@
-import boto3
+import time
+
+import_start_time = time.time()
+
 import json
 import os
 import psycopg2
-import smtplib, ssl
-import statsapi
 import structlog
-import tempfile
-import time
 
 from datetime import datetime, timedelta
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+from database import (
+    PREDICTION_COLUMNS,
+    STATUS_COLUMNS,
+    count_outcomes,
+    fetch_game_records,
+    fetch_games,
+    fetch_refresh_states,
+    update_columns,
+    update_predictions,
+    update_winners,
+    upsert_games,
+)
+from fanout import map_concurrently
+from games import (
+    FINAL_STATUSES,
+    PREGAME_STATUSES,
+    UNPLAYED_STATUSES,
+    build_game_record,
+    game_day,
+    lookup_winner,
+    prefetch_pitchers,
+    schedule_changes,
+)
+from instrumentation import log_summary, metrics, span
+from ledger import (
+    DONE,
+    FAILED,
+    PENDING,
+    STAGE_ROW,
+    done,
+    ensure_ledger,
+    read_ledger,
+    remaining,
+    write_ledger,
+)
+from log_sink import LogSink
+from pitchers import clear_stat_lines, fetch_all_season_stats, seed_stat_lines
+from schedule import get_schedule
+from side_effects import SideEffects, SmtpSession
+from snapshots import ensure_snapshots, read_stats_on, snapshot_exists, write_snapshot
+
+import_time = time.time() - import_start_time
 
 """
 This script will run daily at 5:00 AM.
@@ -18,6 +59,14 @@ This script will run daily at 5:00 AM.
 Tasks include:
  - Adding the day's games to the database
  - Updating yesterday's games with the winning team
+ - Ingesting the pitching lines of yesterday's finished games into the game log table
+
+Through the day, refresh_games can be invoked as often as needed to pick up changes to
+the day's probable pitchers and postponements (see run_refresh).
+
+The progress of every stage is recorded per game in the run ledger (see ledger.py), so
+a run that failed partway through can simply be invoked again, e.g. on a timer, and
+only the games that are left are processed.
 """
 # This code makes the script work on PythonAnywhere
 config_file_path = "config.env"
@@ -35,322 +84,232 @@ EMAIL_TO = os.getenv("MLB_GAMES_EMAIL_TO")
 S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
 PSQL_CONNECTION_STRING = os.getenv("PSQL_CONNECTION_STRING")
 TABLE_NAME = os.getenv("MLB_DB_TABLE_NAME")
+LEDGER_TABLE_NAME = os.getenv("MLB_LEDGER_TABLE_NAME") or f"{TABLE_NAME}_run_ledger"
+SNAPSHOT_TABLE_NAME = os.getenv("MLB_SNAPSHOT_TABLE_NAME", "pitcher_stat_snapshots")
+GAME_LOG_TABLE_NAME = os.getenv("MLB_GAME_LOG_TABLE_NAME", "pitcher_game_logs")
 LOGS_ACCESS_KEY_ID = os.getenv("LOGS_ACCESS_KEY_ID")
 LOGS_SECRET_ACCESS_KEY = os.getenv("LOGS_SECRET_ACCESS_KEY")
 LOGS_ENDPOINT_URL = os.getenv("LOGS_ENDPOINT_URL")
-
-current_time = str(datetime.now()).replace(" ", "_")[:19].replace(":", "-")
+MAX_WORKERS = int(os.getenv("MLB_MAX_WORKERS", "8"))
+# Set to a date (%m/%d/%Y) to run the pipeline as if it were that day, e.g. when replaying a captured day
+RUN_DATE = os.getenv("MLB_RUN_DATE")
+PROMETHEUS_METRICS = os.getenv("MLB_PROMETHEUS_METRICS", "false").lower() == "true"
+MODEL_ACCESS_KEY_ID = os.getenv("MODEL_ACCESS_KEY_ID")
+MODEL_SECRET_ACCESS_KEY = os.getenv("MODEL_SECRET_ACCESS_KEY")
+MODEL_BUCKET = os.getenv("MODEL_BUCKET")
+MODEL_PREFIX = os.getenv("MLB_MODEL_PREFIX", "models")
+MODEL_CACHE_PATH = os.getenv("MLB_MODEL_CACHE_PATH", "/tmp/models")
+# Set to the directory of a model artifact to use it instead of the latest one in MODEL_BUCKET
+MODEL_PATH = os.getenv("MLB_MODEL_PATH")
+# How long the end of a run waits for its emails and uploads, in seconds
+SIDE_EFFECT_DEADLINE = float(os.getenv("MLB_SIDE_EFFECT_DEADLINE", "30"))
+SIDE_EFFECT_WORKERS = 4
+SMTP_HOST = "smtp.gmail.com"
+SMTP_PORT = 465
+
+current_time = None
+run_log = None
 updated = []
 prepared = []
-
-s3 = boto3.resource(
-    service_name="s3",
-    aws_access_key_id=LOGS_ACCESS_KEY_ID,
-    aws_secret_access_key=LOGS_SECRET_ACCESS_KEY,
-    endpoint_url=LOGS_ENDPOINT_URL,
-)
-
-connection_string = PSQL_CONNECTION_STRING
-
-aws_psql_conn = psycopg2.connect(connection_string)
-
-
-def lookup_player(player: str) -> str:
-    """
-    Gets the ID of a player specified by name
-
-    :param player: the ID of the player whose information is being accessed
-    :returns: the player ID for the specified name
+prepared_records = []
+predicted = []
+# The stages that had already been completed by an earlier run
+completed_stages = []
+# The errors of the run, sent as a single digest at the end
+errors = []
+# The run's background emails and uploads, and the SMTP connection they share
+side_effects = None
+smtp = None
+
+# Clients are created on first use and reused while the Lambda container stays warm
+s3 = None
+aws_psql_conn = None
+model_s3 = None
+models = None
+models_etag = None
+tables_ready = False
+# Whether the database connection has been checked to be alive during this invocation
+connection_checked = False
+cold_start = True
+init_times = {}
+
+
+def get_s3():
     """
-    try:
-        return statsapi.lookup_player(player)[0]["id"]
-    except IndexError:
-        print(f"Unable to get ID for pitcher {player}")
-        return None
+    Gets the S3 resource, creating it on first use
 
+    boto3 is imported here rather than at the top of the file so that its import cost is only paid when logs are uploaded.
 
-def get_ERA(pitcher: str) -> float:
+    :returns: the S3 resource
     """
-    Gets the ERA for a pitcher
+    global s3
 
-    :param pitcher: the name of the pitcher whose ERA is being accessed
-    :returns: the ERA for the given pitcher as a float to two decimal places; None if pitcher's ID cannot be found
-    """
-    pitcher_id = lookup_player(pitcher)
+    if s3 is None:
+        start_time = time.time()
+        import boto3
 
-    if pitcher_id:
-        try:
-            pitcher_stats = statsapi.player_stat_data(
-                personId=pitcher_id, group="pitching", type="season", sportId=1
-            )["stats"][0]["stats"]
-
-            return format(float(pitcher_stats["era"]), ".2f")
-        except IndexError:
-            print(f"Unable to get ERA for pitcher {pitcher}")
-            return None
-    else:
-        return None
+        s3 = boto3.resource(
+            service_name="s3",
+            aws_access_key_id=LOGS_ACCESS_KEY_ID,
+            aws_secret_access_key=LOGS_SECRET_ACCESS_KEY,
+            endpoint_url=LOGS_ENDPOINT_URL,
+        )
+        init_times["s3"] = time.time() - start_time
 
+    return s3
 
-def get_win_percentage(pitcher: str) -> float:
-    """
-    Gets the win percentage for a pitcher
 
-    :param pitcher: the name of the pitcher whose win percentage is being accessed
-    :returns: the win percentage for the given pitcher as a float to two decimal places; None if pitcher's ID cannot be found
+def get_db_connection():
     """
-    pitcher_id = lookup_player(pitcher)
-
-    if pitcher_id:
-        try:
-            pitcher_stats = statsapi.player_stat_data(
-                personId=pitcher_id, group="pitching", type="season", sportId=1
-            )["stats"][0]["stats"]
-            try:
-                return format(float(pitcher_stats["winPercentage"]), ".3f")
-            except ValueError:
-                return None
-        except IndexError:
-            print(f"Unable to get win percentage for pitcher {pitcher}")
-            return None
-    else:
-        return None
-
+    Gets the database connection, reconnecting if the connection from a previous invocation is no longer alive
 
-def get_losses(pitcher: str) -> int:
-    """
-    Gets the pitcher's losses
+    The connection is only checked the first time it is used in an invocation.
 
-    :param pitcher: the name of the pitcher whose losses are being accessed
-    :returns: the pitcher's losses as an int; None if pitcher's ID cannot be found
+    :returns: the database connection
     """
-    pitcher_id = lookup_player(pitcher)
+    global aws_psql_conn, connection_checked
 
-    if pitcher_id:
+    if aws_psql_conn is not None and not aws_psql_conn.closed:
+        if connection_checked:
+            return aws_psql_conn
         try:
-            pitcher_stats = statsapi.player_stat_data(
-                personId=pitcher_id, group="pitching", type="season", sportId=1
-            )["stats"][0]["stats"]
+            with aws_psql_conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            aws_psql_conn.rollback()
+            connection_checked = True
+            return aws_psql_conn
+        except psycopg2.Error:
+            print("Database connection is no longer alive, reconnecting...")
             try:
-                return int(pitcher_stats["losses"])
-            except ValueError:
-                return None
-        except IndexError:
-            print(f"Unable to get losses for pitcher {pitcher}")
-            return None
-    else:
-        return None
+                aws_psql_conn.close()
+            except psycopg2.Error:
+                pass
 
+    start_time = time.time()
+    aws_psql_conn = psycopg2.connect(PSQL_CONNECTION_STRING)
+    connection_checked = True
+    init_times["database"] = time.time() - start_time
 
-def get_wins(pitcher: str) -> int:
-    """
-    Gets the pitcher's wins
-
-    :param pitcher: the name of the pitcher whose wins are being accessed
-    :returns: the pitcher's wins as an int; None if pitcher's ID cannot be found
-    """
-    pitcher_id = lookup_player(pitcher)
+    return aws_psql_conn
 
-    if pitcher_id:
-        try:
-            pitcher_stats = statsapi.player_stat_data(
-                personId=pitcher_id, group="pitching", type="season", sportId=1
-            )["stats"][0]["stats"]
-            try:
-                return int(pitcher_stats["wins"])
-            except ValueError:
-                return None
-        except IndexError:
-            print(f"Unable to get wins for pitcher {pitcher}")
-            return None
-    else:
-        return None
 
+def get_pipeline_connection():
+    """
+    Gets the database connection on first use: migrates the games table, creates the current season's partition, and creates the run ledger, stat snapshot and game log tables
 
-def get_IP(pitcher: str) -> float:
+    :returns: the database connection
     """
-    Gets the number of innings pitched for a pitcher.
+    global tables_ready
 
-    Because innings pitched are counted with .0, .1, .2, where 1, and 2 are outs, the decimal point will be multipled by 3 for later computation purposes.
+    conn = get_db_connection()
+    if not tables_ready:
+        from game_logs import ensure_game_logs
+        from migrations import ensure_partitions, migrate
 
-    :param pitcher: the name of the pitcher whose IP are being accessed
-    :returns: the innings pitched as a float to one decimal place; None if pitcher's ID cannot be found
-    """
-    pitcher_id = lookup_player(pitcher)
+        migrate(conn, TABLE_NAME)
+        ensure_partitions(conn, TABLE_NAME, [run_date().year])
+        ensure_ledger(conn, LEDGER_TABLE_NAME)
+        ensure_snapshots(conn, SNAPSHOT_TABLE_NAME)
+        ensure_game_logs(conn, GAME_LOG_TABLE_NAME)
+        tables_ready = True
 
-    if pitcher_id:
-        try:
-            pitcher_stats = statsapi.player_stat_data(
-                personId=pitcher_id, group="pitching", type="season", sportId=1
-            )["stats"][0]["stats"]
-            try:
-                IP = pitcher_stats["inningsPitched"]
-                outs = IP.split(".")[1]
-                outs = int(outs) * 3
-                IP = f'{IP.split(".")[0]}.{outs}'
-                IP_formatted = float(IP)
-                return IP_formatted
-            except ValueError:
-                return None
-        except IndexError:
-            print(f"Unable to get innings pitched for pitcher {pitcher}")
-            return None
-    else:
-        return None
+    return conn
 
 
-def get_K9(pitcher: str) -> float:
+def get_model_s3():
     """
-    Gets the strikeouts per 9 innings.
+    Gets the S3 client for the model bucket, creating it on first use
 
-    :param pitcher: the name of the pitcher whose IP are being accessed
-    :returns: the K/9 as a float; None if pitcher's ID cannot be found
+    :returns: the S3 client
     """
-    pitcher_id = lookup_player(pitcher)
+    global model_s3
 
-    if pitcher_id:
-        try:
-            pitcher_stats = statsapi.player_stat_data(
-                personId=pitcher_id, group="pitching", type="season", sportId=1
-            )["stats"][0]["stats"]
-            try:
-                K9 = pitcher_stats["strikeoutsPer9Inn"]
-                return float(K9)
-            except ValueError:
-                return None
-        except IndexError:
-            print(f"Unable to get K/9 for pitcher {pitcher}")
-            return None
-    else:
-        return None
+    if model_s3 is None:
+        start_time = time.time()
+        import boto3
 
+        model_s3 = boto3.client(
+            service_name="s3",
+            aws_access_key_id=MODEL_ACCESS_KEY_ID,
+            aws_secret_access_key=MODEL_SECRET_ACCESS_KEY,
+            endpoint_url=LOGS_ENDPOINT_URL,
+        )
+        init_times["model_s3"] = time.time() - start_time
 
-def get_BB9(pitcher: str) -> float:
-    """
-    Gets the number of walks per 9 innings
+    return model_s3
 
-    :param pitcher: the name of the pitcher whose IP are being accessed
-    :returns: the BB/9 pitched as a float; None if pitcher's ID cannot be found
-    """
-    pitcher_id = lookup_player(pitcher)
 
-    if pitcher_id:
-        try:
-            pitcher_stats = statsapi.player_stat_data(
-                personId=pitcher_id, group="pitching", type="season", sportId=1
-            )["stats"][0]["stats"]
-            try:
-                bb9 = pitcher_stats["walksPer9Inn"]
-                return float(bb9)
-            except ValueError:
-                return None
-        except IndexError:
-            print(f"Unable to get BB/9 for pitcher {pitcher}")
-            return None
-    else:
-        return None
-
-
-def get_K_BB_diff(pitcher: str) -> float:
+def get_models() -> dict:
     """
-    Gets the strikeout percentage minus the walk percentage of a pitcher
+    Gets the latest models, only downloading and loading them when a new version has been published
 
-    :param pitcher: the name of the pitcher whose IP are being accessed
-    :returns: the K% - BB% as a float; None if pitcher's ID cannot be found
+    :returns: the models, as returned by model_artifact.read_artifact; None if there are no models to use
     """
-    pitcher_id = lookup_player(pitcher)
+    global models, models_etag
 
-    if pitcher_id:
-        try:
-            pitcher_stats = statsapi.player_stat_data(
-                personId=pitcher_id, group="pitching", type="season", sportId=1
-            )["stats"][0]["stats"]
-            try:
-                k_perc = float(pitcher_stats["strikeOuts"]) / float(
-                    pitcher_stats["battersFaced"]
-                )
-                bb_perc = float(pitcher_stats["baseOnBalls"]) / float(
-                    pitcher_stats["battersFaced"]
-                )
-                diff = k_perc - bb_perc
-                return diff
-            except ValueError:
-                return None
-        except IndexError:
-            print(f"Unable to get K% - BB% for pitcher {pitcher}")
-            return None
-    else:
-        return None
+    from model_artifact import read_artifact, sync_artifact
 
+    if MODEL_PATH:
+        if models is None:
+            start_time = time.time()
+            models = read_artifact(MODEL_PATH)
+            init_times["models"] = time.time() - start_time
+        return models
 
-def get_WHIP(pitcher: str) -> float:
-    """
-    Gets the walks and hits per innings pitched for a pitcher.
+    if not MODEL_BUCKET:
+        return None
 
-    :param pitcher: the name of the pitcher whose IP are being accessed
-    :returns: the WHIP as a float; None if pitcher's ID cannot be found
-    """
-    pitcher_id = lookup_player(pitcher)
+    etag, directory = sync_artifact(
+        get_model_s3(), MODEL_BUCKET, MODEL_PREFIX, MODEL_CACHE_PATH, models_etag
+    )
+    if directory is not None:
+        start_time = time.time()
+        models = read_artifact(directory)
+        models_etag = etag
+        init_times["models"] = time.time() - start_time
 
-    if pitcher_id:
-        try:
-            pitcher_stats = statsapi.player_stat_data(
-                personId=pitcher_id, group="pitching", type="season", sportId=1
-            )["stats"][0]["stats"]
-            try:
-                WHIP = pitcher_stats["whip"]
-                return float(WHIP)
-            except ValueError:
-                return None
-        except IndexError:
-            print(f"Unable to get WHIP for pitcher {pitcher}")
-            return None
-    else:
-        return None
+    return models
 
 
-def get_BABIP(pitcher: str) -> float:
+def run_date() -> datetime:
     """
-    Gets the batting average on balls in play for a pitcher.
-
-    More on BABIP: https://library.fangraphs.com/pitching/babip/
+    Gets the day the pipeline is running for
 
-    :param pitcher: the name of the pitcher whose IP are being accessed
-    :returns: the BABIP as a float; None if pitcher's ID cannot be found
+    :returns: MLB_RUN_DATE if it is set; otherwise now
     """
-    pitcher_id = lookup_player(pitcher)
+    if RUN_DATE:
+        return datetime.strptime(RUN_DATE, "%m/%d/%Y")
 
-    if pitcher_id:
-        try:
-            pitcher_stats = statsapi.player_stat_data(
-                personId=pitcher_id, group="pitching", type="season", sportId=1
-            )["stats"][0]["stats"]
-            try:
-                hits = float(pitcher_stats["hits"])
-                home_runs = float(pitcher_stats["homeRuns"])
-                at_bats = float(pitcher_stats["atBats"])
-                strikeouts = float(pitcher_stats["strikeOuts"])
-                sac_flies = float(pitcher_stats["sacFlies"])
-
-                BABIP = (hits - home_runs) / (
-                    at_bats - strikeouts - home_runs + sac_flies
-                )
-
-                return BABIP
-            except ValueError:
-                return None
-        except IndexError:
-            print(f"Unable to get BABIP for pitcher {pitcher}")
-            return None
-    else:
-        return None
+    return datetime.now()
 
 
-def config_struct_log(file_name: str) -> structlog:
+def reset_run_state():
+    """
+    Resets everything that is tracked per run, so that nothing carries over between warm invocations
+    """
+    global connection_checked, current_time, run_log, side_effects, smtp
+
+    connection_checked = False
+    current_time = str(datetime.now()).replace(" ", "_")[:19].replace(":", "-")
+    run_log = LogSink()
+    config_struct_log(run_log)
+    updated.clear()
+    prepared.clear()
+    prepared_records.clear()
+    predicted.clear()
+    completed_stages.clear()
+    errors.clear()
+    side_effects = SideEffects(SIDE_EFFECT_WORKERS)
+    smtp = SmtpSession(SMTP_HOST, SMTP_PORT, EMAIL_FROM, EMAIL_PASSWORD)
+    clear_stat_lines()
+    metrics.clear()
+
+
+def config_struct_log(file_name) -> structlog:
     """
     Configures the structured logging.
 
-    :param file_name: the file to write the logs to
+    :param file_name: the file-like object to write the logs to
     :returns: an instance of of the structlog
     """
     structlog.configure(
@@ -367,6 +326,7 @@ def config_struct_log(file_name: str) -> structlog:
 def send_email():
     prepared_html_list = ""
     updated_html_list = ""
+    predicted_html_list = ""
 
     for game in prepared:
         prepared_html_list = prepared_html_list + f"<li>{game}</li>"
@@ -374,6 +334,9 @@ def send_email():
     for game in updated:
         updated_html_list = updated_html_list + f"<li>{game}</li>"
 
+    for game in predicted:
+        predicted_html_list = predicted_html_list + f"<li>{game}</li>"
+
     html = f"""
         <h1 id="mlb-pipeline-today-">MLB Pipeline {datetime.now().strftime("%m/%d/%Y")}</h1>
             <h2 id="games-updated">Games Updated</h2>
@@ -382,292 +345,851 @@ def send_email():
             <h2 id="games-prepared">Games Prepared</h2>
                 <p>There were {len(prepared)} games added:</p>
                 <p><ul>{prepared_html_list}</ul></p>
+            <h2 id="games-predicted">Games Predicted</h2>
+                <p>There were {len(predicted)} games predicted:</p>
+                <p><ul>{predicted_html_list}</ul></p>
             <p><em>Email sent {datetime.now().strftime("%m/%d/%Y %H:%M:%S")}</em></p>
         """
 
-    email_message = MIMEMultipart()
-    email_message["From"] = EMAIL_FROM
-    email_message["To"] = EMAIL_TO
-    email_message["Subject"] = f"MLB Pipeline Update"
+    send_message("MLB Pipeline Update", html)
 
-    email_message.attach(MIMEText(html, "html"))
-    email_string = email_message.as_string()
 
-    context = ssl.create_default_context()
-    with smtplib.SMTP_SSL("smtp.gmail.com", 465, context=context) as server:
-        server.login(EMAIL_FROM, EMAIL_PASSWORD)
-        server.sendmail(EMAIL_FROM, EMAIL_TO, email_string)
+def record_error(method: str, error: Exception):
+    """
+    Adds an error to the digest sent at the end of the run
 
-    print(f"\nEmail sent to {EMAIL_TO}.")
+    :param method: where the error occurred, e.g. "update_games()"
+    :param error: the error
+    """
+    errors.append((method, error, datetime.now()))
 
 
-def send_error_email(method, error):
-    html = f"""
-        <h1 id="mlb-pipeline-today-">MLB Pipeline {datetime.now().strftime("%m/%d/%Y")}</h1>
-            <p>There was an error when trying to run the pipeline. Please see below:</p>
+def send_error_digest():
+    """
+    Sends every error of the run in a single email
+    """
+    sections = "".join(f"""
             <h2 id="where">Where</h2>
             <p>The error occurred in {method}</p>
             <h2 id="what">What</h2>
             <p>Error message: </br> {error}</p>
             <h2 id="when">When</h2>
-            <p>The error occurred at {datetime.now()}</p>
-
+            <p>The error occurred at {occurred_at}</p>
+        """ for method, error, occurred_at in errors)
+    html = f"""
+        <h1 id="mlb-pipeline-today-">MLB Pipeline {datetime.now().strftime("%m/%d/%Y")}</h1>
+            <p>There {"was an error" if len(errors) == 1 else f"were {len(errors)} errors"} when trying to run the pipeline. Please see below:</p>
+            {sections}
         """
 
+    send_message("MLB Pipeline ERROR", html)
+
+
+def send_message(subject: str, html: str):
+    """
+    Sends an HTML email over the run's SMTP connection
+
+    :param subject: the subject of the email
+    :param html: the body of the email
+    """
     email_message = MIMEMultipart()
     email_message["From"] = EMAIL_FROM
     email_message["To"] = EMAIL_TO
-    email_message["Subject"] = f"MLB Pipeline ERROR"
+    email_message["Subject"] = subject
 
     email_message.attach(MIMEText(html, "html"))
     email_string = email_message.as_string()
 
-    context = ssl.create_default_context()
-    with smtplib.SMTP_SSL("smtp.gmail.com", 465, context=context) as server:
-        server.login(EMAIL_FROM, EMAIL_PASSWORD)
-        server.sendmail(EMAIL_FROM, EMAIL_TO, email_string)
+    with span("email_send", subject=subject) as s:
+        s["bytes"] = len(email_string)
+        smtp.send(EMAIL_FROM, EMAIL_TO, email_string)
 
     print(f"\nEmail sent to {EMAIL_TO}.")
 
 
-def send_error_email(method, error):
-    html = f"""
-        <h1 id="mlb-pipeline-today-">MLB Pipeline {datetime.now().strftime("%m/%d/%Y")}</h1>
-            <p>There was an error when trying to run the pipeline. Please see below:</p>
-            <h2 id="where">Where</h2>
-            <p>The error occurred in {method}</p>
-            <h2 id="what">What</h2>
-            <p>Error message: </br> {error}</p>
-            <h2 id="when">When</h2>
-            <p>The error occurred at {datetime.now()}</p>
+def log_key() -> str:
+    """
+    Gets the key of the run's log object, partitioned by date so that downstream queries can scan a single day
 
-        """
+    :returns: the key of the log object
+    """
+    return f"logs/date={current_time[:10]}/{current_time}.jsonl.gz"
 
-    email_message = MIMEMultipart()
-    email_message["From"] = EMAIL_FROM
-    email_message["To"] = EMAIL_TO
-    email_message["Subject"] = f"MLB Pipeline ERROR"
 
-    email_message.attach(MIMEText(html, "html"))
-    email_string = email_message.as_string()
+def ship_run_log():
+    """
+    Writes the run's summary event and uploads the run's logs as a single compressed object
 
-    context = ssl.create_default_context()
-    with smtplib.SMTP_SSL("smtp.gmail.com", 465, context=context) as server:
-        server.login(EMAIL_FROM, EMAIL_PASSWORD)
-        server.sendmail(EMAIL_FROM, EMAIL_TO, email_string)
+    If MLB_PROMETHEUS_METRICS is enabled, the run's metrics are also uploaded as Prometheus text next to the logs.
+    """
+    log_summary(structlog.get_logger())
+
+    key = log_key()
+    s3_client = get_s3().meta.client
+    if PROMETHEUS_METRICS:
+        # Uploaded in the background, alongside the logs
+        side_effects.submit(
+            "metrics upload",
+            s3_client.put_object,
+            Bucket=S3_BUCKET_NAME,
+            Key=key.replace(".jsonl.gz", ".prom"),
+            Body=metrics.to_prometheus().encode(),
+        )
 
-    print(f"\nEmail sent to {EMAIL_TO}.")
+    with span("s3_upload", key=key) as s:
+        s["bytes"] = run_log.upload(s3_client, S3_BUCKET_NAME, key)
+    print(
+        f"{run_log.lines} log line(s) ({s['bytes']} bytes compressed) have been successfully uploaded to {S3_BUCKET_NAME} as {key}\n"
+    )
 
 
-def update_games():
-    start_time = time.time()
+def finish_run(notify: bool):
+    """
+    Sends the run's email and ships its logs, waiting for every side effect of the run up to SIDE_EFFECT_DEADLINE
 
-    temp = tempfile.NamedTemporaryFile(prefix=current_time, suffix="_temp", mode="w")
+    :param notify: whether to send the summary email; the error digest is sent instead if the run had errors
+    """
+    deadline = time.time() + SIDE_EFFECT_DEADLINE
+
+    if errors:
+        side_effects.submit("error digest", send_error_digest)
+    elif notify:
+        side_effects.submit("summary email", send_email)
+
+    # The emails are waited for before the logs are shipped so that their spans are in the logs
+    results = side_effects.wait(deadline - time.time())
+    structlog.get_logger().info(
+        event="side_effects",
+        done=results["done"],
+        failed=[name for name, _ in results["failed"]],
+        pending=results["pending"],
+    )
 
-    logger = config_struct_log(temp)
+    try:
+        ship_run_log()
+    except Exception as e:
+        print(f"Error occurred uploading the run's logs: {e}")
 
-    yesterday = datetime.now() - timedelta(1)
-    yesterday = datetime.strftime(yesterday, "%m/%d/%Y")
+    results = side_effects.close(deadline - time.time())
+    smtp.close()
 
-    try:
-        sched = statsapi.schedule(date=yesterday)
-    except:
-        print(f"An error occurred when trying to get games for {yesterday}")
-    # sched = statsapi.schedule(date="8/25/2022")  # use for testing purposes
+    for name, error in results["failed"]:
+        print(f"Error occurred in side effect {name}: {error}")
+    for name in results["pending"]:
+        print(
+            f"Side effect {name} did not finish within {SIDE_EFFECT_DEADLINE} seconds."
+        )
 
-    cursor = aws_psql_conn.cursor()
 
-    sql = f"UPDATE {TABLE_NAME} set winning_team=(%s) where game_id=(%s)"
-    for i, game in enumerate(sched):
-        print(f"Updating: {i + 1} of {len(sched)}...")
+def print_timing(
+    stage: str,
+    start_time: float,
+    fetch_time: float = None,
+    sequential_time: float = None,
+):
+    """
+    Prints how long a stage took, alongside how long its network calls would have taken without concurrency
 
-        try:
-            winning_team = (
-                statsapi.lookup_team(game["winning_team"])[0]["id"]
-                if "winning_team" in game
-                else None
-            )
-        except Exception:
-            print(
-                "There is no winning team, implying that this game may have ended in a tie. Winner has been set to None."
-            )
-            winning_team = None
+    :param stage: the name of the stage, e.g. "update games"
+    :param start_time: the time the stage started
+    :param fetch_time: the wall time of the stage's concurrent calls in seconds, if it made any
+    :param sequential_time: the summed time of the stage's concurrent calls in seconds, if it made any
+    """
+    concurrency = (
+        f"\nTime spent on API calls with {MAX_WORKERS} worker(s): {timedelta(seconds=fetch_time)}, without concurrency: {timedelta(seconds=sequential_time)}"
+        if fetch_time is not None
+        else ""
+    )
+    print(
+        f"------------------------------------------------\nFinished {stage} at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}.\nTotal time to {stage}: {timedelta(seconds=(time.time() - start_time))}{concurrency}\n------------------------------------------------"
+    )
 
-        record_to_insert = (
-            winning_team,
-            game["game_id"],
-        )
 
-        if winning_team is not None:
-            winning_team_name = statsapi.lookup_team(winning_team)[0]["name"]
-        else:
-            winning_team_name = "n/a"
-        updated.append(
-            f'{winning_team_name} won Game {game["game_id"]}. The winner has been set to {winning_team}.'
-        )
+def update_games():
+    start_time = time.time()
 
-        cursor.execute(
-            sql,
-            (record_to_insert),
-        )
-        aws_psql_conn.commit()
+    logger = structlog.get_logger()
 
-        print(
-            cursor.rowcount,
-            f"record(s) inserted successfully into {TABLE_NAME} table.\n",
+    ledger_date = (run_date() - timedelta(1)).date()
+    yesterday = ledger_date.strftime("%m/%d/%Y")
+
+    conn = get_pipeline_connection()
+    statuses = read_ledger(conn, LEDGER_TABLE_NAME, ledger_date, "update")
+    if statuses.get(STAGE_ROW) == DONE:
+        print(f"Games for {yesterday} have already been updated.")
+        completed_stages.append("update")
+        return None
+
+    try:
+        sched = get_schedule(date=yesterday)
+    except Exception as e:
+        # Without the schedule there is nothing to update, so the stage fails rather than carrying on
+        raise RuntimeError(f"Could not get games for {yesterday}: {e}") from e
+    # sched = get_schedule(date="8/25/2022")  # use for testing purposes
+    game_ids = set(remaining(statuses, [game["game_id"] for game in sched]))
+    sched = [game for game in sched if game["game_id"] in game_ids]
+
+    winners = [lookup_winner(game) for game in sched]
+
+    records = [
+        (winning_team, game["game_id"])
+        for game, (winning_team, _) in zip(sched, winners)
+    ]
+    # Games that are still being played are left pending so that the next run updates them
+    game_statuses = {
+        game["game_id"]: (
+            DONE
+            if winning_team is not None
+            or game["status"] in FINAL_STATUSES + UNPLAYED_STATUSES
+            else PENDING
         )
+        for game, (winning_team, _) in zip(sched, winners)
+    }
+    game_statuses[STAGE_ROW] = PENDING if PENDING in game_statuses.values() else DONE
 
+    outcomes = update_winners(conn, TABLE_NAME, records, commit=False)
+    write_ledger(conn, LEDGER_TABLE_NAME, ledger_date, "update", game_statuses)
+    counts = count_outcomes(outcomes)
+    print(
+        f"{counts['updated']} record(s) updated and {counts['skipped']} skipped in {TABLE_NAME} table.\n"
+    )
+
+    for game, (winning_team, winning_team_name), record in zip(sched, winners, records):
+        updated.append(
+            f'{winning_team_name} won Game {game["game_id"]}. The winner has been set to {winning_team}.'
+        )
         logger.info(
             event="game_updated",
             game_id=game["game_id"],
             away_team=game["away_name"],
             home_team=game["home_name"],
             game_date=game["game_date"],
-            winning_team=record_to_insert,
+            winning_team=record,
+            outcome=outcomes[game["game_id"]],
         )
 
-    key = f"{current_time}_updated_games"
+    logger.info(event="games_updated", **counts)
+    print_timing("update games", start_time)
+
+
+def ingest_game_logs():
+    start_time = time.time()
+
+    logger = structlog.get_logger()
+
+    ledger_date = (run_date() - timedelta(1)).date()
+    yesterday = ledger_date.strftime("%m/%d/%Y")
+
+    conn = get_pipeline_connection()
+    statuses = read_ledger(conn, LEDGER_TABLE_NAME, ledger_date, "game_logs")
+    if statuses.get(STAGE_ROW) == DONE:
+        print(f"Game logs for {yesterday} have already been ingested.")
+        return None
+
+    from game_logs import fetch_game_logs, ingested_game_ids, write_game_logs
+
+    try:
+        sched = get_schedule(date=yesterday)
+    except Exception as e:
+        raise RuntimeError(f"Could not get games for {yesterday}: {e}") from e
+    # Only finished games have complete lines; games still being played are ingested by a later run
+    game_ids = set(remaining(statuses, [game["game_id"] for game in sched]))
+    finished = [
+        game
+        for game in sched
+        if game["game_id"] in game_ids and game["status"] in FINAL_STATUSES
+    ]
+    # Games already stored, e.g. by a backfill or a run that failed after writing them, are not fetched again
+    ingested = ingested_game_ids(
+        conn, GAME_LOG_TABLE_NAME, [game["game_id"] for game in finished]
+    )
+    to_fetch = [game for game in finished if game["game_id"] not in ingested]
+
+    game_errors = {}
+
+    def fetch(game: dict) -> list:
+        try:
+            return fetch_game_logs(game["game_id"], game_day(game))
+        except Exception as e:
+            print(
+                f"Error occurred fetching the boxscore of game {game['game_id']}: {e}"
+            )
+            game_errors[game["game_id"]] = str(e)
+            return []
+
+    fetch_start_time = time.time()
+    lines, sequential_time = map_concurrently(fetch, to_fetch, MAX_WORKERS)
+    fetch_time = time.time() - fetch_start_time
+
+    game_statuses = {
+        game["game_id"]: FAILED if game["game_id"] in game_errors else DONE
+        for game in finished
+    }
+    game_statuses.update(
+        {
+            game["game_id"]: DONE
+            for game in sched
+            if game["game_id"] in game_ids and game["status"] in UNPLAYED_STATUSES
+        }
+    )
+    all_done = len(game_statuses) == len(game_ids) and not game_errors
+    game_statuses[STAGE_ROW] = DONE if all_done else PENDING
 
-    s3.meta.client.upload_file(
-        Filename=temp.name,
-        Bucket=S3_BUCKET_NAME,
-        Key=key,
+    stored = write_game_logs(
+        conn, GAME_LOG_TABLE_NAME, [row for rows in lines for row in rows], commit=False
+    )
+    write_ledger(
+        conn, LEDGER_TABLE_NAME, ledger_date, "game_logs", game_statuses, game_errors
     )
-    print(f"{temp.name} has been successfully uploaded to {S3_BUCKET_NAME} as {key}\n")
     print(
-        f"------------------------------------------------\nFinished updating games at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}.\nTotal time to update games: {timedelta(seconds=(time.time() - start_time))}\n------------------------------------------------"
+        f"{stored} pitching line(s) from {len(to_fetch) - len(game_errors)} game(s) stored in {GAME_LOG_TABLE_NAME} table, {len(ingested)} game(s) already stored.\n"
+    )
+
+    for game_id, error in game_errors.items():
+        logger.error(
+            event="game_failed", stage="ingest_game_logs", game_id=game_id, error=error
+        )
+    logger.info(
+        event="game_logs_ingested",
+        games=len(to_fetch) - len(game_errors),
+        already_ingested=len(ingested),
+        lines=stored,
+        failed=len(game_errors),
+    )
+
+    print_timing("ingest game logs", start_time, fetch_time, sequential_time)
+
+    if game_errors:
+        raise RuntimeError(
+            f"The boxscores of {len(game_errors)} game(s) could not be fetched and will be retried on the next run"
+        )
+
+
+def store_records(conn, sched: list, records: list, day) -> dict:
+    """
+    Writes the rows of games, along with their pitchers' recent form and their status, without committing
+
+    :param conn: the database connection
+    :param sched: the games from the schedule
+    :param records: the rows of the games, in the order of GAME_COLUMNS
+    :param day: the day of the games
+    :returns: the output of upsert_games
+    """
+    from game_logs import FORM_COLUMNS, derive_form
+
+    no_form = (None,) * len(FORM_COLUMNS)
+    try:
+        form = {
+            row[0]: row[1:]
+            for row in derive_form(
+                conn, GAME_LOG_TABLE_NAME, records, day.replace(month=1, day=1), day
+            )
+        }
+        with_form = sum(values != no_form for values in form.values())
+        print(f"Recent form of {with_form} game(s) derived from the game logs.")
+    except Exception as e:
+        # The games are stored without their form, which the models do not depend on
+        print(f"Error occurred deriving recent form from the game logs: {e}")
+        conn.rollback()
+        form = {}
+
+    statuses = {game["game_id"]: game["status"] for game in sched}
+    outcomes = upsert_games(conn, TABLE_NAME, records, commit=False)
+    update_columns(
+        conn,
+        TABLE_NAME,
+        {**FORM_COLUMNS, **STATUS_COLUMNS},
+        [
+            (record[0], *form.get(record[0], no_form), statuses[record[0]])
+            for record in records
+        ],
+        "update_form",
+        commit=False,
     )
 
+    return outcomes
+
+
+def learn_games():
+    global models
+
+    start_time = time.time()
+
+    logger = structlog.get_logger()
+
+    ledger_date = (run_date() - timedelta(1)).date()
+
+    conn = get_pipeline_connection()
+    game_ids = remaining(
+        read_ledger(conn, LEDGER_TABLE_NAME, ledger_date, "learn"),
+        done(read_ledger(conn, LEDGER_TABLE_NAME, ledger_date, "update")),
+    )
+    if not game_ids:
+        print("There are no newly finished games to learn from.")
+        return None
+
+    from online import ONLINE_MODEL, learn, save
+
+    current_models = get_models()
+    if current_models is None or ONLINE_MODEL not in current_models:
+        print("There is no online model to update, skipping online learning.")
+        return None
+
+    rows = fetch_games(conn, TABLE_NAME, game_ids)
+    learned_models, learned = learn(current_models, rows)
+    if not learned:
+        print("None of the finished games could be learned from.")
+        write_ledger(
+            conn,
+            LEDGER_TABLE_NAME,
+            ledger_date,
+            "learn",
+            {game_id: DONE for game_id in game_ids},
+        )
+        return None
+
+    from model_artifact import publish_artifact, read_artifact
+
+    version = f"{current_time}-online"
+    directory = os.path.join(MODEL_CACHE_PATH, version)
+    save(learned_models, directory, version)
+    if MODEL_PATH:
+        print(
+            f"Models are loaded from {MODEL_PATH}, so version {version} has only been saved to {directory}."
+        )
+    else:
+        publish_artifact(get_model_s3(), directory, MODEL_BUCKET, MODEL_PREFIX)
+    models = read_artifact(directory)
+    # Only recorded once the new version is published, so a failed publish is learned again on the next run
+    write_ledger(
+        conn,
+        LEDGER_TABLE_NAME,
+        ledger_date,
+        "learn",
+        {game_id: DONE for game_id in game_ids},
+    )
+
+    print(f"Online model updated with {learned} game(s) as version {version}.\n")
+    logger.info(event="model_updated", version=version, games=learned)
+
+    print_timing("learn games", start_time)
+
+
+def load_stat_snapshot(conn, sched: list, snapshot_date, take_snapshot: bool) -> int:
+    """
+    Puts the stat lines of the day's pitchers into the memo from the snapshot store, taking the day's snapshot first if it has not been taken
+
+    Pitchers the snapshot does not have (e.g. pitchers making their debut) are left to be fetched one by one.
+
+    :param conn: the database connection
+    :param sched: the day's games
+    :param snapshot_date: the day
+    :param take_snapshot: whether the day's snapshot may be taken, i.e. none of the day's games have started
+    :returns: the number of pitchers whose stat lines came from the snapshot
+    """
+    pitchers = [
+        (game[f"{side}_probable_pitcher"], game[f"{side}_probable_pitcher_id"])
+        for game in sched
+        for side in ("home", "away")
+        if game[f"{side}_probable_pitcher_id"]
+    ]
+    if not pitchers:
+        return 0
+
+    pitcher_ids = [pitcher_id for _, pitcher_id in pitchers]
+    stats = read_stats_on(conn, SNAPSHOT_TABLE_NAME, pitcher_ids, snapshot_date)
+    if (
+        take_snapshot
+        and set(pitcher_ids) - set(stats)
+        and not snapshot_exists(conn, SNAPSHOT_TABLE_NAME, snapshot_date)
+    ):
+        stats = fetch_all_season_stats(snapshot_date.year)
+        stored = write_snapshot(conn, SNAPSHOT_TABLE_NAME, snapshot_date, stats)
+        print(
+            f"Stats of {stored} pitcher(s) stored in the {SNAPSHOT_TABLE_NAME} snapshot for {snapshot_date}."
+        )
+
+    return seed_stat_lines(pitchers, stats)
+
 
 def prepare_games():
     start_time = time.time()
 
-    temp = tempfile.NamedTemporaryFile(prefix=current_time, suffix="_temp", mode="w")
+    logger = structlog.get_logger()
+
+    ledger_date = run_date().date()
+    date = ledger_date.strftime("%m/%d/%Y")
 
-    logger = config_struct_log(temp)
+    conn = get_pipeline_connection()
+    statuses = read_ledger(conn, LEDGER_TABLE_NAME, ledger_date, "prepare")
+    if statuses.get(STAGE_ROW) == DONE:
+        print(f"Games for {date} have already been prepared.")
+        completed_stages.append("prepare")
+        return None
 
-    date = datetime.strftime(datetime.now(), "%m/%d/%Y")
+    try:
+        sched = get_schedule(date=date)
+    except Exception as e:
+        raise RuntimeError(f"Could not get games for {date}: {e}") from e
+    # sched = get_schedule(date="8/26/2022")  # use for testing purposes
+    # Once a game has started, season stats are no longer the stats going into the day
+    started = any(
+        game["status"] not in PREGAME_STATUSES + UNPLAYED_STATUSES for game in sched
+    )
+    game_ids = set(remaining(statuses, [game["game_id"] for game in sched]))
+    sched = [game for game in sched if game["game_id"] in game_ids]
 
     try:
-        sched = statsapi.schedule(date=date)
-    except:
-        print(f"An error occurred when trying to get games for {date}")
-        return None
-    # sched = statsapi.schedule(date="8/26/2022")  # use for testing purposes
+        from_snapshot = load_stat_snapshot(
+            conn, sched, ledger_date, take_snapshot=not started
+        )
+        print(f"Stats of {from_snapshot} pitcher(s) read from the snapshot store.")
+    except Exception as e:
+        # The pitchers are fetched one by one instead
+        print(f"Error occurred reading the stat snapshot store: {e}")
 
-    cursor = aws_psql_conn.cursor()
+    fetch_start_time = time.time()
+    try:
+        sequential_time = prefetch_pitchers(sched, MAX_WORKERS)
+        fetch_time = time.time() - fetch_start_time
+    except Exception as e:
+        # Whatever was fetched is kept, and the rest is retried game by game below
+        print(f"Not every pitcher could be prefetched: {e}")
+        sequential_time = fetch_time = None
 
-    sql = f"INSERT INTO {TABLE_NAME} (game_id, home_team_id, home_team_name, away_team_id, away_team_name, home_pitcher, home_pitcher_id, home_pitcher_era, home_pitcher_win_percentage, home_pitcher_wins, home_pitcher_losses, home_pitcher_innings_pitched, away_pitcher, away_pitcher_id, away_pitcher_era, away_pitcher_win_percentage, away_pitcher_wins, away_pitcher_losses, away_pitcher_innings_pitched, home_pitcher_k_nine, home_pitcher_bb_nine, home_pitcher_k_bb_diff, home_pitcher_whip, home_pitcher_babip, away_pitcher_k_nine, away_pitcher_bb_nine, away_pitcher_k_bb_diff, away_pitcher_whip, away_pitcher_babip) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
+    records = []
+    game_errors = {}
     for i, game in enumerate(sched):
         print(f"Preparing: {i + 1} of {len(sched)}...")
-        home_probable_pitcher = game["home_probable_pitcher"]
-        away_probable_pitcher = game["away_probable_pitcher"]
-
-        record_to_insert = (
-            game["game_id"],
-            game["home_id"],
-            game["home_name"],
-            game["away_id"],
-            game["away_name"],
-            home_probable_pitcher,
-            (
-                statsapi.lookup_player(home_probable_pitcher)[0]["id"]
-                if statsapi.lookup_player(home_probable_pitcher)
-                else None
-            ),
-            get_ERA(home_probable_pitcher),
-            get_win_percentage(home_probable_pitcher),
-            get_wins(home_probable_pitcher),
-            get_losses(home_probable_pitcher),
-            get_IP(home_probable_pitcher),
-            away_probable_pitcher,
-            (
-                statsapi.lookup_player(away_probable_pitcher)[0]["id"]
-                if statsapi.lookup_player(away_probable_pitcher)
-                else None
-            ),
-            get_ERA(away_probable_pitcher),
-            get_win_percentage(away_probable_pitcher),
-            get_wins(away_probable_pitcher),
-            get_losses(away_probable_pitcher),
-            get_IP(away_probable_pitcher),
-            get_K9(home_probable_pitcher),
-            get_BB9(home_probable_pitcher),
-            get_K_BB_diff(home_probable_pitcher),
-            get_WHIP(home_probable_pitcher),
-            get_BABIP(home_probable_pitcher),
-            get_K9(away_probable_pitcher),
-            get_BB9(away_probable_pitcher),
-            get_K_BB_diff(away_probable_pitcher),
-            get_WHIP(away_probable_pitcher),
-            get_BABIP(away_probable_pitcher),
-        )
-
         try:
-            cursor.execute(sql, record_to_insert)
-            aws_psql_conn.commit()
-            print(
-                cursor.rowcount,
-                f"record(s) inserted successfully into {TABLE_NAME} table.\n",
+            record_to_insert = build_game_record(game)
+        except Exception as e:
+            print(f"Error occurred preparing game {game['game_id']}: {e}")
+            game_errors[game["game_id"]] = str(e)
+            continue
+
+        records.append(record_to_insert)
+
+    outcomes = store_records(conn, sched, records, ledger_date)
+    game_statuses = {game_id: DONE for game_id in outcomes}
+    game_statuses.update({game_id: FAILED for game_id in game_errors})
+    game_statuses[STAGE_ROW] = FAILED if game_errors else DONE
+    write_ledger(
+        conn, LEDGER_TABLE_NAME, ledger_date, "prepare", game_statuses, game_errors
+    )
+    prepared_records.extend(records)
+    counts = count_outcomes(outcomes)
+    print(
+        f"{counts['inserted']} record(s) inserted, {counts['updated']} updated and {counts['skipped']} skipped in {TABLE_NAME} table.\n"
+    )
+
+    for game in sched:
+        if game["game_id"] in game_errors:
+            logger.error(
+                event="game_failed",
+                stage="prepare_games",
+                game_id=game["game_id"],
+                error=game_errors[game["game_id"]],
             )
+            continue
+        outcome = outcomes[game["game_id"]]
+        if outcome == "inserted":
             prepared.append(
                 f'{game["away_name"]} @ {game["home_name"]}, game ID {game["game_id"]}.'
             )
-            logger.info(
-                event="game_prepared",
-                game_id=game["game_id"],
-                away_team=game["away_name"],
-                home_team=game["home_name"],
-                game_date=game["game_date"],
-            )
-
-        except Exception as e:
-            aws_psql_conn.rollback()
-            print(f"Unable to insert record with game ID {game['game_id']}: {e}")
+        else:
             prepared.append(
                 f'{game["away_name"]} @ {game["home_name"]}, game ID {game["game_id"]} (rescheduled).'
             )
-            logger.info(
-                event="error_preparing_game",
-                game_id=game["game_id"],
-                away_team=game["away_name"],
-                home_team=game["home_name"],
-                game_date=game["game_date"],
+        logger.info(
+            event="game_prepared",
+            game_id=game["game_id"],
+            away_team=game["away_name"],
+            home_team=game["home_name"],
+            game_date=game["game_date"],
+            outcome=outcome,
+        )
+
+    logger.info(event="games_prepared", **counts)
+
+    print_timing("prepare games", start_time, fetch_time, sequential_time)
+
+    if game_errors:
+        raise RuntimeError(
+            f"{len(game_errors)} of {len(sched)} game(s) could not be prepared and will be retried on the next run"
+        )
+
+
+def predict_records(conn, current_models: dict, records: list) -> tuple:
+    """
+    Predicts games and writes their predictions, without committing
+
+    :param conn: the database connection
+    :param current_models: the models, as returned by get_models
+    :param records: the rows of the games, in the order of GAME_COLUMNS
+    :returns: a tuple of the predictions and the output of update_predictions
+    """
+    from predictions import predict
+
+    logger = structlog.get_logger()
+
+    predictions = predict(current_models, records)
+
+    outcomes = update_predictions(conn, TABLE_NAME, predictions, commit=False)
+
+    for prediction in predictions:
+        game_id, predicted_winner, home_win_probability = prediction[:3]
+        predicted.append(
+            f"Game {game_id}: predicted winner {predicted_winner}"
+            + (
+                f" ({home_win_probability:.1%} home win probability)."
+                if home_win_probability is not None
+                else "."
             )
+        )
+        logger.info(
+            event="game_predicted",
+            game_id=game_id,
+            predictions=dict(zip(PREDICTION_COLUMNS, prediction[1:])),
+            outcome=outcomes[game_id],
+        )
 
-    key = f"{current_time}_prepared_games"
+    return predictions, outcomes
 
-    s3.meta.client.upload_file(
-        Filename=temp.name,
-        Bucket=S3_BUCKET_NAME,
-        Key=key,
+
+def predict_games():
+    start_time = time.time()
+
+    logger = structlog.get_logger()
+
+    ledger_date = run_date().date()
+
+    conn = get_pipeline_connection()
+    game_ids = remaining(
+        read_ledger(conn, LEDGER_TABLE_NAME, ledger_date, "predict"),
+        done(read_ledger(conn, LEDGER_TABLE_NAME, ledger_date, "prepare")),
     )
-    print(f"{temp.name} has been successfully uploaded to {S3_BUCKET_NAME} as {key}\n")
+    if not game_ids:
+        print("There are no games to predict.")
+        return None
+    current_models = get_models()
+    if current_models is None:
+        print("No models have been published, skipping predictions.")
+        return None
 
+    # Games prepared by an earlier run are read back from the table
+    game_ids = set(game_ids)
+    records = [record for record in prepared_records if record[0] in game_ids]
+    records += fetch_game_records(
+        conn, TABLE_NAME, game_ids - {record[0] for record in records}
+    )
+    predictions, outcomes = predict_records(conn, current_models, records)
+    write_ledger(
+        conn,
+        LEDGER_TABLE_NAME,
+        ledger_date,
+        "predict",
+        {game_id: DONE for game_id in game_ids},
+    )
+    counts = count_outcomes(outcomes)
     print(
-        f"------------------------------------------------\nFinished preparing games at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}.\nTotal time to prepare games: {timedelta(seconds=(time.time() - start_time))}\n------------------------------------------------"
+        f"{len(predictions)} of {len(records)} game(s) predicted, {counts['updated']} record(s) updated in {TABLE_NAME} table.\n"
     )
 
+    logger.info(event="games_predicted", predicted=len(predictions), **counts)
+
+    print_timing("predict games", start_time)
+
+
+def refresh_games():
+    start_time = time.time()
+
+    logger = structlog.get_logger()
+
+    today = run_date().date()
+    date = today.strftime("%m/%d/%Y")
+
+    try:
+        sched = get_schedule(date=date)
+    except Exception as e:
+        raise RuntimeError(f"Could not get games for {date}: {e}") from e
+
+    conn = get_pipeline_connection()
+    states = fetch_refresh_states(conn, TABLE_NAME, [game["game_id"] for game in sched])
+    changes = {
+        game["game_id"]: schedule_changes(game, states.get(game["game_id"]))
+        for game in sched
+    }
+    changed = [game for game in sched if changes[game["game_id"]]]
+    if not changed:
+        print(f"None of the {len(sched)} game(s) for {date} have changed.")
+        logger.info(event="games_refreshed", unchanged=len(sched))
+        return None
+
+    # Only the matchups of games that have not started are rebuilt and predicted again
+    to_rebuild = [
+        game
+        for game in changed
+        if game["status"] in PREGAME_STATUSES and changes[game["game_id"]] != ["status"]
+    ]
+    # Any other change is only recorded, and games that will not be played lose their predictions
+    to_record = [game for game in changed if game not in to_rebuild]
+    to_clear = [
+        game["game_id"]
+        for game in to_record
+        if "status" in changes[game["game_id"]]
+        and game["status"] in UNPLAYED_STATUSES
+        and game["game_id"] in states
+    ]
+
+    records = []
+    rebuilt = []
+    game_errors = {}
+    if to_rebuild:
+        # The snapshot is only read: games have been played since the morning, so pitchers missing from it are fetched one by one
+        try:
+            load_stat_snapshot(conn, to_rebuild, today, take_snapshot=False)
+        except Exception as e:
+            print(f"Error occurred reading the stat snapshot store: {e}")
+        fetch_start_time = time.time()
+        try:
+            sequential_time = prefetch_pitchers(to_rebuild, MAX_WORKERS)
+            fetch_time = time.time() - fetch_start_time
+        except Exception as e:
+            print(f"Not every pitcher could be prefetched: {e}")
+            sequential_time = fetch_time = None
+        for game in to_rebuild:
+            try:
+                records.append(build_game_record(game))
+            except Exception as e:
+                print(f"Error occurred refreshing game {game['game_id']}: {e}")
+                game_errors[game["game_id"]] = str(e)
+                continue
+            rebuilt.append(game)
+    else:
+        sequential_time = fetch_time = None
+
+    outcomes = store_records(conn, rebuilt, records, today)
+    update_columns(
+        conn,
+        TABLE_NAME,
+        STATUS_COLUMNS,
+        [(game["game_id"], game["status"]) for game in to_record],
+        "update_status",
+        commit=False,
+    )
+    if to_clear:
+        update_predictions(
+            conn,
+            TABLE_NAME,
+            [(game_id, *[None] * len(PREDICTION_COLUMNS)) for game_id in to_clear],
+            commit=False,
+        )
+    current_models = get_models() if records else None
+    if current_models is not None:
+        predict_records(conn, current_models, records)
+    conn.commit()
+
+    for game in rebuilt:
+        prepared.append(
+            f'{game["away_name"]} @ {game["home_name"]}, game ID {game["game_id"]} (refreshed: {", ".join(changes[game["game_id"]])}).'
+        )
+        logger.info(
+            event="game_refreshed",
+            game_id=game["game_id"],
+            changes=changes[game["game_id"]],
+            outcome=outcomes[game["game_id"]],
+        )
+    for game_id, error in game_errors.items():
+        logger.error(
+            event="game_failed", stage="refresh_games", game_id=game_id, error=error
+        )
+    print(
+        f"{len(rebuilt)} game(s) refreshed, {len(to_record)} status change(s) recorded and {len(to_clear)} prediction(s) cleared in {TABLE_NAME} table.\n"
+    )
+    logger.info(
+        event="games_refreshed",
+        refreshed=len(rebuilt),
+        recorded=len(to_record),
+        cleared=len(to_clear),
+        failed=len(game_errors),
+        unchanged=len(sched) - len(changed),
+    )
+
+    print_timing("refresh games", start_time, fetch_time, sequential_time)
+
+    if game_errors:
+        raise RuntimeError(
+            f"{len(game_errors)} of {len(to_rebuild)} changed game(s) could not be refreshed and will be retried on the next refresh"
+        )
+
 
 def main():
     error_occurred = False
+    reset_run_state()
+    if EMAIL_FROM:
+        # Connect to the mail server in the background, so the handshake is done by the time an email is sent
+        side_effects.submit("smtp connect", smtp.connect)
     try:
         print("Trying to update games...")
         update_games()
     except Exception as e:
         print(f"Error occurred updating games: {e}")
-        send_error_email("update_games()", e)
+        structlog.get_logger().error(
+            event="stage_failed", stage="update_games", error=str(e)
+        )
+        record_error("update_games()", e)
+        error_occurred = True
+    try:
+        print("Trying to ingest game logs...")
+        ingest_game_logs()
+    except Exception as e:
+        print(f"Error occurred ingesting game logs: {e}")
+        structlog.get_logger().error(
+            event="stage_failed", stage="ingest_game_logs", error=str(e)
+        )
+        record_error("ingest_game_logs()", e)
+        error_occurred = True
+    try:
+        print("Trying to learn from games...")
+        learn_games()
+    except Exception as e:
+        print(f"Error occurred learning from games: {e}")
+        structlog.get_logger().error(
+            event="stage_failed", stage="learn_games", error=str(e)
+        )
+        record_error("learn_games()", e)
         error_occurred = True
     try:
         print("Trying to prepare games...")
         prepare_games()
     except Exception as e:
         print(f"Error occurred preparing games: {e}")
-        send_error_email("prepare_games()", e)
+        structlog.get_logger().error(
+            event="stage_failed", stage="prepare_games", error=str(e)
+        )
+        record_error("prepare_games()", e)
+        error_occurred = True
+    try:
+        print("Trying to predict games...")
+        predict_games()
+    except Exception as e:
+        print(f"Error occurred predicting games: {e}")
+        structlog.get_logger().error(
+            event="stage_failed", stage="predict_games", error=str(e)
+        )
+        record_error("predict_games()", e)
         error_occurred = True
 
+    # A re-invocation after a complete run has nothing new to report
+    nothing_new = set(completed_stages) == {"update", "prepare"} and not predicted
+    if nothing_new and not error_occurred:
+        print("\nEvery stage had already been completed, so no email was sent.")
+    finish_run(notify=not nothing_new)
+
+    print_init_times()
+
     if not error_occurred:
-        send_email()
         return {
             "statusCode": 200,
             "body": json.dumps(
@@ -684,4 +1206,127 @@ def main():
         }
 
 
-main()
+def print_init_times():
+    """
+    Prints how long the imports and client creation took on a cold start
+
+    Called at the end of every handler path, so the cold start is reported by whichever invocation served it.
+    """
+    global cold_start
+
+    if not cold_start:
+        print("Warm start: reused existing clients.")
+        return
+
+    cold_start = False
+    timings = [f"imports took {timedelta(seconds=import_time)}"] + [
+        f"{client} init took {timedelta(seconds=elapsed)}"
+        for client, elapsed in init_times.items()
+    ]
+    print(f"Cold start: {', '.join(timings)}")
+
+
+def run_backfill(start_date: str, end_date: str) -> dict:
+    """
+    Backfills the matchups and winners of every day in a range
+
+    :param start_date: the first date to backfill, formatted as %m/%d/%Y
+    :param end_date: the last date to backfill, formatted as %m/%d/%Y
+    :returns: the status of the run
+    """
+    from backfill import backfill
+    from migrations import ensure_partitions
+
+    reset_run_state()
+    try:
+        conn = get_pipeline_connection()
+        ensure_partitions(
+            conn,
+            TABLE_NAME,
+            range(
+                datetime.strptime(start_date, "%m/%d/%Y").year,
+                datetime.strptime(end_date, "%m/%d/%Y").year + 1,
+            ),
+        )
+        finished = backfill(
+            conn,
+            TABLE_NAME,
+            start_date,
+            end_date,
+            MAX_WORKERS,
+            SNAPSHOT_TABLE_NAME,
+            GAME_LOG_TABLE_NAME,
+        )
+    except Exception as e:
+        print(f"Error occurred backfilling games: {e}")
+        structlog.get_logger().error(
+            event="stage_failed", stage="backfill", error=str(e)
+        )
+        record_error("backfill()", e)
+        finish_run(notify=False)
+        print_init_times()
+        return {
+            "statusCode": 400,
+            "body": json.dumps(
+                "There has been an error when running the backfill. Check logs for further status updates."
+            ),
+        }
+
+    finish_run(notify=False)
+    print_init_times()
+    return {"statusCode": 200, "body": json.dumps(finished)}
+
+
+def run_refresh() -> dict:
+    """
+    Refreshes the day's games whose probable pitchers or status have changed since they were stored
+
+    :returns: the status of the run
+    """
+    reset_run_state()
+    try:
+        refresh_games()
+    except Exception as e:
+        print(f"Error occurred refreshing games: {e}")
+        structlog.get_logger().error(
+            event="stage_failed", stage="refresh_games", error=str(e)
+        )
+        record_error("refresh_games()", e)
+        finish_run(notify=False)
+        print_init_times()
+        return {
+            "statusCode": 400,
+            "body": json.dumps(
+                "There has been an error when refreshing games. Check logs for further status updates."
+            ),
+        }
+
+    # Only a refresh that changed a matchup is worth an email
+    finish_run(notify=bool(prepared))
+    print_init_times()
+    return {"statusCode": 200, "body": json.dumps(prepared)}
+
+
+def lambda_handler(event, context):
+    """
+    The entry point for AWS Lambda
+
+    An event of the form {"backfill": {"start_date": "08/01/2023", "end_date": "08/31/2023"}} runs a backfill instead of the daily pipeline,
+    and an event of the form {"refresh": true} refreshes the day's changed games (see refresh_games).
+
+    :param event: the event that triggered the function
+    :param context: the Lambda runtime context
+    :returns: the status of the run
+    """
+    if event and "backfill" in event:
+        return run_backfill(
+            event["backfill"]["start_date"], event["backfill"]["end_date"]
+        )
+    if event and event.get("refresh"):
+        return run_refresh()
+
+    return main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+import numpy as np
+import stats_api
+
+from datetime import date
+from instrumentation import span
+from psycopg2.extras import execute_values
+
+"""
+Incrementally aggregated pitcher game logs.
+
+Once a game is final its boxscore is fetched, once, and every pitcher's line from it is
+stored as a row of counting stats. Nothing already ingested is fetched again, so each day
+only costs one request per finished game.
+
+Stats are derived locally from the stored lines: GameLogs holds a pitcher's lines as compact
+numpy arrays and sums them, over the season or over each pitcher's last few starts, in a
+single vectorised pass, from which ERA, WHIP, K/9, BB/9, K%-BB% and BABIP are computed. The
+rolling windows (e.g. the last 3 starts) are form features that season totals cannot give.
+Season stats still come from the daily stat snapshot, a single paged request, because the
+lines have no wins or losses and only cover the games ingested so far.
+"""
+
+# Each counting stat in a boxscore line and the column it is stored in
+LOG_STATS = {
+    "outs": "outs",
+    "battersFaced": "batters_faced",
+    "atBats": "at_bats",
+    "hits": "hits",
+    "homeRuns": "home_runs",
+    "baseOnBalls": "base_on_balls",
+    "strikeOuts": "strike_outs",
+    "sacFlies": "sac_flies",
+    "earnedRuns": "earned_runs",
+}
+LOG_COLUMNS = ["pitcher_id", "game_id", "game_date", "started", *LOG_STATS.values()]
+
+FORM_WINDOWS = [3, 5]
+FORM_METRICS = ["era", "whip", "k_nine", "bb_nine", "k_bb_diff", "babip"]
+# The per-pitcher form stats, e.g. "last3_era", as stored for each side in the games table
+FORM_STATS = [f"last{n}_{metric}" for n in FORM_WINDOWS for metric in FORM_METRICS]
+# The columns of the games table the form stats are written to, and their types
+FORM_COLUMNS = {
+    f"{side}_pitcher_{stat}": "double precision"
+    for side in ("home", "away")
+    for stat in FORM_STATS
+}
+
+
+def parse_boxscore(boxscore: dict, game_id: int, game_date: date) -> list:
+    """
+    Gets every pitcher's line from a boxscore
+
+    :param boxscore: the boxscore as returned by the game_boxscore endpoint
+    :param game_id: the ID of the game
+    :param game_date: the date of the game
+    :returns: tuples of values in the order of LOG_COLUMNS
+    """
+    rows = []
+    for side in ("home", "away"):
+        team = boxscore["teams"][side]
+        pitchers = team.get("pitchers", [])
+        for pitcher_id in pitchers:
+            player = team["players"].get(f"ID{pitcher_id}", {})
+            line = player.get("stats", {}).get("pitching", {})
+            if not line:
+                continue
+            rows.append(
+                (
+                    pitcher_id,
+                    game_id,
+                    game_date,
+                    # The starter is always listed first
+                    pitcher_id == pitchers[0],
+                    *(int(line.get(stat) or 0) for stat in LOG_STATS),
+                )
+            )
+
+    return rows
+
+
+def fetch_game_logs(game_id: int, game_date: date) -> list:
+    """
+    Fetches the boxscore of a finished game and gets every pitcher's line from it
+
+    :param game_id: the ID of the game
+    :param game_date: the date of the game
+    :returns: tuples of values in the order of LOG_COLUMNS
+    """
+    with span("boxscore_fetch", game_id=game_id) as s:
+        r = stats_api.get("game_boxscore", {"gamePk": game_id})
+        s["bytes"] = stats_api.payload_size(r)
+
+    return parse_boxscore(r, game_id, game_date)
+
+
+def ensure_game_logs(conn, table_name: str):
+    """
+    Creates the game log table if it does not exist
+
+    :param conn: the database connection
+    :param table_name: the name of the game log table
+    """
+    counts = ", ".join(f"{column} smallint NOT NULL" for column in LOG_STATS.values())
+
+    try:
+        with span("db_write", table=table_name, statement="ensure_game_logs"):
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    f"CREATE TABLE IF NOT EXISTS {table_name} (pitcher_id integer NOT NULL, game_id integer NOT NULL, game_date date NOT NULL, started boolean NOT NULL, {counts}, PRIMARY KEY (pitcher_id, game_id)); CREATE INDEX IF NOT EXISTS {table_name}_pitcher_date ON {table_name} (pitcher_id, game_date)"
+                )
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def write_game_logs(conn, table_name: str, rows: list, commit: bool = True) -> int:
+    """
+    Stores pitchers' lines, replacing any already stored for the same pitcher and game
+
+    :param conn: the database connection
+    :param table_name: the name of the game log table
+    :param rows: tuples of values in the order of LOG_COLUMNS
+    :param commit: whether to commit; False leaves the write in the current transaction
+    :returns: the number of lines stored
+    """
+    rows = list({(row[0], row[1]): row for row in rows}.values())
+    if not rows:
+        return 0
+
+    updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in LOG_COLUMNS[2:])
+    sql = f"INSERT INTO {table_name} ({', '.join(LOG_COLUMNS)}) VALUES %s ON CONFLICT (pitcher_id, game_id) DO UPDATE SET {updates}"
+
+    try:
+        with span(
+            "db_write", table=table_name, statement="write_game_logs", rows=len(rows)
+        ):
+            with conn.cursor() as cursor:
+                execute_values(cursor, sql, rows, page_size=len(rows))
+            if commit:
+                conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    return len(rows)
+
+
+def ingested_game_ids(conn, table_name: str, game_ids: list) -> set:
+    """
+    Gets which of the given games already have their lines stored
+
+    :param conn: the database connection
+    :param table_name: the name of the game log table
+    :param game_ids: the IDs of the games
+    :returns: the IDs of the games with lines in the table
+    """
+    if not game_ids:
+        return set()
+
+    with span("db_read", table=table_name, statement="ingested_game_ids"):
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"SELECT DISTINCT game_id FROM {table_name} WHERE game_id = ANY(%s)",
+                (list(game_ids),),
+            )
+            ingested = {game_id for (game_id,) in cursor.fetchall()}
+        conn.rollback()
+
+    return ingested
+
+
+def read_game_logs(
+    conn, table_name: str, pitcher_ids: list, start_date: date, end_date: date
+) -> list:
+    """
+    Gets pitchers' lines from the games played in a range of dates
+
+    :param conn: the database connection
+    :param table_name: the name of the game log table
+    :param pitcher_ids: the IDs of the pitchers
+    :param start_date: the first date of the range
+    :param end_date: the date after the last date of the range
+    :returns: tuples of values in the order of LOG_COLUMNS
+    """
+    if not pitcher_ids:
+        return []
+
+    with span("db_read", table=table_name, statement="read_game_logs"):
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"SELECT {', '.join(LOG_COLUMNS)} FROM {table_name} WHERE pitcher_id = ANY(%s) AND game_date >= %s AND game_date < %s",
+                (list(pitcher_ids), start_date, end_date),
+            )
+            rows = cursor.fetchall()
+        conn.rollback()
+
+    return rows
+
+
+def derive_form(
+    conn, table_name: str, records: list, season_start: date, end_date: date
+) -> list:
+    """
+    Derives the recent form of both pitchers of games from their stored game logs
+
+    :param conn: the database connection
+    :param table_name: the name of the game log table
+    :param records: rows of the games table, in the order of database.GAME_COLUMNS
+    :param season_start: the first date of the season's game logs
+    :param end_date: the date after the last game log to use, i.e. the day of the games
+    :returns: tuples of game ID followed by values in the order of FORM_COLUMNS
+    """
+    pitcher_ids = list(
+        {record[i] for record in records for i in (6, 13) if record[i] is not None}
+    )
+    logs = GameLogs(
+        read_game_logs(conn, table_name, pitcher_ids, season_start, end_date)
+    )
+
+    return logs.form_records(records)
+
+
+class GameLogs:
+    """
+    Pitchers' lines as compact arrays, one element per line
+    """
+
+    def __init__(self, rows: list):
+        """
+        :param rows: tuples of values in the order of LOG_COLUMNS
+        """
+        self.pitcher_ids = np.array([row[0] for row in rows], dtype=np.int64)
+        self.game_dates = np.array([row[2] for row in rows], dtype="datetime64[D]")
+        self.started = np.array([row[3] for row in rows], dtype=bool)
+        self.counts = np.array([row[4:] for row in rows], dtype=np.int32).reshape(
+            len(rows), len(LOG_STATS)
+        )
+
+    def totals(self, pitcher_ids: list, last_starts: int = None) -> np.ndarray:
+        """
+        Sums the counting stats of each pitcher
+
+        :param pitcher_ids: the IDs of the pitchers
+        :param last_starts: if given, only each pitcher's last this many starts are summed; otherwise every line
+        :returns: a matrix with a row per pitcher and a column per stat in LOG_STATS
+        """
+        unique_ids, inverse = np.unique(
+            np.asarray(pitcher_ids, dtype=np.int64), return_inverse=True
+        )
+        totals = np.zeros((len(unique_ids), len(LOG_STATS)), dtype=np.float64)
+
+        keep = np.isin(self.pitcher_ids, unique_ids)
+        if last_starts is not None:
+            keep &= self.started
+        lines = np.flatnonzero(keep)
+
+        if len(lines):
+            # Each pitcher's lines, most recent first
+            lines = lines[
+                np.lexsort(
+                    (-self.game_dates[lines].astype(np.int64), self.pitcher_ids[lines])
+                )
+            ]
+            pitchers = self.pitcher_ids[lines]
+
+            if last_starts is not None:
+                first = np.r_[True, pitchers[1:] != pitchers[:-1]]
+                first_line = np.flatnonzero(first)[np.cumsum(first) - 1]
+                recent = np.arange(len(lines)) - first_line < last_starts
+                lines, pitchers = lines[recent], pitchers[recent]
+
+            np.add.at(totals, np.searchsorted(unique_ids, pitchers), self.counts[lines])
+
+        return totals[inverse]
+
+    def form_records(self, records: list) -> list:
+        """
+        Builds the form stats of both pitchers of games
+
+        :param records: rows of the games table, in the order of database.GAME_COLUMNS
+        :returns: tuples of game ID followed by values in the order of FORM_COLUMNS; None where a pitcher has no starts
+        """
+        home = self.form([record[6] or 0 for record in records])
+        away = self.form([record[13] or 0 for record in records])
+
+        return [
+            (
+                record[0],
+                *(
+                    None if np.isnan(values[i]) else float(values[i])
+                    for values in (*home.values(), *away.values())
+                ),
+            )
+            for i, record in enumerate(records)
+        ]
+
+    def form(self, pitcher_ids: list) -> dict:
+        """
+        Computes each pitcher's metrics over each window in FORM_WINDOWS
+
+        :param pitcher_ids: the IDs of the pitchers
+        :returns: a dict mapping each stat in FORM_STATS to an array with an element per pitcher; NaN where a pitcher has no starts
+        """
+        form = {}
+        for n in FORM_WINDOWS:
+            for metric, values in metrics(self.totals(pitcher_ids, n)).items():
+                form[f"last{n}_{metric}"] = values
+
+        return form
+
+
+def metrics(totals: np.ndarray) -> dict:
+    """
+    Computes rate stats from counting stats
+
+    :param totals: a matrix with a row per pitcher and a column per stat in LOG_STATS, as from GameLogs.totals
+    :returns: a dict mapping each metric in FORM_METRICS to an array with an element per pitcher; NaN where a metric is undefined
+    """
+    stat = dict(zip(LOG_STATS.values(), totals.T))
+
+    def ratio(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+        return np.divide(
+            numerator,
+            denominator,
+            out=np.full(len(numerator), np.nan),
+            where=denominator > 0,
+        )
+
+    return {
+        "era": ratio(27 * stat["earned_runs"], stat["outs"]),
+        "whip": ratio(3 * (stat["base_on_balls"] + stat["hits"]), stat["outs"]),
+        "k_nine": ratio(27 * stat["strike_outs"], stat["outs"]),
+        "bb_nine": ratio(27 * stat["base_on_balls"], stat["outs"]),
+        "k_bb_diff": ratio(
+            stat["strike_outs"] - stat["base_on_balls"], stat["batters_faced"]
+        ),
+        "babip": ratio(
+            stat["hits"] - stat["home_runs"],
+            stat["at_bats"]
+            - stat["strike_outs"]
+            - stat["home_runs"]
+            + stat["sac_flies"],
+        ),
+    }
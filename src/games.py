@@ -0,0 +1,142 @@
+from datetime import date, datetime
+from pitchers import get_stat_line, prefetch_stat_lines
+from teams import lookup_team_id, lookup_team_name
+
+"""
+Builds the rows written to the games table from games on the schedule.
+"""
+
+FINAL_STATUSES = ["Final", "Game Over", "Completed Early"]
+UNPLAYED_STATUSES = ["Postponed", "Cancelled"]
+# Games whose matchups can still change before the first pitch
+PREGAME_STATUSES = ["Scheduled", "Pre-Game", "Warmup", "Delayed Start"]
+
+
+def game_day(game: dict) -> date:
+    """
+    :param game: the game from the schedule
+    :returns: the date the game is played on
+    """
+    return datetime.strptime(game["game_date"], "%Y-%m-%d").date()
+
+
+def prefetch_pitchers(
+    games: list, max_workers: int, point_in_time: bool = False
+) -> float:
+    """
+    Fetches the stat lines of every probable pitcher of the given games concurrently
+
+    :param games: the games from the schedule
+    :param max_workers: the maximum number of pitchers being fetched at once
+    :param point_in_time: if True, fetch each pitcher's stats going into the game rather than their current stats
+    :returns: the summed time of the fetches in seconds
+    """
+    return prefetch_stat_lines(
+        [
+            (
+                game[f"{side}_probable_pitcher"],
+                game[f"{side}_probable_pitcher_id"],
+                game_day(game) if point_in_time else None,
+            )
+            for game in games
+            for side in ("home", "away")
+        ],
+        max_workers,
+    )
+
+
+def build_game_record(game: dict, point_in_time: bool = False) -> tuple:
+    """
+    Builds the row for a game, in the order of database.GAME_COLUMNS
+
+    :param game: the game from the schedule
+    :param point_in_time: if True, use each pitcher's stats going into the game rather than their current stats
+    :returns: the row for the game
+    """
+    day = game_day(game)
+    as_of = day if point_in_time else None
+    home_probable_pitcher = game["home_probable_pitcher"]
+    away_probable_pitcher = game["away_probable_pitcher"]
+
+    home = get_stat_line(home_probable_pitcher, game["home_probable_pitcher_id"], as_of)
+    away = get_stat_line(away_probable_pitcher, game["away_probable_pitcher_id"], as_of)
+
+    return (
+        game["game_id"],
+        game["home_id"],
+        game["home_name"],
+        game["away_id"],
+        game["away_name"],
+        home_probable_pitcher,
+        home.pitcher_id,
+        home.era(),
+        home.win_percentage(),
+        home.wins(),
+        home.losses(),
+        home.innings_pitched(),
+        away_probable_pitcher,
+        away.pitcher_id,
+        away.era(),
+        away.win_percentage(),
+        away.wins(),
+        away.losses(),
+        away.innings_pitched(),
+        home.k_nine(),
+        home.bb_nine(),
+        home.k_bb_diff(),
+        home.whip(),
+        home.babip(),
+        away.k_nine(),
+        away.bb_nine(),
+        away.k_bb_diff(),
+        away.whip(),
+        away.babip(),
+        day,
+        day.year,
+    )
+
+
+def lookup_winner(game: dict) -> tuple:
+    """
+    Gets the ID and name of the team that won a game
+
+    :param game: the game from the schedule
+    :returns: a tuple of the winning team's ID and name; (None, "n/a") if there is no winner
+    """
+    winning_team = game.get("winning_team_id") or lookup_team_id(
+        game.get("winning_team")
+    )
+
+    if winning_team is None:
+        if "winning_team" in game:
+            print(
+                "There is no winning team, implying that this game may have ended in a tie. Winner has been set to None."
+            )
+        return None, "n/a"
+
+    return winning_team, lookup_team_name(winning_team) or game["winning_team"]
+
+
+def schedule_changes(game: dict, state: tuple) -> list:
+    """
+    Compares a game on the schedule with the game as stored
+
+    :param game: the game from the schedule
+    :param state: the stored names and IDs of the home and away pitchers and status of the game, as from database.fetch_refresh_states; None if the game is not stored
+    :returns: what has changed: "new", "home_pitcher", "away_pitcher" and/or "status"; empty if nothing has
+    """
+    if state is None:
+        return ["new"]
+
+    changes = []
+    for side, (name, pitcher_id) in zip(("home", "away"), (state[0:2], state[2:4])):
+        scheduled_id = game[f"{side}_probable_pitcher_id"]
+        # A stored ID may have been resolved from the name when the schedule had none
+        if game[f"{side}_probable_pitcher"] != name or (
+            scheduled_id is not None and scheduled_id != pitcher_id
+        ):
+            changes.append(f"{side}_pitcher")
+    if game["status"] != state[4]:
+        changes.append("status")
+
+    return changes
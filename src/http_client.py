@@ -0,0 +1,192 @@
+import random
+import requests
+import threading
+import time
+
+from concurrent.futures import Future
+from instrumentation import current_span
+from requests.adapters import HTTPAdapter
+
+"""
+Pooled, retrying HTTP client.
+
+One requests session is shared by every thread (and by every warm invocation of the
+Lambda), so connections are kept alive and reused instead of being opened for each call.
+Every request has a timeout and waits for a token from a token bucket, so that a wide
+fan-out cannot flood the API. Connection errors, timeouts, 429s and 5xx responses are
+retried with exponential backoff and full jitter, and each retry is added to the span
+the request was made in. Identical requests that are already in flight are coalesced:
+later callers wait for the first one's response instead of making their own.
+"""
+
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket, refilled continuously at a fixed rate
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        """
+        :param rate: the number of tokens added per second; 0 or less disables rate limiting
+        :param capacity: the most tokens the bucket can hold, i.e. the largest burst allowed
+        """
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        Takes a token, waiting for one to be added if the bucket is empty
+
+        :returns: how long the call waited, in seconds
+        """
+        if self.rate <= 0:
+            return 0.0
+
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated_at) * self.rate
+                )
+                self.updated_at = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+            waited += wait
+
+
+class HttpClient:
+    """
+    A pooled session with timeouts, rate limiting, retries and request coalescing
+    """
+
+    def __init__(
+        self,
+        pool_size: int,
+        connect_timeout: float,
+        read_timeout: float,
+        max_retries: int,
+        backoff: float,
+        max_backoff: float,
+        rate: float,
+        burst: int,
+    ):
+        """
+        :param pool_size: the most connections kept open to a host
+        :param connect_timeout: how long to wait for a connection, in seconds
+        :param read_timeout: how long to wait between bytes of the response, in seconds
+        :param max_retries: the most times a request is retried
+        :param backoff: the backoff before the first retry, in seconds; doubled for each retry after it
+        :param max_backoff: the longest backoff, in seconds, including any Retry-After asked for by the server
+        :param rate: the most requests started per second; 0 or less disables rate limiting
+        :param burst: the most requests that can be started at once after a quiet period
+        """
+        self.session = requests.Session()
+        # Retries are handled here rather than by urllib3 so that they can be counted in spans
+        adapter = HTTPAdapter(pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.bucket = TokenBucket(rate, burst)
+
+        self.in_flight = {}
+        self.in_flight_lock = threading.Lock()
+
+    def get_json(self, url: str, params: dict = None):
+        """
+        Makes a GET request, or waits for an identical one already in flight
+
+        The same response object is returned to every coalesced caller, so it must not be modified.
+
+        :param url: the URL to request
+        :param params: the query parameters of the request
+        :returns: the decoded JSON body of the response
+        """
+        key = (url, tuple(sorted((k, str(v)) for k, v in (params or {}).items())))
+
+        with self.in_flight_lock:
+            future = self.in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self.in_flight[key] = future
+
+        if not owner:
+            return future.result()
+
+        try:
+            response = self.request(url, params)
+            future.set_result(response)
+            return response
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.in_flight_lock:
+                del self.in_flight[key]
+
+    def request(self, url: str, params: dict = None):
+        """
+        Makes a GET request, retrying it when it fails in a way that may not happen again
+
+        :param url: the URL to request
+        :param params: the query parameters of the request
+        :returns: the decoded JSON body of the response
+        """
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            retry_after = None
+
+            try:
+                r = self.session.get(url, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            else:
+                if r.status_code not in RETRY_STATUSES:
+                    r.raise_for_status()
+                    return r.json()
+
+                error = requests.HTTPError(
+                    f"{r.status_code} Server Error: {r.reason} for url: {r.url}",
+                    response=r,
+                )
+                retry_after = parse_retry_after(r.headers.get("Retry-After"))
+
+            if attempt == self.max_retries:
+                raise error
+
+            record = current_span()
+            if record is not None:
+                record["retries"] += 1
+
+            if retry_after is None:
+                retry_after = random.uniform(
+                    0, min(self.max_backoff, self.backoff * 2**attempt)
+                )
+            time.sleep(min(retry_after, self.max_backoff))
+
+
+def parse_retry_after(value: str) -> float:
+    """
+    :param value: the Retry-After header of a response
+    :returns: the number of seconds to wait; None if the header is missing or is not a number of seconds
+    """
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return None
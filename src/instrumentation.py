@@ -0,0 +1,157 @@
+import structlog
+import threading
+import time
+
+from contextlib import contextmanager
+
+"""
+Timing spans and call counters for the pipeline.
+
+Each instrumented stage (schedule fetch, player lookup, stat fetch, DB write, S3 upload,
+email send) is wrapped in span(), which writes a structured "span" event and adds to the
+in-process metrics registry. At the end of a run the registry is written out as a single
+summary event and, optionally, as Prometheus text.
+"""
+
+
+class MetricsRegistry:
+    """
+    Running totals of every span, per stage
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+
+    def observe(
+        self, stage: str, duration: float, payload_bytes: int, retries: int, error: bool
+    ):
+        """
+        Records one span
+
+        :param stage: the name of the stage
+        :param duration: how long the span took in seconds
+        :param payload_bytes: the size of the payload sent or received
+        :param retries: the number of times the call was retried
+        :param error: whether the span ended in an exception
+        """
+        with self.lock:
+            totals = self.stages.setdefault(
+                stage,
+                {
+                    "count": 0,
+                    "duration": 0.0,
+                    "max_duration": 0.0,
+                    "bytes": 0,
+                    "retries": 0,
+                    "errors": 0,
+                },
+            )
+            totals["count"] += 1
+            totals["duration"] += duration
+            totals["max_duration"] = max(totals["max_duration"], duration)
+            totals["bytes"] += payload_bytes
+            totals["retries"] += retries
+            totals["errors"] += int(error)
+
+    def summary(self) -> dict:
+        """
+        :returns: a copy of the totals for every stage
+        """
+        with self.lock:
+            return {stage: dict(totals) for stage, totals in self.stages.items()}
+
+    def to_prometheus(self) -> str:
+        """
+        Formats the totals in the Prometheus text exposition format
+
+        :returns: the totals as Prometheus text
+        """
+        metrics = [
+            ("mlb_pipeline_stage_calls_total", "counter", "count"),
+            ("mlb_pipeline_stage_duration_seconds_total", "counter", "duration"),
+            ("mlb_pipeline_stage_duration_seconds_max", "gauge", "max_duration"),
+            ("mlb_pipeline_stage_bytes_total", "counter", "bytes"),
+            ("mlb_pipeline_stage_retries_total", "counter", "retries"),
+            ("mlb_pipeline_stage_errors_total", "counter", "errors"),
+        ]
+        summary = self.summary()
+
+        lines = []
+        for name, metric_type, field in metrics:
+            lines.append(f"# TYPE {name} {metric_type}")
+            for stage, totals in sorted(summary.items()):
+                lines.append(f'{name}{{stage="{stage}"}} {totals[field]}')
+
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        """
+        Clears the totals from the previous run
+        """
+        with self.lock:
+            self.stages.clear()
+
+
+metrics = MetricsRegistry()
+
+# The spans open in each thread, innermost last, so that the calls they wrap can add to them
+open_spans = threading.local()
+
+
+@contextmanager
+def span(stage: str, **fields):
+    """
+    Times a stage, writing a "span" event and adding it to the metrics registry
+
+    The yielded dict can be used to record the payload size ("bytes") and retries ("retries") of the call.
+
+    :param stage: the name of the stage, e.g. "stat_fetch"
+    :param fields: extra fields for the span event, e.g. the ID of the pitcher
+    """
+    record = {"bytes": 0, "retries": 0}
+    error = False
+    start_time = time.time()
+    stack = open_spans.__dict__.setdefault("stack", [])
+    stack.append(record)
+
+    try:
+        yield record
+    except Exception:
+        error = True
+        raise
+    finally:
+        stack.pop()
+        duration = time.time() - start_time
+        metrics.observe(stage, duration, record["bytes"], record["retries"], error)
+        # A span must never fail the call it wraps, e.g. when the stage's log file is already closed
+        try:
+            structlog.get_logger().info(
+                event="span",
+                stage=stage,
+                duration=round(duration, 6),
+                bytes=record["bytes"],
+                retries=record["retries"],
+                error=error,
+                **fields,
+            )
+        except (OSError, ValueError):
+            pass
+
+
+def current_span() -> dict:
+    """
+    :returns: the record of the innermost span open in this thread; None if there is none
+    """
+    stack = getattr(open_spans, "stack", None)
+
+    return stack[-1] if stack else None
+
+
+def log_summary(logger):
+    """
+    Writes the totals of the run as a single "run_summary" event
+
+    :param logger: the structlog logger to write to
+    """
+    logger.info(event="run_summary", stages=metrics.summary())
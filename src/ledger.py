@@ -0,0 +1,131 @@
+from datetime import date
+from instrumentation import span
+from psycopg2.extras import execute_values
+
+"""
+Run ledger for the daily pipeline.
+
+The ledger is a table recording, for every date and stage, the status of each game:
+"done" once the stage's write for the game has been committed, "pending" while the game
+still has to be processed again (e.g. it has not finished yet) and "failed" when
+processing it raised. A run only processes the games of a stage that are not "done", so
+a run that failed partway through can be retried, or the Lambda re-invoked on a timer,
+at a cost proportional to the work that is left.
+
+Each stage writes its ledger rows in the same transaction as its writes to the games
+table, so a game is never marked "done" without its data, nor written without being
+marked "done". The row with game_id STAGE_ROW records the stage as a whole, so that a
+stage that is already complete can be skipped without fetching the schedule.
+"""
+
+DONE = "done"
+PENDING = "pending"
+FAILED = "failed"
+STAGE_ROW = 0
+
+
+def ensure_ledger(conn, table_name: str):
+    """
+    Creates the ledger table if it does not exist
+
+    :param conn: the database connection
+    :param table_name: the name of the ledger table
+    """
+    try:
+        with span("db_write", table=table_name, statement="ensure_ledger"):
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    f"CREATE TABLE IF NOT EXISTS {table_name} (run_date date NOT NULL, stage text NOT NULL, game_id integer NOT NULL, status text NOT NULL, error text, updated_at timestamptz NOT NULL DEFAULT now(), PRIMARY KEY (run_date, stage, game_id))"
+                )
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def read_ledger(conn, table_name: str, run_date: date, stage: str) -> dict:
+    """
+    Gets the status of every game of a stage
+
+    :param conn: the database connection
+    :param table_name: the name of the ledger table
+    :param run_date: the date of the games
+    :param stage: the name of the stage
+    :returns: a dict mapping each game ID (and STAGE_ROW, once the stage has a status) to its status
+    """
+    with span("db_read", table=table_name, statement="read_ledger", ledger_stage=stage):
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"SELECT game_id, status FROM {table_name} WHERE run_date = %s AND stage = %s",
+                (run_date, stage),
+            )
+            statuses = dict(cursor.fetchall())
+        conn.rollback()
+
+    return statuses
+
+
+def write_ledger(
+    conn,
+    table_name: str,
+    run_date: date,
+    stage: str,
+    statuses: dict,
+    errors: dict = None,
+    commit: bool = True,
+):
+    """
+    Records the status of games of a stage
+
+    :param conn: the database connection
+    :param table_name: the name of the ledger table
+    :param run_date: the date of the games
+    :param stage: the name of the stage
+    :param statuses: a dict mapping each game ID (or STAGE_ROW) to its status
+    :param errors: a dict mapping the ID of each failed game to its error
+    :param commit: whether to commit; False leaves the write in the current transaction, e.g. to commit it with the stage's own writes
+    """
+    if not statuses:
+        if commit:
+            conn.commit()
+        return None
+
+    errors = errors or {}
+    rows = [
+        (run_date, stage, game_id, status, errors.get(game_id))
+        for game_id, status in statuses.items()
+    ]
+    sql = f"INSERT INTO {table_name} (run_date, stage, game_id, status, error) VALUES %s ON CONFLICT (run_date, stage, game_id) DO UPDATE SET status = EXCLUDED.status, error = EXCLUDED.error, updated_at = now()"
+
+    try:
+        with span(
+            "db_write", table=table_name, statement="write_ledger", rows=len(rows)
+        ):
+            with conn.cursor() as cursor:
+                execute_values(cursor, sql, rows, page_size=len(rows))
+            if commit:
+                conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def remaining(statuses: dict, game_ids: list) -> list:
+    """
+    :param statuses: the output of read_ledger
+    :param game_ids: the IDs of the games of the stage
+    :returns: the IDs of the games that are not done, in order
+    """
+    return [game_id for game_id in game_ids if statuses.get(game_id) != DONE]
+
+
+def done(statuses: dict) -> list:
+    """
+    :param statuses: the output of read_ledger
+    :returns: the IDs of the games that are done
+    """
+    return [
+        game_id
+        for game_id, status in statuses.items()
+        if game_id != STAGE_ROW and status == DONE
+    ]
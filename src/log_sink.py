@@ -0,0 +1,105 @@
+import io
+import threading
+import zlib
+
+"""
+In-memory, gzip-compressed log sink.
+
+Structured log lines are compressed as they are written, so a run's logs never touch the
+Lambda's ephemeral disk, and are shipped to S3 as a single object at the end of the run.
+"""
+
+# Objects larger than this are uploaded in parts; S3 requires parts of at least 5 MB
+MULTIPART_THRESHOLD = 8 * 1024 * 1024
+MULTIPART_PART_SIZE = 8 * 1024 * 1024
+
+
+class LogSink:
+    """
+    A file-like object that gzip-compresses everything written to it, for use with structlog.WriteLoggerFactory
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buffer = io.BytesIO()
+        # wbits=31 writes a gzip header and trailer, so the output is a regular .gz file
+        self.compressor = zlib.compressobj(9, zlib.DEFLATED, 31)
+        self.lines = 0
+        self.raw_bytes = 0
+        self.finished = None
+
+    def write(self, message: str):
+        """
+        Compresses and buffers a log line
+
+        :param message: the text to write
+        """
+        data = message.encode()
+        with self.lock:
+            if self.finished is not None:
+                raise ValueError("Cannot write to a log sink that has been finished")
+            self.buffer.write(self.compressor.compress(data))
+            self.lines += message.count("\n")
+            self.raw_bytes += len(data)
+
+    def flush(self):
+        """
+        Nothing to do; lines are only complete once the sink is finished
+        """
+
+    def finish(self) -> bytes:
+        """
+        Ends the gzip stream. Nothing can be written afterwards.
+
+        :returns: the compressed logs
+        """
+        with self.lock:
+            if self.finished is None:
+                self.buffer.write(self.compressor.flush())
+                self.finished = self.buffer.getvalue()
+
+        return self.finished
+
+    def upload(self, s3_client, bucket: str, key: str) -> int:
+        """
+        Uploads the compressed logs as a single object, using a multipart upload when they are large
+
+        :param s3_client: the S3 client
+        :param bucket: the bucket to upload to
+        :param key: the key to upload as
+        :returns: the size of the uploaded object in bytes
+        """
+        body = self.finish()
+        extra = {"ContentType": "application/gzip"}
+
+        if len(body) <= MULTIPART_THRESHOLD:
+            s3_client.put_object(Bucket=bucket, Key=key, Body=body, **extra)
+            return len(body)
+
+        upload_id = s3_client.create_multipart_upload(Bucket=bucket, Key=key, **extra)[
+            "UploadId"
+        ]
+        try:
+            parts = []
+            for number, start in enumerate(
+                range(0, len(body), MULTIPART_PART_SIZE), start=1
+            ):
+                part = s3_client.upload_part(
+                    Bucket=bucket,
+                    Key=key,
+                    UploadId=upload_id,
+                    PartNumber=number,
+                    Body=body[start : start + MULTIPART_PART_SIZE],
+                )
+                parts.append({"PartNumber": number, "ETag": part["ETag"]})
+            s3_client.complete_multipart_upload(
+                Bucket=bucket,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+        except Exception:
+            s3_client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+            raise
+
+        return len(body)
@@ -0,0 +1,595 @@
+import argparse
+
+from instrumentation import span
+from psycopg2.extras import execute_values
+from schedule import get_game_dates
+
+"""
+Versioned schema migrations for the games table.
+
+Each migration in MIGRATIONS is applied once, in order, and recorded in the table's
+schema_migrations table. Pending migrations are applied in a single transaction under an
+advisory lock, so concurrent invocations do not apply the same migration twice. Once the
+schema is current, a check costs a few statements per container.
+
+A migration never changes once it has been released: its columns and definitions are
+written out in this file rather than taken from the code that writes the table, so every
+database ends up with the same schema whichever version it started from. Migration 1 creates
+every column the pipeline wrote when the migrations were introduced, including the online
+predictions, the pitchers' recent form and the game status. A column added after that gets a
+migration of its own, built with add_columns, as updated_at is by migration 4, and nothing
+outside this file alters the games table.
+
+The games table is partitioned by season, with a partition per season and a default
+partition for anything else. Its primary key is (game_id, season), because Postgres requires
+the partition key to be part of every unique constraint, and a trigger rejects a game stored
+under a second season, so game_id is unique across partitions. Each season's partition is created
+by ensure_partitions before that season's games are written. Winner updates and extracts
+find games by game_id through each partition's primary key. Unfinished games and game dates
+have their own indexes. Every game's updated_at is set when it is inserted and, by a
+trigger, whenever it is updated (which needs Postgres 13 or later), so that extracts can
+find the games written since the last one. The materialized view {table}_features holds
+every *_comp feature and the label, computed exactly as in features.py, so training can
+read features without recomputing them. Refreshing it recomputes every season, so the daily
+pipeline leaves it alone; extract.py refreshes it when training data is pulled, and
+refresh_features (or --refresh-features) refreshes it by hand.
+
+A table created before these migrations is converted in place. Its games are dated from the
+schedule before the migrations' transaction is opened, so the requests to the MLB Stats API
+are made without holding the lock, and each is copied into its season's partition. Games the
+schedule has no date for are not copied. The table as it was is kept as
+{table}_unpartitioned, and is only dropped by hand, with --drop-unpartitioned, which refuses
+while any of its games (e.g. ones that could not be dated) are missing from the games table.
+
+Usage:
+    python migrations.py
+    python migrations.py --refresh-features
+    python migrations.py --drop-unpartitioned
+"""
+
+# The columns the games table is partitioned on and dated by
+PARTITION_COLUMNS = ["game_date", "season"]
+# Text that can be cast to a number; stats were stored as text by some writers
+NUMERIC_PATTERN = r"^\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?\s*$"
+
+
+# Every column of the games table as created by migration 1, i.e. every column the pipeline wrote when the migrations were introduced, and its type
+GAME_TABLE_COLUMNS = {
+    "game_id": "integer",
+    "home_team_id": "integer",
+    "home_team_name": "text",
+    "away_team_id": "integer",
+    "away_team_name": "text",
+    "home_pitcher": "text",
+    "home_pitcher_id": "integer",
+    "home_pitcher_era": "double precision",
+    "home_pitcher_win_percentage": "double precision",
+    "home_pitcher_wins": "integer",
+    "home_pitcher_losses": "integer",
+    "home_pitcher_innings_pitched": "double precision",
+    "away_pitcher": "text",
+    "away_pitcher_id": "integer",
+    "away_pitcher_era": "double precision",
+    "away_pitcher_win_percentage": "double precision",
+    "away_pitcher_wins": "integer",
+    "away_pitcher_losses": "integer",
+    "away_pitcher_innings_pitched": "double precision",
+    "home_pitcher_k_nine": "double precision",
+    "home_pitcher_bb_nine": "double precision",
+    "home_pitcher_k_bb_diff": "double precision",
+    "home_pitcher_whip": "double precision",
+    "home_pitcher_babip": "double precision",
+    "away_pitcher_k_nine": "double precision",
+    "away_pitcher_bb_nine": "double precision",
+    "away_pitcher_k_bb_diff": "double precision",
+    "away_pitcher_whip": "double precision",
+    "away_pitcher_babip": "double precision",
+    "game_date": "date",
+    "season": "smallint",
+    "winning_team": "integer",
+    "predicted_winner": "integer",
+    "home_win_probability": "double precision",
+    "old_school_predicted_winner": "integer",
+    "old_school_home_win_probability": "double precision",
+    "modern_predicted_winner": "integer",
+    "modern_home_win_probability": "double precision",
+    "online_predicted_winner": "integer",
+    "online_home_win_probability": "double precision",
+    "home_pitcher_last3_era": "double precision",
+    "home_pitcher_last3_whip": "double precision",
+    "home_pitcher_last3_k_nine": "double precision",
+    "home_pitcher_last3_bb_nine": "double precision",
+    "home_pitcher_last3_k_bb_diff": "double precision",
+    "home_pitcher_last3_babip": "double precision",
+    "home_pitcher_last5_era": "double precision",
+    "home_pitcher_last5_whip": "double precision",
+    "home_pitcher_last5_k_nine": "double precision",
+    "home_pitcher_last5_bb_nine": "double precision",
+    "home_pitcher_last5_k_bb_diff": "double precision",
+    "home_pitcher_last5_babip": "double precision",
+    "away_pitcher_last3_era": "double precision",
+    "away_pitcher_last3_whip": "double precision",
+    "away_pitcher_last3_k_nine": "double precision",
+    "away_pitcher_last3_bb_nine": "double precision",
+    "away_pitcher_last3_k_bb_diff": "double precision",
+    "away_pitcher_last3_babip": "double precision",
+    "away_pitcher_last5_era": "double precision",
+    "away_pitcher_last5_whip": "double precision",
+    "away_pitcher_last5_k_nine": "double precision",
+    "away_pitcher_last5_bb_nine": "double precision",
+    "away_pitcher_last5_k_bb_diff": "double precision",
+    "away_pitcher_last5_babip": "double precision",
+    "game_status": "text",
+}
+
+
+def add_columns(columns: dict):
+    """
+    Builds a migration adding columns to the games table
+
+    :param columns: a dict mapping each column to its type, written out in full
+    :returns: the function applying the migration
+    """
+
+    def apply(cursor, table_name: str):
+        cursor.execute(
+            f"ALTER TABLE {table_name} "
+            + ", ".join(
+                f"ADD COLUMN IF NOT EXISTS {column} {column_type}"
+                for column, column_type in columns.items()
+            )
+        )
+
+    return apply
+
+
+def convert(expression: str, column_type: str) -> str:
+    """
+    :param expression: a SQL expression of any type
+    :param column_type: the type to convert it to
+    :returns: a SQL expression converting it, with NULL for text that is not a number (e.g. "-.--") when converting to a number
+    """
+    if column_type == "text":
+        return f"{expression}::text"
+
+    return f"CASE WHEN {expression}::text ~ '{NUMERIC_PATTERN}' THEN {expression}::text::double precision::{column_type} END"
+
+
+def partition_sql(table_name: str, season: int) -> str:
+    """
+    :param table_name: the name of the games table
+    :param season: the season
+    :returns: the statement creating the partition of a season, if it does not exist
+    """
+    return f"CREATE TABLE IF NOT EXISTS {table_name}_{season} PARTITION OF {table_name} FOR VALUES FROM ({season}) TO ({season + 1})"
+
+
+def partition_games(cursor, table_name: str):
+    """
+    Creates the games table partitioned by season, converting the table if it already exists without partitions
+
+    :param cursor: a cursor in the migration's transaction
+    :param table_name: the name of the games table
+    """
+    columns = GAME_TABLE_COLUMNS
+
+    cursor.execute(
+        "SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (table_name,)
+    )
+    kind = cursor.fetchall()
+    if kind and kind[0][0] == "p":
+        return None
+
+    legacy_table_name = f"{table_name}_unpartitioned"
+    if kind:
+        cursor.execute(f"ALTER TABLE {table_name} RENAME TO {legacy_table_name}")
+
+    definitions = ", ".join(
+        f"{column} {column_type}"
+        + (" NOT NULL" if column in ("game_id", "season") else "")
+        for column, column_type in columns.items()
+    )
+    cursor.execute(
+        f"CREATE TABLE {table_name} ({definitions}, CONSTRAINT {table_name}_game_season_pkey PRIMARY KEY (game_id, season)) PARTITION BY RANGE (season)"
+    )
+    cursor.execute(
+        f"CREATE TABLE {table_name}_default PARTITION OF {table_name} DEFAULT"
+    )
+
+    # The table as it was is kept, since it is the only other copy of the games, until it is dropped with drop_unpartitioned
+    if kind:
+        copy_unpartitioned(cursor, table_name, legacy_table_name, columns)
+
+
+def copy_unpartitioned(cursor, table_name: str, legacy_table_name: str, columns: dict):
+    """
+    Copies every dated game of the table as it was before partitioning into its season's partition of the partitioned table
+
+    The dates are read from the unpartitioned_game_dates table that migrate fills from the schedule before the migration's transaction.
+
+    :param cursor: a cursor in the migration's transaction
+    :param table_name: the name of the partitioned games table
+    :param legacy_table_name: the name the table before partitioning was renamed to
+    :param columns: a dict mapping every column of the games table to its type
+    """
+    names = [column for column in columns if column not in PARTITION_COLUMNS]
+    # Columns added after the table was created may be missing
+    cursor.execute(
+        f"ALTER TABLE {legacy_table_name} "
+        + ", ".join(f"ADD COLUMN IF NOT EXISTS {column} text" for column in names)
+    )
+
+    cursor.execute(
+        "SELECT DISTINCT EXTRACT(YEAR FROM game_date)::integer FROM unpartitioned_game_dates"
+    )
+    for (season,) in cursor.fetchall():
+        cursor.execute(partition_sql(table_name, season))
+
+    values = ", ".join(
+        convert(f"{legacy_table_name}.{column}", columns[column]) for column in names
+    )
+    game_id = convert(f"{legacy_table_name}.game_id", "integer")
+    cursor.execute(
+        f"INSERT INTO {table_name} ({', '.join(names)}, game_date, season) SELECT {values}, dated.game_date, EXTRACT(YEAR FROM dated.game_date)::smallint FROM {legacy_table_name} JOIN unpartitioned_game_dates AS dated ON dated.game_id = {game_id}"
+    )
+    copied = cursor.rowcount
+
+    cursor.execute(f"SELECT count(*) FROM {legacy_table_name}")
+    ((games,),) = cursor.fetchall()
+    if copied < games:
+        print(
+            f"{games - copied} of {games} game(s) could not be dated from the schedule and are only in {legacy_table_name}."
+        )
+
+
+def index_games(cursor, table_name: str):
+    """
+    Indexes games by date, and the games that do not have a winner yet
+
+    :param cursor: a cursor in the migration's transaction
+    :param table_name: the name of the games table
+    """
+    cursor.execute(
+        f"CREATE INDEX IF NOT EXISTS {table_name}_game_date ON {table_name} (game_date)"
+    )
+    cursor.execute(
+        f"CREATE INDEX IF NOT EXISTS {table_name}_unfinished ON {table_name} (game_id) WHERE winning_team IS NULL"
+    )
+
+
+def stat_sql(side: str, stat: str) -> str:
+    """
+    :param side: "home" or "away"
+    :param stat: the name of the stat, e.g. "era"
+    :returns: the stat of one side's pitcher, as features.stat_column computes it
+    """
+    if stat == "k_bb_ratio":
+        return f"({stat_sql(side, 'k_nine')} / NULLIF({stat_sql(side, 'bb_nine')}, 0))"
+
+    return f"{side}_pitcher_{stat}::double precision"
+
+
+# Each feature of the materialized view created by migration 3 and the per-pitcher stat it compares, as in features.py
+FEATURE_VIEW_STATS = {
+    "pitcher_era_comp": "era",
+    "pitcher_win_percentage_comp": "win_percentage",
+    "pitcher_win_comp": "wins",
+    "pitcher_losses_comp": "losses",
+    "pitcher_innings_pitched_comp": "innings_pitched",
+    "pitcher_k_nine_comp": "k_nine",
+    "pitcher_bb_nine_comp": "bb_nine",
+    "pitcher_k_bb_diff_comp": "k_bb_diff",
+    "pitcher_whip_comp": "whip",
+    "pitcher_babip_comp": "babip",
+    "pitcher_k_bb_ratio_comp": "k_bb_ratio",
+    "pitcher_last3_era_comp": "last3_era",
+    "pitcher_last3_whip_comp": "last3_whip",
+    "pitcher_last3_k_nine_comp": "last3_k_nine",
+    "pitcher_last3_bb_nine_comp": "last3_bb_nine",
+    "pitcher_last3_k_bb_diff_comp": "last3_k_bb_diff",
+    "pitcher_last3_babip_comp": "last3_babip",
+    "pitcher_last5_era_comp": "last5_era",
+    "pitcher_last5_whip_comp": "last5_whip",
+    "pitcher_last5_k_nine_comp": "last5_k_nine",
+    "pitcher_last5_bb_nine_comp": "last5_bb_nine",
+    "pitcher_last5_k_bb_diff_comp": "last5_k_bb_diff",
+    "pitcher_last5_babip_comp": "last5_babip",
+}
+
+
+def create_feature_view(cursor, table_name: str):
+    """
+    Creates the materialized view of every game's features and label
+
+    :param cursor: a cursor in the migration's transaction
+    :param table_name: the name of the games table
+    """
+    features = ", ".join(
+        f"{stat_sql('away', stat)} - {stat_sql('home', stat)} AS {feature}"
+        for feature, stat in FEATURE_VIEW_STATS.items()
+    )
+    cursor.execute(
+        f"CREATE MATERIALIZED VIEW IF NOT EXISTS {table_name}_features AS SELECT game_id, season, game_date, {features}, (winning_team = home_team_id)::integer AS winning_team FROM {table_name}"
+    )
+    # Lets the view be refreshed without blocking reads
+    cursor.execute(
+        f"CREATE UNIQUE INDEX IF NOT EXISTS {table_name}_features_game ON {table_name}_features (game_id, season)"
+    )
+
+
+def track_updates(cursor, table_name: str):
+    """
+    Keeps the time every game was last written current, and indexes it, so that extracts can find the games written since the last one
+
+    :param cursor: a cursor in the migration's transaction
+    :param table_name: the name of the games table
+    """
+    cursor.execute(
+        f"CREATE OR REPLACE FUNCTION {table_name}_touch() RETURNS trigger LANGUAGE plpgsql AS $$ BEGIN NEW.updated_at = now(); RETURN NEW; END $$"
+    )
+    cursor.execute(
+        f"CREATE TRIGGER {table_name}_touch BEFORE UPDATE ON {table_name} FOR EACH ROW EXECUTE FUNCTION {table_name}_touch()"
+    )
+    cursor.execute(
+        f"CREATE INDEX IF NOT EXISTS {table_name}_updated_at ON {table_name} (updated_at)"
+    )
+
+
+def unique_game_ids(cursor, table_name: str):
+    """
+    Rejects a game stored under more than one season, which the primary key on (game_id, season) allows
+
+    :param cursor: a cursor in the migration's transaction
+    :param table_name: the name of the games table
+    """
+    cursor.execute(
+        f"SELECT game_id FROM {table_name} GROUP BY game_id HAVING count(*) > 1 LIMIT 1"
+    )
+    duplicate = cursor.fetchall()
+    if duplicate:
+        raise RuntimeError(
+            f"Game {duplicate[0][0]} is stored under more than one season in {table_name}"
+        )
+
+    # The lock on the game ID makes concurrent writes of the same game wait for each other's check
+    cursor.execute(
+        f"CREATE OR REPLACE FUNCTION {table_name}_unique_game_id() RETURNS trigger LANGUAGE plpgsql AS $$ BEGIN PERFORM pg_advisory_xact_lock(hashtext('{table_name}'), NEW.game_id); IF EXISTS (SELECT 1 FROM {table_name} WHERE game_id = NEW.game_id AND season <> NEW.season) THEN RAISE EXCEPTION 'game % is already stored under another season in {table_name}', NEW.game_id USING ERRCODE = 'unique_violation'; END IF; RETURN NEW; END $$"
+    )
+    cursor.execute(
+        f"CREATE TRIGGER {table_name}_unique_game_id BEFORE INSERT OR UPDATE OF game_id, season ON {table_name} FOR EACH ROW EXECUTE FUNCTION {table_name}_unique_game_id()"
+    )
+
+
+# Every migration, in the order they are applied: its version, its name and the function applying it
+MIGRATIONS = [
+    (1, "partition the games table by season", partition_games),
+    (2, "index game dates and unfinished games", index_games),
+    (3, "materialize the features of every game", create_feature_view),
+    (
+        4,
+        "record when every game was last written",
+        add_columns({"updated_at": "timestamptz NOT NULL DEFAULT now()"}),
+    ),
+    (5, "keep the time every game was last written current", track_updates),
+    (6, "reject a game stored under more than one season", unique_game_ids),
+]
+
+
+def migrate(conn, table_name: str) -> list:
+    """
+    Applies every migration that has not been applied to the games table yet
+
+    :param conn: the database connection
+    :param table_name: the name of the games table
+    :returns: the versions of the migrations applied
+    """
+    migrations_table_name = f"{table_name}_schema_migrations"
+    game_dates = unpartitioned_game_dates(conn, table_name)
+
+    try:
+        with span("db_write", table=migrations_table_name, statement="migrate") as s:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    f"CREATE TABLE IF NOT EXISTS {migrations_table_name} (version integer PRIMARY KEY, name text NOT NULL, applied_at timestamptz NOT NULL DEFAULT now())"
+                )
+                # Concurrent invocations wait here rather than applying the same migration twice
+                cursor.execute(
+                    "SELECT pg_advisory_xact_lock(hashtext(%s))",
+                    (migrations_table_name,),
+                )
+                if game_dates is not None:
+                    # Read by copy_unpartitioned
+                    cursor.execute(
+                        "CREATE TEMPORARY TABLE unpartitioned_game_dates (game_id integer PRIMARY KEY, game_date date NOT NULL) ON COMMIT DROP"
+                    )
+                    if game_dates:
+                        execute_values(
+                            cursor,
+                            "INSERT INTO unpartitioned_game_dates VALUES %s",
+                            list(game_dates.items()),
+                            page_size=len(game_dates),
+                        )
+                cursor.execute(f"SELECT version FROM {migrations_table_name}")
+                applied = {version for (version,) in cursor.fetchall()}
+
+                pending = [
+                    migration for migration in MIGRATIONS if migration[0] not in applied
+                ]
+                for version, name, apply in pending:
+                    print(f"Applying migration {version} to {table_name}: {name}...")
+                    apply(cursor, table_name)
+                    cursor.execute(
+                        f"INSERT INTO {migrations_table_name} (version, name) VALUES (%s, %s)",
+                        (version, name),
+                    )
+            conn.commit()
+            s["applied"] = len(pending)
+    except Exception:
+        conn.rollback()
+        raise
+
+    return [version for version, _, _ in pending]
+
+
+def unpartitioned_game_dates(conn, table_name: str) -> dict:
+    """
+    Dates the games of the games table if it has not been partitioned yet, outside any transaction, so that no lock is held during the requests to the MLB Stats API
+
+    :param conn: the database connection
+    :param table_name: the name of the games table
+    :returns: a dict mapping the ID of every game on the schedule to its date, formatted as %Y-%m-%d; None if the table is partitioned or does not exist
+    """
+    with span("db_read", table=table_name, statement="unpartitioned_game_ids"):
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)",
+                (table_name,),
+            )
+            kind = cursor.fetchall()
+            game_ids = []
+            if kind and kind[0][0] == "r":
+                cursor.execute(
+                    f"SELECT DISTINCT {convert('game_id', 'integer')} FROM {table_name}"
+                )
+                game_ids = [game_id for (game_id,) in cursor.fetchall() if game_id]
+        conn.rollback()
+
+    if not kind or kind[0][0] != "r":
+        return None
+
+    dates = get_game_dates(game_ids)
+    print(
+        f"Found the dates of {len(dates)} of {len(game_ids)} game(s) of {table_name} on the schedule."
+    )
+
+    return dates
+
+
+def ensure_partitions(conn, table_name: str, seasons: list):
+    """
+    Creates the partitions of seasons that do not have one yet, so that their games are not written to the default partition
+
+    A season whose games are already in the default partition cannot be given its own partition; its games stay in the default partition.
+
+    :param conn: the database connection
+    :param table_name: the name of the games table
+    :param seasons: the seasons
+    """
+    for season in seasons:
+        try:
+            with span(
+                "db_write",
+                table=table_name,
+                statement="ensure_partitions",
+                season=season,
+            ):
+                with conn.cursor() as cursor:
+                    cursor.execute(partition_sql(table_name, season))
+                conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(
+                f"Error occurred creating the {season} partition of {table_name}: {e}"
+            )
+
+
+def refresh_features(conn, table_name: str):
+    """
+    Recomputes the materialized view of every game's features and label, without blocking reads of it
+
+    :param conn: the database connection
+    :param table_name: the name of the games table
+    """
+    try:
+        with span(
+            "db_write", table=f"{table_name}_features", statement="refresh_features"
+        ):
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    f"REFRESH MATERIALIZED VIEW CONCURRENTLY {table_name}_features"
+                )
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def drop_unpartitioned(conn, table_name: str) -> int:
+    """
+    Drops the table as it was before partitioning, once every game in it has been copied into the games table
+
+    :param conn: the database connection
+    :param table_name: the name of the games table
+    :returns: the number of games the dropped table held; 0 if there was no such table
+    :raises RuntimeError: if some of its games are not in the games table
+    """
+    legacy_table_name = f"{table_name}_unpartitioned"
+
+    try:
+        with span("db_write", table=legacy_table_name, statement="drop_unpartitioned"):
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT to_regclass(%s)", (legacy_table_name,))
+                if cursor.fetchall()[0][0] is None:
+                    conn.rollback()
+                    return 0
+
+                game_id = convert(f"{legacy_table_name}.game_id", "integer")
+                cursor.execute(
+                    f"SELECT count(*), count(*) FILTER (WHERE NOT EXISTS (SELECT 1 FROM {table_name} WHERE {table_name}.game_id = {game_id})) FROM {legacy_table_name}"
+                )
+                ((games, missing),) = cursor.fetchall()
+                if missing:
+                    raise RuntimeError(
+                        f"{missing} of the {games} game(s) in {legacy_table_name} are not in {table_name}"
+                    )
+
+                cursor.execute(f"DROP TABLE {legacy_table_name}")
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    return games
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Applies the schema migrations of the games table."
+    )
+    parser.add_argument(
+        "--refresh-features",
+        action="store_true",
+        help="also refresh the materialized view of the features",
+    )
+    parser.add_argument(
+        "--drop-unpartitioned",
+        action="store_true",
+        help="also drop the copy of the games table kept from before it was partitioned, once every game in it has been copied",
+    )
+    args = parser.parse_args()
+
+    import function
+
+    conn = function.get_db_connection()
+    applied = migrate(conn, function.TABLE_NAME)
+    print(
+        f"Applied migration(s) {', '.join(map(str, applied))} to {function.TABLE_NAME}."
+        if applied
+        else f"{function.TABLE_NAME} is up to date."
+    )
+
+    if args.drop_unpartitioned:
+        dropped = drop_unpartitioned(conn, function.TABLE_NAME)
+        print(
+            f"Dropped {function.TABLE_NAME}_unpartitioned and its {dropped} game(s)."
+            if dropped
+            else f"There is no {function.TABLE_NAME}_unpartitioned to drop."
+        )
+
+    if args.refresh_features:
+        refresh_features(conn, function.TABLE_NAME)
+        print(f"Refreshed {function.TABLE_NAME}_features.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+import json
+import joblib
+import os
+import shutil
+import tempfile
+
+from instrumentation import span
+
+"""
+Versioned model artifacts.
+
+An artifact is a directory holding a manifest and one joblib file per model. Each joblib file
+holds the fitted model and the scaler its features were standardised with, and is written
+uncompressed so that its numeric arrays can be memory-mapped when it is loaded rather than
+copied. The manifest lists every model with its ordered features and metadata.
+
+Artifacts are published to S3 under <prefix>/<version>/, and <prefix>/latest.json names the
+current version. The serving side keeps downloaded artifacts in a local cache keyed by
+version and only re-reads latest.json when its ETag changes.
+"""
+
+ARTIFACT_FORMAT = 1
+MANIFEST_FILE = "manifest.json"
+LATEST_MANIFEST = "latest.json"
+
+
+def write_artifact(models: dict, directory: str, version: str) -> dict:
+    """
+    Writes an artifact
+
+    :param models: a dict mapping the name of each model to a dict of its "model", "scaler", "features" and "metadata"
+    :param directory: the directory to write the artifact to
+    :param version: the version of the artifact
+    :returns: the manifest of the artifact
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest = {"format": ARTIFACT_FORMAT, "version": version, "models": {}}
+
+    for name, entry in models.items():
+        file_name = f"{name}.joblib"
+        joblib.dump(
+            {"model": entry["model"], "scaler": entry["scaler"]},
+            os.path.join(directory, file_name),
+        )
+        manifest["models"][name] = {
+            "file": file_name,
+            "features": list(entry["features"]),
+            "metadata": entry["metadata"],
+        }
+
+    with open(os.path.join(directory, MANIFEST_FILE), "w") as file:
+        json.dump(manifest, file, indent=2, default=str)
+
+    return manifest
+
+
+def read_manifest(directory: str) -> dict:
+    """
+    :param directory: the directory of an artifact
+    :returns: the manifest of the artifact
+    """
+    with open(os.path.join(directory, MANIFEST_FILE), "r") as file:
+        manifest = json.load(file)
+
+    if manifest.get("format") != ARTIFACT_FORMAT:
+        raise ValueError(
+            f"Unsupported model artifact format {manifest.get('format')} in {directory}"
+        )
+
+    return manifest
+
+
+def read_artifact(directory: str) -> dict:
+    """
+    Loads every model of an artifact, memory-mapping their arrays
+
+    :param directory: the directory of the artifact
+    :returns: a dict mapping the name of each model to its (model, metadata) pair, where the metadata also holds the model's "features", "scaler" and "version"
+    """
+    manifest = read_manifest(directory)
+    models = {}
+
+    with span("model_load", version=manifest["version"]):
+        for name, entry in manifest["models"].items():
+            loaded = joblib.load(os.path.join(directory, entry["file"]), mmap_mode="r")
+            models[name] = (
+                loaded["model"],
+                {
+                    **entry["metadata"],
+                    "features": entry["features"],
+                    "scaler": loaded["scaler"],
+                    "version": manifest["version"],
+                },
+            )
+
+    return models
+
+
+def publish_artifact(s3_client, directory: str, bucket: str, prefix: str) -> str:
+    """
+    Uploads an artifact and then points latest.json at it
+
+    :param s3_client: the S3 client
+    :param directory: the directory of the artifact
+    :param bucket: the bucket to upload to
+    :param prefix: the prefix artifacts are stored under
+    :returns: the version of the artifact
+    """
+    manifest = read_manifest(directory)
+    version = manifest["version"]
+
+    # latest.json is only written once every file of the version is in place
+    files = [entry["file"] for entry in manifest["models"].values()] + [MANIFEST_FILE]
+    for file_name in files:
+        s3_client.upload_file(
+            os.path.join(directory, file_name),
+            bucket,
+            f"{prefix}/{version}/{file_name}",
+        )
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=f"{prefix}/{LATEST_MANIFEST}",
+        Body=json.dumps({"version": version}),
+        ContentType="application/json",
+    )
+
+    return version
+
+
+def sync_artifact(
+    s3_client, bucket: str, prefix: str, cache_path: str, etag: str = None
+) -> tuple:
+    """
+    Makes sure the latest artifact is in the local cache, downloading it if it is not
+
+    :param s3_client: the S3 client
+    :param bucket: the bucket artifacts are stored in
+    :param prefix: the prefix artifacts are stored under
+    :param cache_path: the directory artifacts are cached in
+    :param etag: the ETag of latest.json when it was last synced
+    :returns: a tuple of the ETag of latest.json and the directory of the latest artifact; the directory is None if latest.json has not changed since etag
+    """
+    from botocore.exceptions import ClientError
+
+    with span("model_sync", bucket=bucket) as s:
+        try:
+            latest = s3_client.get_object(
+                Bucket=bucket,
+                Key=f"{prefix}/{LATEST_MANIFEST}",
+                **({"IfNoneMatch": etag} if etag else {}),
+            )
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ["304", "NotModified"]:
+                return etag, None
+            raise
+
+        version = json.loads(latest["Body"].read())["version"]
+        directory = os.path.join(cache_path, version)
+
+        if not os.path.exists(os.path.join(directory, MANIFEST_FILE)):
+            # Download into a temporary directory first so that a half-downloaded version is never used
+            os.makedirs(cache_path, exist_ok=True)
+            download_path = tempfile.mkdtemp(dir=cache_path)
+            try:
+                s3_client.download_file(
+                    bucket,
+                    f"{prefix}/{version}/{MANIFEST_FILE}",
+                    os.path.join(download_path, MANIFEST_FILE),
+                )
+                for entry in read_manifest(download_path)["models"].values():
+                    s3_client.download_file(
+                        bucket,
+                        f"{prefix}/{version}/{entry['file']}",
+                        os.path.join(download_path, entry["file"]),
+                    )
+                    s["bytes"] += os.path.getsize(
+                        os.path.join(download_path, entry["file"])
+                    )
+                os.replace(download_path, directory)
+            except Exception:
+                shutil.rmtree(download_path, ignore_errors=True)
+                raise
+
+        # Only the latest version is kept, since /tmp is small
+        for cached in os.listdir(cache_path):
+            if cached != version:
+                shutil.rmtree(os.path.join(cache_path, cached), ignore_errors=True)
+
+    return latest["ETag"], directory
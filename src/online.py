@@ -0,0 +1,83 @@
+import copy
+import numpy as np
+
+from database import GAME_COLUMNS
+from features import LABEL, build_features, feature_matrix, rows_to_frame
+from instrumentation import span
+from model_artifact import write_artifact
+from predictions import standardise
+
+"""
+Online updates of the incrementally trainable model.
+
+train.py adds an "online" model to each artifact: a logistic model trained by stochastic
+gradient descent. Every morning, once yesterday's winners are known, those games are used to
+take a partial_fit step on the model, which costs time in proportion to the number of new
+games, and the result is published as a new version of the artifact. The scaler is left as
+train.py fitted it, since it is shared with the batch models and the model's weights are only
+meaningful on the scale it was trained on; it only changes with the next batch retrain, which
+is then only needed occasionally.
+"""
+
+ONLINE_MODEL = "online"
+
+
+def learn(models: dict, rows: list) -> tuple:
+    """
+    Updates the online model with finished games
+
+    :param models: the output of model_artifact.read_artifact
+    :param rows: tuples of values in the order of database.GAME_COLUMNS, followed by the winning team
+    :returns: a tuple of the models with the online model updated, and the number of games it learned from
+    """
+    features = build_features(
+        rows_to_frame(rows, GAME_COLUMNS + ["winning_team"]), label=True
+    )
+    if features.is_empty():
+        return models, 0
+
+    model, metadata = models[ONLINE_MODEL]
+    # The loaded model is a read-only memory map, so it is copied before being updated
+    model = copy.deepcopy(model)
+
+    # The scaler also covers features the model does not use, so the model's are scaled by name
+    X = feature_matrix(standardise(features, metadata["scaler"]), metadata["features"])
+    y = features[LABEL].to_numpy()
+
+    with span("model_learn", model=ONLINE_MODEL, games=len(y)):
+        model.partial_fit(X, y, classes=np.array([0, 1]))
+
+    metadata = {
+        **metadata,
+        "games_learned": metadata.get("games_learned", 0) + len(y),
+    }
+
+    return {**models, ONLINE_MODEL: (model, metadata)}, len(y)
+
+
+def save(models: dict, directory: str, version: str) -> dict:
+    """
+    Writes loaded models back out as a new version of the artifact
+
+    :param models: the output of model_artifact.read_artifact, or of learn
+    :param directory: the directory to write the artifact to
+    :param version: the version of the artifact
+    :returns: the manifest of the artifact
+    """
+    return write_artifact(
+        {
+            name: {
+                "model": model,
+                "scaler": metadata["scaler"],
+                "features": metadata["features"],
+                "metadata": {
+                    key: value
+                    for key, value in metadata.items()
+                    if key not in ["scaler", "features", "version"]
+                },
+            }
+            for name, (model, metadata) in models.items()
+        },
+        directory,
+        version,
+    )
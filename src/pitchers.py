@@ -0,0 +1,463 @@
+import json
+import os
+import stats_api
+import threading
+import time
+
+from datetime import date, datetime, timedelta
+from fanout import map_concurrently
+from instrumentation import span
+
+"""
+Pitcher lookups for the daily pipeline.
+
+A pitcher's season stat line is fetched once per run and kept in a memo so that
+every metric written to the database is derived from the same snapshot.
+
+Pitcher IDs normally come straight from the schedule, and stat lines are memoized by ID so
+that pitchers who share a name are never confused. When they do not, names are resolved
+through a persistent cache so that the same starters are not looked up by name on every
+run. A name that belongs to more than one pitcher is never resolved from the cache.
+"""
+
+PLAYER_ID_CACHE_PATH = os.getenv("MLB_PLAYER_ID_CACHE_PATH", "/tmp/player_ids.json")
+PLAYER_ID_TTL = float(os.getenv("MLB_PLAYER_ID_TTL_DAYS", "30")) * 86400
+PLAYER_ID_NEGATIVE_TTL = (
+    float(os.getenv("MLB_PLAYER_ID_NEGATIVE_TTL_DAYS", "1")) * 86400
+)
+
+# The most players the stats endpoint returns per request
+STATS_PAGE_SIZE = 1000
+
+stat_line_memo = {}
+player_id_cache = None
+player_id_cache_lock = threading.Lock()
+
+
+class PitcherStatLine:
+    """
+    A snapshot of a pitcher's season pitching stats.
+
+    Every metric is computed from the stats fetched when the snapshot was built, so no
+    metric makes its own call to the MLB Stats API.
+    """
+
+    def __init__(self, name: str, pitcher_id: int, stats: dict):
+        """
+        :param name: the name of the pitcher
+        :param pitcher_id: the ID of the pitcher; None if it cannot be found
+        :param stats: the season pitching stats for the pitcher; None if they cannot be found
+        """
+        self.name = name
+        self.pitcher_id = pitcher_id
+        self.stats = stats
+
+    def era(self) -> float:
+        """
+        :returns: the ERA as a float to two decimal places; None if unavailable
+        """
+        try:
+            return format(float(self.stats["era"]), ".2f")
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def win_percentage(self) -> float:
+        """
+        :returns: the win percentage as a float to three decimal places; None if unavailable
+        """
+        try:
+            return format(float(self.stats["winPercentage"]), ".3f")
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def wins(self) -> int:
+        """
+        :returns: the pitcher's wins as an int; None if unavailable
+        """
+        try:
+            return int(self.stats["wins"])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def losses(self) -> int:
+        """
+        :returns: the pitcher's losses as an int; None if unavailable
+        """
+        try:
+            return int(self.stats["losses"])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def innings_pitched(self) -> float:
+        """
+        Gets the number of innings pitched.
+
+        Because innings pitched are counted with .0, .1, .2, where 1, and 2 are outs, the decimal point will be multipled by 3 for later computation purposes.
+
+        :returns: the innings pitched as a float to one decimal place; None if unavailable
+        """
+        try:
+            IP = self.stats["inningsPitched"]
+            outs = int(IP.split(".")[1]) * 3
+            return float(f'{IP.split(".")[0]}.{outs}')
+        except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+            return None
+
+    def k_nine(self) -> float:
+        """
+        :returns: the K/9 as a float; None if unavailable
+        """
+        try:
+            return float(self.stats["strikeoutsPer9Inn"])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def bb_nine(self) -> float:
+        """
+        :returns: the BB/9 as a float; None if unavailable
+        """
+        try:
+            return float(self.stats["walksPer9Inn"])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def k_bb_diff(self) -> float:
+        """
+        :returns: the strikeout percentage minus the walk percentage as a float; None if unavailable
+        """
+        try:
+            batters_faced = float(self.stats["battersFaced"])
+            k_perc = float(self.stats["strikeOuts"]) / batters_faced
+            bb_perc = float(self.stats["baseOnBalls"]) / batters_faced
+            return k_perc - bb_perc
+        except (KeyError, TypeError, ValueError, ZeroDivisionError):
+            return None
+
+    def whip(self) -> float:
+        """
+        :returns: the WHIP as a float; None if unavailable
+        """
+        try:
+            return float(self.stats["whip"])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def babip(self) -> float:
+        """
+        Gets the batting average on balls in play.
+
+        More on BABIP: https://library.fangraphs.com/pitching/babip/
+
+        :returns: the BABIP as a float; None if unavailable
+        """
+        try:
+            hits = float(self.stats["hits"])
+            home_runs = float(self.stats["homeRuns"])
+            at_bats = float(self.stats["atBats"])
+            strikeouts = float(self.stats["strikeOuts"])
+            sac_flies = float(self.stats["sacFlies"])
+
+            return (hits - home_runs) / (at_bats - strikeouts - home_runs + sac_flies)
+        except (KeyError, TypeError, ValueError, ZeroDivisionError):
+            return None
+
+
+def load_player_ids() -> dict:
+    """
+    Loads the name to ID resolution cache from disk, dropping expired entries
+
+    :returns: the cache, mapping a player's name to their ID (None if the name could not be resolved or is ambiguous) and when it was resolved
+    """
+    global player_id_cache
+
+    with player_id_cache_lock:
+        if player_id_cache is None:
+            try:
+                with open(PLAYER_ID_CACHE_PATH, "r") as file:
+                    cached = json.load(file)
+            except (OSError, ValueError):
+                cached = {}
+
+            now = time.time()
+            player_id_cache = {
+                name: entry
+                for name, entry in cached.items()
+                if now - entry["resolved_at"]
+                < (
+                    PLAYER_ID_TTL
+                    if entry["id"] or entry.get("ambiguous")
+                    else PLAYER_ID_NEGATIVE_TTL
+                )
+            }
+
+    return player_id_cache
+
+
+def save_player_ids():
+    """
+    Writes the name to ID resolution cache to disk
+    """
+    if player_id_cache is None:
+        return
+
+    with player_id_cache_lock:
+        try:
+            with open(PLAYER_ID_CACHE_PATH, "w") as file:
+                json.dump(player_id_cache, file)
+        except OSError as e:
+            print(f"Unable to save player ID cache to {PLAYER_ID_CACHE_PATH}: {e}")
+
+
+def remember_player_id(player: str, player_id: int):
+    """
+    Records the ID of a player in the resolution cache
+
+    If the name is already recorded with a different ID, it belongs to more than one player, and is recorded as ambiguous instead.
+
+    :param player: the name of the player
+    :param player_id: the ID of the player; None if the name could not be resolved
+    """
+    cache = load_player_ids()
+
+    with player_id_cache_lock:
+        entry = cache.get(player)
+        if entry and (
+            entry.get("ambiguous")
+            or player_id
+            and entry["id"]
+            and player_id != entry["id"]
+        ):
+            if not entry.get("ambiguous"):
+                print(
+                    f"{player} is the name of more than one player ({entry['id']}, {player_id}); it will not be resolved by name"
+                )
+            cache[player] = {"id": None, "ambiguous": True, "resolved_at": time.time()}
+        else:
+            cache[player] = {"id": player_id, "resolved_at": time.time()}
+
+
+def search_players(player: str) -> list:
+    """
+    Gets the players from the current season whose name contains the given name
+
+    :param player: the name being searched for
+    :returns: the matching players
+    """
+    with span("player_lookup", player=player) as s:
+        r = stats_api.get(
+            "sports_players",
+            {
+                "sportId": 1,
+                "season": datetime.now().year,
+                "fields": "people,id,fullName,firstName,lastName,useName,boxscoreName,nameFirstLast,firstLastName,lastFirstName",
+            },
+        )
+        s["bytes"] = stats_api.payload_size(r)
+
+    return [
+        person
+        for person in r.get("people", [])
+        if any(player.lower() in str(value).lower() for value in person.values())
+    ]
+
+
+def lookup_player(player: str) -> int:
+    """
+    Gets the ID of a player specified by name, using the resolution cache when possible
+
+    When more than one player matches the name, the player whose full name matches exactly is preferred. A name that
+    is the full name of more than one player is ambiguous and is not resolved.
+
+    :param player: the name of the player whose ID is being accessed
+    :returns: the player ID for the specified name; None if it cannot be found or is ambiguous
+    """
+    if not player:
+        return None
+
+    cache = load_player_ids()
+    if player in cache:
+        return cache[player]["id"]
+
+    matches = search_players(player)
+    exact_matches = [
+        match
+        for match in matches
+        if match.get("fullName", "").lower() == player.lower()
+    ]
+    matches = exact_matches or matches
+
+    if len({match["id"] for match in exact_matches}) > 1:
+        print(f"{player} is the name of more than one player; unable to get their ID")
+        with player_id_cache_lock:
+            cache[player] = {"id": None, "ambiguous": True, "resolved_at": time.time()}
+        return None
+
+    if matches:
+        player_id = matches[0]["id"]
+    else:
+        print(f"Unable to get ID for pitcher {player}")
+        player_id = None
+
+    remember_player_id(player, player_id)
+
+    return player_id
+
+
+def fetch_season_stats(pitcher_id: int, as_of: date = None) -> dict:
+    """
+    Gets the season pitching stats for a pitcher
+
+    :param pitcher_id: the ID of the pitcher whose stats are being accessed
+    :param as_of: if given, only games of that season played before this date are counted, i.e. the stats going into a game on that date
+    :returns: the raw season stats as returned by the MLB Stats API; None if they cannot be found
+    """
+    if as_of:
+        day_before = as_of - timedelta(1)
+        hydrate = f"stats(group=[pitching],type=[byDateRange],startDate=01/01/{as_of.year},endDate={day_before.strftime('%m/%d/%Y')},sportId=1)"
+    else:
+        hydrate = "stats(group=[pitching],type=[season],sportId=1)"
+
+    with span("stat_fetch", pitcher_id=pitcher_id, as_of=str(as_of)) as s:
+        r = stats_api.get("person", {"personId": pitcher_id, "hydrate": hydrate})
+        s["bytes"] = stats_api.payload_size(r)
+
+    try:
+        return [
+            split["stat"]
+            for stat_group in r["people"][0].get("stats", [])
+            for split in stat_group["splits"]
+        ][0]
+    except IndexError:
+        print(f"Unable to get season stats for pitcher {pitcher_id}")
+        return None
+
+
+def stat_line_key(pitcher: str, pitcher_id: int = None, as_of: date = None) -> tuple:
+    """
+    :param pitcher: the name of the pitcher
+    :param pitcher_id: the ID of the pitcher, if known
+    :param as_of: the date the stat line is going into, as for get_stat_line
+    :returns: the key of the pitcher's stat line in the memo; by ID when it is known, so that pitchers who share a name are kept apart
+    """
+    if pitcher_id:
+        return ("id", pitcher_id, as_of)
+
+    return ("name", pitcher, as_of)
+
+
+def get_stat_line(
+    pitcher: str, pitcher_id: int = None, as_of: date = None
+) -> PitcherStatLine:
+    """
+    Gets the season stat line for a pitcher, fetching it only the first time it is requested during a run
+
+    :param pitcher: the name of the pitcher whose stat line is being accessed
+    :param pitcher_id: the ID of the pitcher, if known; otherwise it is looked up by name
+    :param as_of: if given, the stat line going into a game on this date rather than the current one
+    :returns: the stat line for the pitcher
+    """
+    key = stat_line_key(pitcher, pitcher_id, as_of)
+    if key not in stat_line_memo:
+        if pitcher_id:
+            remember_player_id(pitcher, pitcher_id)
+        else:
+            pitcher_id = lookup_player(pitcher)
+        stats = fetch_season_stats(pitcher_id, as_of) if pitcher_id else None
+        stat_line_memo[key] = PitcherStatLine(pitcher, pitcher_id, stats)
+
+    return stat_line_memo[key]
+
+
+def fetch_all_season_stats(season: int) -> dict:
+    """
+    Gets the season pitching stats of every pitcher who has pitched this season, a page at a time
+
+    Pitchers who pitched for more than one team are left out unless the API also returns their combined line.
+
+    :param season: the season
+    :returns: a dict mapping each pitcher's ID to their raw season stats as returned by the MLB Stats API
+    """
+    stats = {}
+    offset = 0
+
+    while True:
+        with span("stat_fetch_all", season=season, offset=offset) as s:
+            r = stats_api.get(
+                "stats",
+                {
+                    "stats": "season",
+                    "group": "pitching",
+                    "playerPool": "ALL",
+                    "sportIds": 1,
+                    "season": season,
+                    "limit": STATS_PAGE_SIZE,
+                    "offset": offset,
+                },
+            )
+            s["bytes"] = stats_api.payload_size(r)
+
+        splits = [split for group in r.get("stats", []) for split in group["splits"]]
+        by_pitcher = {}
+        for split in splits:
+            by_pitcher.setdefault(split["player"]["id"], []).append(split)
+        for pitcher_id, pitcher_splits in by_pitcher.items():
+            combined = [split for split in pitcher_splits if "team" not in split]
+            if combined:
+                stats[pitcher_id] = combined[0]["stat"]
+            elif len(pitcher_splits) == 1:
+                stats[pitcher_id] = pitcher_splits[0]["stat"]
+
+        total = sum(group.get("totalSplits", 0) for group in r.get("stats", []))
+        offset += len(splits)
+        if not splits or offset >= total:
+            return stats
+
+
+def seed_stat_lines(pitchers: list, stats: dict, as_of: date = None) -> int:
+    """
+    Puts stat lines that are already known, e.g. from the snapshot store, into the memo so that they are not fetched
+
+    :param pitchers: tuples of the name and ID of the pitchers
+    :param stats: a dict mapping pitcher IDs to their raw season stats
+    :param as_of: the date the stats are going into, as for get_stat_line
+    :returns: the number of pitchers whose stat lines were put into the memo
+    """
+    seeded = 0
+    for pitcher, pitcher_id in pitchers:
+        key = stat_line_key(pitcher, pitcher_id, as_of)
+        if pitcher_id in stats and key not in stat_line_memo:
+            remember_player_id(pitcher, pitcher_id)
+            stat_line_memo[key] = PitcherStatLine(
+                pitcher, pitcher_id, stats[pitcher_id]
+            )
+            seeded += 1
+
+    return seeded
+
+
+def prefetch_stat_lines(pitchers: list, max_workers: int) -> float:
+    """
+    Fetches the stat lines for many pitchers concurrently so that later calls to get_stat_line are served from the memo
+
+    :param pitchers: tuples of the name, ID (None if unknown) and, optionally, as-of date of the pitchers whose stat lines are being fetched
+    :param max_workers: the maximum number of pitchers being fetched at once
+    :returns: the summed time of the fetches in seconds
+    """
+    to_fetch = [
+        pitcher
+        for pitcher in dict.fromkeys(pitchers)
+        if stat_line_key(*pitcher) not in stat_line_memo
+    ]
+    _, sequential_time = map_concurrently(
+        lambda pitcher: get_stat_line(*pitcher), to_fetch, max_workers
+    )
+    save_player_ids()
+
+    return sequential_time
+
+
+def clear_stat_lines():
+    """
+    Clears the stat lines fetched during the previous run
+    """
+    stat_line_memo.clear()
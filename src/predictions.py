@@ -0,0 +1,112 @@
+import numpy as np
+import polars as pl
+
+from database import PREDICTION_COLUMNS
+from features import TRAINING_FEATURES, build_features, feature_matrix, rows_to_frame
+from instrumentation import span
+
+"""
+Scores the day's games with the trained models.
+
+The model artifact (see model_artifact.py) holds the all-stats, old-school and modern models,
+and, when it was written by train.py, the incrementally updated online model (see online.py). Features for every game on the slate are built in one pass and
+each model is called once for the whole slate, so the cost of scoring does not grow with the
+number of calls.
+"""
+
+# The models of the artifact and the prefix of their columns
+MODEL_COLUMN_PREFIXES = {
+    "all_stats": "",
+    "old_school": "old_school_",
+    "modern": "modern_",
+    "online": "online_",
+}
+
+
+def model_features(metadata: dict) -> list:
+    """
+    :param metadata: the metadata of a model
+    :returns: the features the model was trained on, in order
+    """
+    return metadata["features"]
+
+
+def standardise(features: pl.DataFrame, scaler) -> pl.DataFrame:
+    """
+    Scales the features the same way they were scaled for training
+
+    :param features: the output of features.build_features
+    :param scaler: the StandardScaler fitted on TRAINING_FEATURES (ALL_STAT_FEATURES in older artifacts) when training; None if the features were not scaled
+    :returns: the scaled features; features the frame does not have are skipped
+    """
+    if scaler is None:
+        return features
+
+    return features.with_columns(
+        (pl.col(name) - mean) / scale
+        for name, mean, scale in zip(
+            getattr(scaler, "feature_names_in_", TRAINING_FEATURES),
+            scaler.mean_,
+            scaler.scale_,
+        )
+        if name in features.columns
+    )
+
+
+def home_win_probabilities(model, X: np.ndarray) -> np.ndarray:
+    """
+    :param model: a fitted classifier
+    :param X: the features of every game
+    :returns: the probability of the home team winning every game; None if the model cannot give probabilities
+    """
+    if not hasattr(model, "predict_proba"):
+        return None
+
+    return model.predict_proba(X)[:, list(model.classes_).index(1)]
+
+
+def predict(models: dict, rows: list) -> list:
+    """
+    Predicts the winner of every game with every model
+
+    Games missing a feature get no predictions, and models missing from the artifact predict nothing.
+
+    :param models: the output of model_artifact.read_artifact
+    :param rows: tuples of values in the order of database.GAME_COLUMNS
+    :returns: tuples of game ID followed by values in the order of database.PREDICTION_COLUMNS
+    """
+    features = build_features(rows_to_frame(rows))
+    if features.is_empty():
+        return []
+
+    game_ids = features["game_id"].to_list()
+    teams = {row[0]: (row[1], row[3]) for row in rows}
+    columns = {}
+
+    for name, prefix in MODEL_COLUMN_PREFIXES.items():
+        if name not in models:
+            columns[f"{prefix}predicted_winner"] = [None] * len(game_ids)
+            columns[f"{prefix}home_win_probability"] = [None] * len(game_ids)
+            continue
+
+        model, metadata = models[name]
+        # Models are trained on plain matrices, in the order of the features in the manifest
+        X = feature_matrix(
+            standardise(features, metadata.get("scaler")), model_features(metadata)
+        )
+
+        with span("model_predict", model=name, games=len(game_ids)):
+            home_won = model.predict(X)
+            probabilities = home_win_probabilities(model, X)
+
+        columns[f"{prefix}predicted_winner"] = [
+            teams[game_id][0] if won == 1 else teams[game_id][1]
+            for game_id, won in zip(game_ids, home_won)
+        ]
+        columns[f"{prefix}home_win_probability"] = (
+            [None] * len(game_ids)
+            if probabilities is None
+            else [float(p) for p in probabilities]
+        )
+
+    return list(zip(game_ids, *(columns[column] for column in PREDICTION_COLUMNS)))
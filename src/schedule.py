@@ -0,0 +1,137 @@
+import stats_api
+
+from games import FINAL_STATUSES
+from instrumentation import span
+from teams import lookup_team_name
+
+"""
+Schedule fetching for the daily pipeline.
+
+This returns games in the same shape as statsapi.schedule, but also keeps the IDs of the
+probable pitchers and the winning team that statsapi.schedule throws away, so that they
+do not have to be looked up again by name.
+"""
+
+# The most games whose dates are looked up in a single request
+GAME_DATE_CHUNK_SIZE = 200
+
+
+def get_schedule(
+    date: str = None, start_date: str = None, end_date: str = None
+) -> list:
+    """
+    Gets the games for a date or a range of dates
+
+    :param date: the date to get games for, formatted as %m/%d/%Y
+    :param start_date: the first date of a range to get games for, formatted as %m/%d/%Y
+    :param end_date: the last date of a range to get games for, formatted as %m/%d/%Y
+    :returns: a list of games
+    """
+    params = {"sportId": "1", "hydrate": "decisions,probablePitcher(note)"}
+
+    if date:
+        params["date"] = date
+    else:
+        params.update({"startDate": start_date, "endDate": end_date})
+
+    with span(
+        "schedule_fetch", date=date, start_date=start_date, end_date=end_date
+    ) as s:
+        r = stats_api.get("schedule", params)
+        s["bytes"] = stats_api.payload_size(r)
+
+    games = []
+    for day in r.get("dates", []):
+        for game in day.get("games", []):
+            games.append(parse_game(game, day["date"]))
+
+    return games
+
+
+def get_game_dates(game_ids: list) -> dict:
+    """
+    Gets the dates of games by their IDs, e.g. for games that were stored without them
+
+    :param game_ids: the IDs of the games
+    :returns: a dict mapping the ID of every game on the schedule to the date it is played on, formatted as %Y-%m-%d; the date it was rescheduled to if it was rescheduled
+    """
+    game_ids = list(game_ids)
+    dates = {}
+    for start in range(0, len(game_ids), GAME_DATE_CHUNK_SIZE):
+        chunk = game_ids[start : start + GAME_DATE_CHUNK_SIZE]
+        with span("schedule_fetch", games=len(chunk)) as s:
+            r = stats_api.get(
+                "schedule",
+                {
+                    "sportId": "1",
+                    "gamePks": ",".join(str(game_id) for game_id in chunk),
+                },
+            )
+            s["bytes"] = stats_api.payload_size(r)
+
+        # Days are in order, so a rescheduled game is left with the date it was rescheduled to
+        for day in r.get("dates", []):
+            for game in day.get("games", []):
+                dates[game["gamePk"]] = day["date"]
+
+    return dates
+
+
+def parse_game(game: dict, game_date: str) -> dict:
+    """
+    Flattens a game from the schedule endpoint
+
+    :param game: the game as returned by the schedule endpoint
+    :param game_date: the date of the game
+    :returns: the game with the same keys as statsapi.schedule, plus home_probable_pitcher_id, away_probable_pitcher_id, winning_team_id and losing_team_id
+    """
+    home = game["teams"]["home"]
+    away = game["teams"]["away"]
+
+    game_info = {
+        "game_id": game["gamePk"],
+        "game_datetime": game["gameDate"],
+        "game_date": game_date,
+        "game_type": game["gameType"],
+        "status": game["status"]["detailedState"],
+        "away_name": team_name(away),
+        "home_name": team_name(home),
+        "away_id": away["team"]["id"],
+        "home_id": home["team"]["id"],
+        "doubleheader": game.get("doubleHeader"),
+        "game_num": game.get("gameNumber"),
+        "home_probable_pitcher": home.get("probablePitcher", {}).get("fullName", ""),
+        "away_probable_pitcher": away.get("probablePitcher", {}).get("fullName", ""),
+        "home_probable_pitcher_id": home.get("probablePitcher", {}).get("id"),
+        "away_probable_pitcher_id": away.get("probablePitcher", {}).get("id"),
+        "home_pitcher_note": home.get("probablePitcher", {}).get("note", ""),
+        "away_pitcher_note": away.get("probablePitcher", {}).get("note", ""),
+        "away_score": away.get("score", "0"),
+        "home_score": home.get("score", "0"),
+    }
+
+    if game_info["status"] in FINAL_STATUSES:
+        if game.get("isTie"):
+            game_info.update({"winning_team": "Tie", "losing_team": "Tie"})
+        else:
+            winner, loser = (away, home) if away.get("isWinner") else (home, away)
+            game_info.update(
+                {
+                    "winning_team": team_name(winner),
+                    "losing_team": team_name(loser),
+                    "winning_team_id": winner["team"]["id"],
+                    "losing_team_id": loser["team"]["id"],
+                }
+            )
+
+    return game_info
+
+
+def team_name(side: dict) -> str:
+    """
+    Gets the name of one side of a game, falling back to the team index when the schedule leaves it out
+
+    :param side: the home or away side of a game as returned by the schedule endpoint
+    :returns: the name of the team
+    """
+    return side["team"].get("name") or lookup_team_name(side["team"]["id"]) or "???"
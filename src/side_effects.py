@@ -0,0 +1,158 @@
+import smtplib
+import ssl
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor, wait
+
+"""
+Run-scoped side effects: notifications and uploads that the pipeline's results do not depend on.
+
+Side effects are queued on a SideEffects dispatcher and run on its background threads
+while the next stage carries on, and the run only waits for them at the end, up to a
+deadline. Emails go through an SmtpSession, which opens a single TLS connection per run
+(ahead of time, in the background) and sends every message over it.
+"""
+
+
+class SideEffects:
+    """
+    A queue of side effects run concurrently in the background
+    """
+
+    def __init__(self, max_workers: int):
+        """
+        :param max_workers: the most side effects run at once
+        """
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="side-effect"
+        )
+        self.lock = threading.Lock()
+        self.futures = {}
+
+    def submit(self, name: str, func, *args, **kwargs):
+        """
+        Queues a side effect
+
+        :param name: the name of the side effect, for reporting
+        :param func: the function to call
+        :param args: the positional arguments of the function
+        :param kwargs: the keyword arguments of the function
+        :returns: the future of the side effect
+        """
+        future = self.executor.submit(func, *args, **kwargs)
+        with self.lock:
+            self.futures[future] = name
+
+        return future
+
+    def wait(self, timeout: float) -> dict:
+        """
+        Waits for every side effect queued so far
+
+        :param timeout: the most time to wait, in seconds
+        :returns: a dict of the number of side effects "done", and the names of those "failed" (with their errors) and still "pending"
+        """
+        with self.lock:
+            futures = dict(self.futures)
+
+        finished, unfinished = wait(futures, timeout=max(timeout, 0))
+
+        failed = [
+            (futures[future], future.exception())
+            for future in finished
+            if future.exception() is not None
+        ]
+        with self.lock:
+            for future in finished:
+                self.futures.pop(future, None)
+
+        return {
+            "done": len(finished) - len(failed),
+            "failed": failed,
+            "pending": [futures[future] for future in unfinished],
+        }
+
+    def close(self, timeout: float) -> dict:
+        """
+        Waits for every side effect up to a deadline, then abandons any that are still running
+
+        :param timeout: the most time to wait, in seconds
+        :returns: the output of wait
+        """
+        results = self.wait(timeout)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+        return results
+
+
+class SmtpSession:
+    """
+    A lazily opened SMTP over TLS connection, shared by every email of a run
+    """
+
+    def __init__(self, host: str, port: int, user: str, password: str):
+        """
+        :param host: the SMTP server
+        :param port: the port of the SMTP server
+        :param user: the user to log in as
+        :param password: the password of the user
+        """
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.lock = threading.Lock()
+        self.server = None
+
+    def connect(self) -> float:
+        """
+        Opens the connection and logs in, unless that has already been done
+
+        :returns: how long connecting took, in seconds
+        """
+        start_time = time.time()
+        with self.lock:
+            self.open()
+
+        return time.time() - start_time
+
+    def open(self):
+        """
+        Opens the connection if it is not open; the caller must hold the lock
+        """
+        if self.server is None:
+            server = smtplib.SMTP_SSL(
+                self.host, self.port, context=ssl.create_default_context()
+            )
+            server.login(self.user, self.password)
+            self.server = server
+
+    def send(self, from_address: str, to_address: str, message: str):
+        """
+        Sends an email, reconnecting once if the server has closed the connection
+
+        :param from_address: the sender
+        :param to_address: the recipient
+        :param message: the whole message, headers included
+        """
+        with self.lock:
+            self.open()
+            try:
+                self.server.sendmail(from_address, to_address, message)
+            except smtplib.SMTPServerDisconnected:
+                self.server = None
+                self.open()
+                self.server.sendmail(from_address, to_address, message)
+
+    def close(self):
+        """
+        Closes the connection, if it was opened
+        """
+        with self.lock:
+            if self.server is not None:
+                try:
+                    self.server.quit()
+                except (smtplib.SMTPException, OSError):
+                    pass
+                self.server = None
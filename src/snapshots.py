@@ -0,0 +1,175 @@
+from datetime import date
+from instrumentation import span
+from psycopg2.extras import Json, execute_values
+
+"""
+Point-in-time store of pitchers' season stats.
+
+Every morning, before any of the day's games are played, the season stats of every pitcher
+who has pitched this season are fetched in a single paged request and stored under the
+day's date. A snapshot for a date is therefore each pitcher's stats going into that day's
+games, which the MLB Stats API cannot give back later without a request per pitcher and
+date range. A snapshot is never overwritten, so stats fetched later in the day cannot
+replace them. Only the raw stats in SNAPSHOT_STATS are kept, so every metric can be
+recomputed for any past date from the store alone.
+"""
+
+SNAPSHOT_STATS = [
+    "gamesPlayed",
+    "gamesStarted",
+    "wins",
+    "losses",
+    "winPercentage",
+    "era",
+    "whip",
+    "inningsPitched",
+    "outs",
+    "battersFaced",
+    "atBats",
+    "hits",
+    "doubles",
+    "triples",
+    "homeRuns",
+    "runs",
+    "earnedRuns",
+    "baseOnBalls",
+    "intentionalWalks",
+    "hitByPitch",
+    "strikeOuts",
+    "strikeoutsPer9Inn",
+    "walksPer9Inn",
+    "sacFlies",
+    "sacBunts",
+    "groundOuts",
+    "airOuts",
+    "wildPitches",
+    "balks",
+    "numberOfPitches",
+    "strikes",
+    "saves",
+    "holds",
+    "blownSaves",
+]
+
+
+def ensure_snapshots(conn, table_name: str):
+    """
+    Creates the snapshot table if it does not exist
+
+    :param conn: the database connection
+    :param table_name: the name of the snapshot table
+    """
+    try:
+        with span("db_write", table=table_name, statement="ensure_snapshots"):
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    f"CREATE TABLE IF NOT EXISTS {table_name} (pitcher_id integer NOT NULL, as_of_date date NOT NULL, stats jsonb NOT NULL, PRIMARY KEY (pitcher_id, as_of_date))"
+                )
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def write_snapshot(conn, table_name: str, as_of_date: date, stats: dict) -> int:
+    """
+    Stores the stats of many pitchers going into a date, keeping any already stored for that date
+
+    :param conn: the database connection
+    :param table_name: the name of the snapshot table
+    :param as_of_date: the date the stats are going into
+    :param stats: a dict mapping each pitcher's ID to their raw season stats
+    :returns: the number of pitchers stored
+    """
+    rows = [
+        (
+            pitcher_id,
+            as_of_date,
+            Json({key: stat[key] for key in SNAPSHOT_STATS if key in stat}),
+        )
+        for pitcher_id, stat in stats.items()
+    ]
+    if not rows:
+        return 0
+
+    sql = f"INSERT INTO {table_name} (pitcher_id, as_of_date, stats) VALUES %s ON CONFLICT (pitcher_id, as_of_date) DO NOTHING"
+
+    try:
+        with span(
+            "db_write", table=table_name, statement="write_snapshot", rows=len(rows)
+        ):
+            with conn.cursor() as cursor:
+                execute_values(cursor, sql, rows, page_size=len(rows))
+                stored = cursor.rowcount
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    return stored
+
+
+def snapshot_exists(conn, table_name: str, as_of_date: date) -> bool:
+    """
+    :param conn: the database connection
+    :param table_name: the name of the snapshot table
+    :param as_of_date: the date
+    :returns: whether a snapshot has been taken for the date, whichever pitchers it holds
+    """
+    with span("db_read", table=table_name, statement="snapshot_exists"):
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"SELECT 1 FROM {table_name} WHERE as_of_date = %s LIMIT 1",
+                (as_of_date,),
+            )
+            exists = bool(cursor.fetchall())
+        conn.rollback()
+
+    return exists
+
+
+def read_stats(conn, table_name: str, pitcher_ids: list, as_of_date: date) -> dict:
+    """
+    Gets pitchers' stats as of a date, i.e. from the latest snapshot taken on or before it
+
+    :param conn: the database connection
+    :param table_name: the name of the snapshot table
+    :param pitcher_ids: the IDs of the pitchers
+    :param as_of_date: the date
+    :returns: a dict mapping the ID of every pitcher with a snapshot to a tuple of the date of the snapshot and their raw season stats
+    """
+    if not pitcher_ids:
+        return {}
+
+    with span("db_read", table=table_name, statement="read_stats"):
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"SELECT DISTINCT ON (pitcher_id) pitcher_id, as_of_date, stats FROM {table_name} WHERE pitcher_id = ANY(%s) AND as_of_date <= %s ORDER BY pitcher_id, as_of_date DESC",
+                (list(pitcher_ids), as_of_date),
+            )
+            stats = {
+                pitcher_id: (snapshot_date, stat)
+                for pitcher_id, snapshot_date, stat in cursor.fetchall()
+            }
+        conn.rollback()
+
+    return stats
+
+
+def read_stats_on(conn, table_name: str, pitcher_ids: list, as_of_date: date) -> dict:
+    """
+    Gets pitchers' stats from the snapshot of exactly a date, i.e. their stats going into that day's games
+
+    :param conn: the database connection
+    :param table_name: the name of the snapshot table
+    :param pitcher_ids: the IDs of the pitchers
+    :param as_of_date: the date
+    :returns: a dict mapping the ID of every pitcher in the snapshot to their raw season stats
+    """
+    return {
+        pitcher_id: stat
+        for pitcher_id, (snapshot_date, stat) in read_stats(
+            conn, table_name, pitcher_ids, as_of_date
+        ).items()
+        if snapshot_date == as_of_date
+    }
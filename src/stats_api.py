@@ -0,0 +1,221 @@
+import gzip
+import hashlib
+import json
+import os
+import statsapi
+import time
+
+from datetime import datetime
+from http_client import HttpClient
+
+"""
+Transport layer for all MLB Stats API traffic.
+
+Every request the pipeline makes goes through get(), which behaves according to
+MLB_API_MODE:
+ - live: always calls the API (the default)
+ - record: calls the API and saves every response to the store
+ - replay: serves responses from the store and never calls the API
+ - cache: serves responses from the store while they are fresh, otherwise calls the API and saves the response
+
+Responses are stored gzip-compressed, one file per request, keyed by endpoint and parameters.
+
+Calls to the API go through a shared http_client.HttpClient, which pools connections,
+applies timeouts, retries and rate limiting, and coalesces identical concurrent requests.
+The URLs are built from statsapi's table of endpoints.
+"""
+
+API_MODE = os.getenv("MLB_API_MODE", "live")
+API_STORE_PATH = os.getenv("MLB_API_STORE_PATH", "/tmp/mlb_api_store")
+
+# How long a cached response stays fresh in cache mode, in seconds. Season stats only
+# change once games are played, so they stay fresh until the date changes.
+ENDPOINT_TTLS = {
+    "schedule": 5 * 60,
+    "person": "game_day",
+    "stats": "game_day",
+    "sports_players": 24 * 3600,
+    "teams": 24 * 3600,
+}
+DEFAULT_TTL = 5 * 60
+
+API_POOL_SIZE = int(os.getenv("MLB_API_POOL_SIZE", "16"))
+API_CONNECT_TIMEOUT = float(os.getenv("MLB_API_CONNECT_TIMEOUT", "5"))
+API_READ_TIMEOUT = float(os.getenv("MLB_API_READ_TIMEOUT", "15"))
+API_MAX_RETRIES = int(os.getenv("MLB_API_MAX_RETRIES", "4"))
+API_BACKOFF = float(os.getenv("MLB_API_BACKOFF", "0.5"))
+API_MAX_BACKOFF = float(os.getenv("MLB_API_MAX_BACKOFF", "10"))
+API_RATE_LIMIT = float(os.getenv("MLB_API_RATE_LIMIT", "20"))
+API_BURST = int(os.getenv("MLB_API_BURST", "10"))
+
+client = HttpClient(
+    API_POOL_SIZE,
+    API_CONNECT_TIMEOUT,
+    API_READ_TIMEOUT,
+    API_MAX_RETRIES,
+    API_BACKOFF,
+    API_MAX_BACKOFF,
+    API_RATE_LIMIT,
+    API_BURST,
+)
+
+
+def request_key(endpoint: str, params: dict) -> str:
+    """
+    Gets the key a request is stored under
+
+    :param endpoint: the name of the endpoint, as used by statsapi.get
+    :param params: the parameters of the request
+    :returns: the key for the request
+    """
+    canonical = json.dumps(
+        {k: str(v) for k, v in params.items()}, sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.sha1(f"{endpoint}?{canonical}".encode()).hexdigest()
+
+
+def store_path(endpoint: str, params: dict) -> str:
+    """
+    :param endpoint: the name of the endpoint
+    :param params: the parameters of the request
+    :returns: the path of the file the request is stored in
+    """
+    return os.path.join(
+        API_STORE_PATH, endpoint, f"{request_key(endpoint, params)}.json.gz"
+    )
+
+
+def read_stored(endpoint: str, params: dict) -> dict:
+    """
+    Reads a stored response
+
+    :param endpoint: the name of the endpoint
+    :param params: the parameters of the request
+    :returns: the stored entry, with the response and when it was fetched; None if it was never stored
+    """
+    try:
+        with gzip.open(store_path(endpoint, params), "rt") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def write_stored(endpoint: str, params: dict, response: dict):
+    """
+    Stores a response
+
+    :param endpoint: the name of the endpoint
+    :param params: the parameters of the request
+    :param response: the response from the API
+    """
+    path = store_path(endpoint, params)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Write to a temporary file first so that a concurrent reader never sees half a response
+    temp_path = f"{path}.{os.getpid()}.{time.time_ns()}.tmp"
+    with gzip.open(temp_path, "wt") as file:
+        json.dump(
+            {
+                "endpoint": endpoint,
+                "params": {k: str(v) for k, v in params.items()},
+                "fetched_at": time.time(),
+                "response": response,
+            },
+            file,
+        )
+    os.replace(temp_path, path)
+
+
+def is_fresh(endpoint: str, fetched_at: float) -> bool:
+    """
+    Checks whether a stored response can still be served in cache mode
+
+    :param endpoint: the name of the endpoint
+    :param fetched_at: when the response was fetched
+    :returns: True if the response is still fresh
+    """
+    ttl = ENDPOINT_TTLS.get(endpoint, DEFAULT_TTL)
+
+    if ttl == "game_day":
+        return datetime.fromtimestamp(fetched_at).date() == datetime.now().date()
+
+    return time.time() - fetched_at < ttl
+
+
+def endpoint_url(endpoint: str, params: dict) -> tuple:
+    """
+    Builds the URL of a request the same way statsapi.get does, leaving out parameters the endpoint does not take
+
+    :param endpoint: the name of the endpoint, as used by statsapi.get
+    :param params: the parameters of the request
+    :returns: a tuple of the URL, with its path parameters filled in, and the query parameters
+    """
+    ep = statsapi.ENDPOINTS.get(endpoint)
+    if not ep:
+        raise ValueError(f"Invalid endpoint ({endpoint}).")
+
+    url = ep["url"]
+    for name, path_param in ep["path_params"].items():
+        value = params.get(name, path_param.get("default"))
+        if value is None or value == "":
+            if path_param.get("required"):
+                raise ValueError(f"Missing required path parameter {{{name}}}")
+            url = url.replace(f"{{{name}}}", "")
+            continue
+        url = url.replace(
+            f"{{{name}}}",
+            ("/" if path_param["leading_slash"] else "")
+            + str(value)
+            + ("/" if path_param["trailing_slash"] else ""),
+        )
+
+    query = {k: str(v) for k, v in params.items() if k in ep["query_params"]}
+
+    return url, query
+
+
+def fetch(endpoint: str, params: dict) -> dict:
+    """
+    Calls the MLB Stats API
+
+    :param endpoint: the name of the endpoint
+    :param params: the parameters of the request
+    :returns: the response from the API
+    """
+    url, query = endpoint_url(endpoint, params)
+
+    return client.get_json(url, query)
+
+
+def payload_size(response: dict) -> int:
+    """
+    :param response: a response from the API
+    :returns: the size of the response in bytes, as JSON
+    """
+    return len(json.dumps(response, separators=(",", ":")))
+
+
+def get(endpoint: str, params: dict) -> dict:
+    """
+    Makes a request to the MLB Stats API, according to MLB_API_MODE
+
+    :param endpoint: the name of the endpoint, as used by statsapi.get
+    :param params: the parameters of the request
+    :returns: the response
+    """
+    if API_MODE == "live":
+        return fetch(endpoint, params)
+
+    if API_MODE in ["replay", "cache"]:
+        stored = read_stored(endpoint, params)
+        if stored is not None and (
+            API_MODE == "replay" or is_fresh(endpoint, stored["fetched_at"])
+        ):
+            return stored["response"]
+        if API_MODE == "replay":
+            raise LookupError(f"No recorded response for {endpoint} {params}")
+
+    response = fetch(endpoint, params)
+    write_stored(endpoint, params, response)
+
+    return response
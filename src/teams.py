@@ -0,0 +1,108 @@
+import os
+import stats_api
+import threading
+import time
+
+from instrumentation import span
+
+"""
+In-memory index of MLB teams.
+
+All teams are fetched once per process (and again once the index expires), after which
+name to ID and ID to name lookups never touch the network.
+"""
+
+TEAM_INDEX_TTL = float(os.getenv("MLB_TEAM_INDEX_TTL_HOURS", "24")) * 3600
+TEAM_ALIAS_FIELDS = [
+    "name",
+    "teamName",
+    "shortName",
+    "clubName",
+    "franchiseName",
+    "abbreviation",
+    "teamCode",
+    "fileCode",
+]
+
+team_index = None
+team_index_lock = threading.Lock()
+
+
+def build_team_index(teams: list) -> dict:
+    """
+    Builds the lookup tables for a list of teams
+
+    Aliases that are shared by more than one team (e.g. "Sox") are left out so that a lookup never returns the wrong team.
+
+    :param teams: the teams as returned by the teams endpoint
+    :returns: a dict with "names" mapping ID to name, "ids" mapping lowercase name or alias to ID, and "loaded_at"
+    """
+    names = {}
+    ids = {}
+    ambiguous = set()
+
+    for team in teams:
+        names[team["id"]] = team["name"]
+        for field in TEAM_ALIAS_FIELDS:
+            alias = str(team.get(field) or "").lower()
+            if not alias:
+                continue
+            if alias in ids and ids[alias] != team["id"]:
+                ambiguous.add(alias)
+            ids[alias] = team["id"]
+
+    for alias in ambiguous:
+        del ids[alias]
+
+    return {"names": names, "ids": ids, "loaded_at": time.time()}
+
+
+def load_team_index() -> dict:
+    """
+    Gets the team index, fetching it if it has not been loaded yet or has expired
+
+    :returns: the team index
+    """
+    global team_index
+
+    with team_index_lock:
+        if team_index is None or time.time() - team_index["loaded_at"] > TEAM_INDEX_TTL:
+            with span("team_fetch") as s:
+                r = stats_api.get(
+                    "teams",
+                    {
+                        "sportIds": 1,
+                        "activeStatus": "Y",
+                        "fields": "teams,id,name,teamName,shortName,clubName,franchiseName,abbreviation,teamCode,fileCode",
+                    },
+                )
+                s["bytes"] = stats_api.payload_size(r)
+            team_index = build_team_index(r["teams"])
+
+    return team_index
+
+
+def lookup_team_id(name: str) -> int:
+    """
+    Gets the ID of a team from its name or one of its aliases
+
+    :param name: the name of the team, e.g. "New York Yankees", "Yankees" or "NYY"
+    :returns: the ID of the team; None if no team matches
+    """
+    if not name:
+        return None
+
+    return load_team_index()["ids"].get(str(name).lower())
+
+
+def lookup_team_name(team_id: int) -> str:
+    """
+    Gets the name of a team from its ID
+
+    :param team_id: the ID of the team
+    :returns: the name of the team; None if no team matches
+    """
+    if team_id is None:
+        return None
+
+    return load_team_index()["names"].get(int(team_id))
@@ -0,0 +1,118 @@
+import pytest
+
+from database import GAME_COLUMNS, count_outcomes, upsert_games
+
+
+class FakeCursor:
+    """
+    A cursor that records each statement and returns the rows it is given
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, sql, params=None):
+        if self.connection.error:
+            raise self.connection.error
+        self.connection.statements.append(sql.decode())
+
+    def fetchall(self):
+        return self.connection.returned
+
+    def mogrify(self, template, args):
+        return repr(tuple(args)).encode()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class FakeConnection:
+    """
+    A connection whose upserts return the given (game ID, inserted) rows
+    """
+
+    encoding = "UTF8"
+
+    def __init__(self, returned=(), error=None):
+        self.returned = list(returned)
+        self.error = error
+        self.statements = []
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+def game_row(game_id: int) -> tuple:
+    return (game_id, *[None] * (len(GAME_COLUMNS) - 1))
+
+
+def test_upsert_reports_inserted_updated_and_skipped_games():
+    # Postgres returns only the rows it wrote; xmax is 0 for a new row version
+    conn = FakeConnection(returned=[(1, True), (2, False)])
+
+    outcomes = upsert_games(conn, "games", [game_row(1), game_row(2), game_row(3)])
+
+    assert outcomes == {1: "inserted", 2: "updated", 3: "skipped"}
+    assert count_outcomes(outcomes) == {"inserted": 1, "updated": 1, "skipped": 1}
+    assert conn.commits == 1
+
+
+def test_upsert_is_a_single_statement_that_skips_unchanged_rows():
+    conn = FakeConnection()
+
+    upsert_games(conn, "games", [game_row(1), game_row(2)])
+
+    (sql,) = conn.statements
+    assert "ON CONFLICT (game_id, season) DO UPDATE" in sql
+    assert "games.home_pitcher IS DISTINCT FROM EXCLUDED.home_pitcher" in sql
+    assert "season = EXCLUDED.season" not in sql
+    assert sql.endswith("RETURNING game_id, (xmax = 0) AS inserted")
+
+
+def test_upsert_writes_the_last_row_of_a_repeated_game():
+    conn = FakeConnection(returned=[(1, True)])
+    first = game_row(1)
+    last = (1, 147, *first[2:])
+
+    outcomes = upsert_games(conn, "games", [first, last])
+
+    assert outcomes == {1: "inserted"}
+    assert "(1, 147," in conn.statements[0]
+    assert "(1, None," not in conn.statements[0]
+
+
+def test_upsert_without_rows_writes_nothing():
+    conn = FakeConnection()
+
+    assert upsert_games(conn, "games", []) == {}
+    assert conn.statements == []
+    assert conn.commits == 0
+
+
+def test_upsert_leaves_the_commit_to_the_caller():
+    conn = FakeConnection(returned=[(1, True)])
+
+    upsert_games(conn, "games", [game_row(1)], commit=False)
+
+    assert conn.commits == 0
+
+
+def test_upsert_rolls_back_on_error():
+    conn = FakeConnection(error=RuntimeError("connection lost"))
+
+    with pytest.raises(RuntimeError):
+        upsert_games(conn, "games", [game_row(1)])
+
+    assert conn.rollbacks == 1
+    assert conn.commits == 0
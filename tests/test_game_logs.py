@@ -0,0 +1,138 @@
+import numpy as np
+import pytest
+
+from database import GAME_COLUMNS
+from datetime import date
+from game_logs import FORM_COLUMNS, FORM_METRICS, LOG_STATS, GameLogs, metrics
+from pitchers import PitcherStatLine
+
+STAT = {column: index for index, column in enumerate(LOG_STATS.values())}
+
+
+def line(
+    pitcher_id: int, game_id: int, day: int, started: bool = True, **counts
+) -> tuple:
+    """
+    :returns: a game log row, with every counting stat not given as 0
+    """
+    return (
+        pitcher_id,
+        game_id,
+        date(2024, 5, day),
+        started,
+        *(counts.get(column, 0) for column in LOG_STATS.values()),
+    )
+
+
+# Pitcher 1 has four starts, given out of order, and a more recent relief appearance; pitcher 2 has one start
+ROWS = [
+    line(1, 102, 10, earned_runs=2, outs=18),
+    line(1, 104, 20, earned_runs=4, outs=15),
+    line(1, 101, 5, earned_runs=8, outs=9),
+    line(1, 103, 15, earned_runs=1, outs=21),
+    line(1, 105, 22, started=False, earned_runs=3, outs=3),
+    line(2, 103, 15, earned_runs=0, outs=27),
+]
+
+
+def test_last_starts_sums_each_pitchers_most_recent_starts():
+    totals = GameLogs(ROWS).totals([1, 2], last_starts=3)
+
+    assert totals[0, STAT["earned_runs"]] == 2 + 4 + 1
+    assert totals[0, STAT["outs"]] == 18 + 15 + 21
+    assert totals[1, STAT["outs"]] == 27
+
+
+def test_a_window_longer_than_the_season_sums_every_start():
+    totals = GameLogs(ROWS).totals([1], last_starts=5)
+
+    assert totals[0, STAT["earned_runs"]] == 8 + 2 + 1 + 4
+
+
+def test_without_a_window_every_line_is_summed():
+    totals = GameLogs(ROWS).totals([1])
+
+    assert totals[0, STAT["earned_runs"]] == 8 + 2 + 1 + 4 + 3
+
+
+def test_totals_follow_the_order_of_the_pitchers_asked_for():
+    totals = GameLogs(ROWS).totals([2, 3, 1, 2], last_starts=1)
+
+    assert list(totals[:, STAT["outs"]]) == [27, 0, 15, 27]
+
+
+def test_no_lines_gives_zero_totals():
+    totals = GameLogs([]).totals([1, 2], last_starts=3)
+
+    assert totals.shape == (2, len(LOG_STATS))
+    assert not totals.any()
+
+
+def test_metrics_match_the_season_stat_line():
+    counts = {
+        "outs": 544,
+        "batters_faced": 742,
+        "at_bats": 667,
+        "hits": 152,
+        "home_runs": 21,
+        "base_on_balls": 61,
+        "strike_outs": 190,
+        "sac_flies": 5,
+        "earned_runs": 72,
+    }
+    innings = counts["outs"] / 3
+    stat_line = PitcherStatLine(
+        "A Pitcher",
+        1,
+        {
+            "era": f"{9 * counts['earned_runs'] / innings:.2f}",
+            "whip": f"{(counts['base_on_balls'] + counts['hits']) / innings:.2f}",
+            "strikeoutsPer9Inn": f"{9 * counts['strike_outs'] / innings:.2f}",
+            "walksPer9Inn": f"{9 * counts['base_on_balls'] / innings:.2f}",
+            "battersFaced": counts["batters_faced"],
+            "atBats": counts["at_bats"],
+            "hits": counts["hits"],
+            "homeRuns": counts["home_runs"],
+            "baseOnBalls": counts["base_on_balls"],
+            "strikeOuts": counts["strike_outs"],
+            "sacFlies": counts["sac_flies"],
+        },
+    )
+    totals = np.array([[counts[column] for column in LOG_STATS.values()]], float)
+
+    computed = metrics(totals)
+
+    assert set(computed) == set(FORM_METRICS)
+    # The stat line's ERA, WHIP, K/9 and BB/9 are rounded to two places by the API
+    assert computed["era"][0] == pytest.approx(float(stat_line.era()), abs=0.005)
+    assert computed["whip"][0] == pytest.approx(stat_line.whip(), abs=0.005)
+    assert computed["k_nine"][0] == pytest.approx(stat_line.k_nine(), abs=0.005)
+    assert computed["bb_nine"][0] == pytest.approx(stat_line.bb_nine(), abs=0.005)
+    assert computed["k_bb_diff"][0] == pytest.approx(stat_line.k_bb_diff())
+    assert computed["babip"][0] == pytest.approx(stat_line.babip())
+
+
+def test_metrics_are_nan_when_undefined():
+    computed = metrics(np.zeros((1, len(LOG_STATS))))
+
+    assert all(np.isnan(values[0]) for values in computed.values())
+
+
+def test_form_records_have_every_form_column_and_none_without_starts():
+    record = [None] * len(GAME_COLUMNS)
+    record[GAME_COLUMNS.index("game_id")] = 200
+    record[GAME_COLUMNS.index("home_pitcher_id")] = 1
+    record[GAME_COLUMNS.index("away_pitcher_id")] = 3
+
+    (form,) = GameLogs(ROWS).form_records([tuple(record)])
+    values = dict(zip(FORM_COLUMNS, form[1:]))
+
+    assert form[0] == 200
+    assert len(form) == 1 + len(FORM_COLUMNS)
+    assert values["home_pitcher_last3_era"] == pytest.approx(27 * 7 / 54)
+    assert values["home_pitcher_last5_era"] == pytest.approx(27 * 15 / 63)
+    assert all(
+        value is None
+        for column, value in values.items()
+        if column.startswith("away_pitcher_")
+    )
@@ -0,0 +1,233 @@
+import http_client
+import pytest
+import requests
+import threading
+
+from http_client import HttpClient, TokenBucket, parse_retry_after
+
+
+class FakeClock:
+    """
+    A monotonic clock that only moves when something sleeps
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, body=None, headers=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers or {}
+        self.reason = "Reason"
+        self.url = "https://api.example/test"
+
+    def json(self):
+        return self.body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code}", response=self)
+
+
+class FakeSession:
+    """
+    A session that returns, or raises, each of the given outcomes in turn
+    """
+
+    def __init__(self, outcomes: list):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def get(self, url, params=None, timeout=None):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(http_client.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(http_client.time, "sleep", clock.sleep)
+    return clock
+
+
+def client(outcomes: list, max_retries: int = 3) -> HttpClient:
+    client = HttpClient(
+        pool_size=4,
+        connect_timeout=1,
+        read_timeout=1,
+        max_retries=max_retries,
+        backoff=0.5,
+        max_backoff=4,
+        rate=0,
+        burst=1,
+    )
+    client.session = FakeSession(outcomes)
+    return client
+
+
+def test_token_bucket_allows_a_burst_then_waits_for_each_token(clock):
+    bucket = TokenBucket(rate=10, capacity=2)
+
+    assert bucket.acquire() == 0.0
+    assert bucket.acquire() == 0.0
+    assert bucket.acquire() == pytest.approx(0.1)
+    assert clock.now == pytest.approx(0.1)
+
+
+def test_token_bucket_refills_up_to_its_capacity(clock):
+    bucket = TokenBucket(rate=10, capacity=2)
+    bucket.acquire()
+    bucket.acquire()
+
+    clock.now += 60
+
+    assert bucket.acquire() == 0.0
+    assert bucket.acquire() == 0.0
+    assert bucket.acquire() == pytest.approx(0.1)
+
+
+def test_token_bucket_without_a_rate_never_waits(clock):
+    bucket = TokenBucket(rate=0, capacity=1)
+
+    assert all(bucket.acquire() == 0.0 for _ in range(100))
+    assert clock.sleeps == []
+
+
+def test_retry_after_is_honoured(clock):
+    http = client(
+        [
+            FakeResponse(503, headers={"Retry-After": "3"}),
+            FakeResponse(200, {"ok": True}),
+        ]
+    )
+
+    assert http.request("https://api.example/test") == {"ok": True}
+    assert clock.sleeps == [3.0]
+
+
+def test_retry_after_is_capped_at_the_longest_backoff(clock):
+    http = client(
+        [FakeResponse(429, headers={"Retry-After": "120"}), FakeResponse(200, {})]
+    )
+
+    http.request("https://api.example/test")
+
+    assert clock.sleeps == [4]
+
+
+def test_backoff_doubles_with_full_jitter_up_to_the_longest_backoff(clock, monkeypatch):
+    bounds = []
+    monkeypatch.setattr(
+        http_client.random,
+        "uniform",
+        lambda low, high: bounds.append((low, high)) or high,
+    )
+    http = client(
+        [
+            requests.ConnectionError(),
+            requests.Timeout(),
+            FakeResponse(500),
+            requests.ConnectionError(),
+            FakeResponse(200, {}),
+        ],
+        max_retries=4,
+    )
+
+    http.request("https://api.example/test")
+
+    assert bounds == [(0, 0.5), (0, 1.0), (0, 2.0), (0, 4)]
+    assert clock.sleeps == [0.5, 1.0, 2.0, 4]
+
+
+def test_the_last_error_is_raised_once_the_retries_run_out(clock):
+    http = client([FakeResponse(502)] * 3, max_retries=2)
+
+    with pytest.raises(requests.HTTPError) as error:
+        http.request("https://api.example/test")
+
+    assert error.value.response.status_code == 502
+    assert http.session.calls == 3
+
+
+def test_client_errors_are_not_retried(clock):
+    http = client([FakeResponse(404)])
+
+    with pytest.raises(requests.HTTPError):
+        http.request("https://api.example/test")
+
+    assert http.session.calls == 1
+    assert clock.sleeps == []
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("2") == 2.0
+    assert parse_retry_after("-1") == 0.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") is None
+
+
+def test_identical_requests_in_flight_are_coalesced(monkeypatch):
+    started = threading.Event()
+    release = threading.Event()
+    waiting = threading.Event()
+
+    class BlockingSession(FakeSession):
+        def get(self, url, params=None, timeout=None):
+            started.set()
+            release.wait(5)
+            return super().get(url, params, timeout)
+
+    class WatchedFuture(http_client.Future):
+        def result(self, timeout=None):
+            waiting.set()
+            return super().result(timeout)
+
+    monkeypatch.setattr(http_client, "Future", WatchedFuture)
+    http = client([])
+    http.session = BlockingSession([FakeResponse(200, {"games": []})])
+    responses = []
+
+    def get():
+        responses.append(
+            http.get_json("https://api.example/test", {"date": "2024-04-01"})
+        )
+
+    owner = threading.Thread(target=get)
+    owner.start()
+    assert started.wait(5)
+    waiter = threading.Thread(target=get)
+    waiter.start()
+    assert waiting.wait(5)
+    release.set()
+    owner.join(5)
+    waiter.join(5)
+
+    assert http.session.calls == 1
+    assert len(responses) == 2
+    assert responses[0] is responses[1]
+    assert http.in_flight == {}
+
+
+def test_a_failed_request_is_not_left_in_flight():
+    http = client([FakeResponse(404), FakeResponse(200, {})], max_retries=0)
+
+    with pytest.raises(requests.HTTPError):
+        http.get_json("https://api.example/test")
+
+    # Nothing is left in flight, so the next identical request is made again
+    assert http.get_json("https://api.example/test") == {}
+    assert http.session.calls == 2
@@ -0,0 +1,35 @@
+from ledger import DONE, FAILED, PENDING, STAGE_ROW, done, remaining
+
+
+def test_remaining_keeps_every_game_that_is_not_done_in_order():
+    statuses = {3: DONE, 1: FAILED, 2: PENDING}
+
+    assert remaining(statuses, [1, 2, 3, 4]) == [1, 2, 4]
+
+
+def test_remaining_on_a_first_run_is_every_game():
+    assert remaining({}, [5, 4, 6]) == [5, 4, 6]
+
+
+def test_remaining_after_a_complete_run_is_nothing():
+    statuses = {STAGE_ROW: DONE, 1: DONE, 2: DONE}
+
+    assert remaining(statuses, [1, 2]) == []
+
+
+def test_remaining_ignores_games_no_longer_on_the_schedule():
+    statuses = {1: DONE, 9: PENDING}
+
+    assert remaining(statuses, [1, 2]) == [2]
+
+
+def test_done_is_only_the_games_that_are_done():
+    statuses = {1: DONE, 2: FAILED, 3: PENDING, 4: DONE}
+
+    assert sorted(done(statuses)) == [1, 4]
+
+
+def test_done_leaves_out_the_stage_row():
+    statuses = {STAGE_ROW: DONE, 1: DONE}
+
+    assert done(statuses) == [1]